@@ -0,0 +1,36 @@
+import sys
+import numpy as np
+from src.services.local_vector_index import LocalVectorIndex
+from src.services.ann_index import IVFFlatIndex, recall_latency_report
+from src.config.settings import LOCAL_INDEX_DIR, EMBEDDING_DIMENSION
+
+def main():
+    """ローカルインデックスのチャンクで近似最近傍探索の再現率と検索時間を測定"""
+    namespace = sys.argv[1] if len(sys.argv) > 1 else ""
+    top_k = 10
+    query_count = 100
+    
+    print(f"ローカルインデックス '{LOCAL_INDEX_DIR}' を読み込み中...")
+    index = LocalVectorIndex(LOCAL_INDEX_DIR, EMBEDDING_DIMENSION)
+    ns = index._namespace(namespace)
+    if ns is None or ns.size == 0:
+        print(f"namespace '{namespace or 'default'}' にベクトルがありません")
+        return
+    
+    vectors = ns.vectors
+    print(f"ベクトル数: {len(vectors)}")
+    
+    # 登録済みのチャンク自身をクエリとして使用
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(query_count, len(vectors)), replace=False)]
+    
+    print("IVFインデックスを学習中...")
+    ivf = IVFFlatIndex.train(vectors)
+    print(f"リスト数: {ivf.n_lists}")
+    
+    print(f"\n{'nprobe':>8} {'recall@' + str(top_k):>10} {'ms/query':>10}")
+    for row in recall_latency_report(vectors, queries, top_k=top_k, index=ivf):
+        print(f"{row['nprobe']:>8} {row['recall']:>10.4f} {row['ms_per_query']:>10.4f}")
+
+if __name__ == "__main__":
+    main()
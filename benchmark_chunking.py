@@ -0,0 +1,77 @@
+import sys
+import os
+import csv
+import time
+from janome.tokenizer import Tokenizer
+from src.utils.text_processing import JapaneseTextProcessor, SENTENCE_TERMINATORS, split_sentences_fast
+
+def load_documents(paths):
+    """ベンチマークに使う文書を読み込む（ディレクトリの場合は配下の.txtファイル）"""
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if filename.endswith(".txt"):
+                        with open(os.path.join(root, filename), encoding="utf-8", errors="replace") as f:
+                            documents.append(f.read())
+        else:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                documents.append(f.read())
+    if not documents:
+        # 文書が指定されない場合はチャット履歴の回答文を使う
+        with open("chat_history_20250428_065306.csv", encoding="utf-8") as f:
+            answers = [row["content"] for row in csv.DictReader(f) if row["role"] == "assistant"]
+        documents = ["\n".join(answers)] * 20
+    return documents
+
+def janome_split(tokenizer, text):
+    """従来の形態素解析による文分割"""
+    sentences = []
+    current_sentence = []
+    for token in tokenizer.tokenize(text):
+        current_sentence.append(token.surface)
+        if token.surface in SENTENCE_TERMINATORS:
+            sentences.append("".join(current_sentence))
+            current_sentence = []
+    if current_sentence:
+        sentences.append("".join(current_sentence))
+    return sentences
+
+def measure(label, documents, megabytes, func):
+    """文書をすべて処理する時間を測定してMB/sを表示"""
+    start = time.perf_counter()
+    for document in documents:
+        func(document)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:>8.3f}秒 {megabytes / elapsed:>8.3f} MB/s")
+
+def main():
+    """チャンク分割のスループット（MB/s）を測定"""
+    documents = load_documents(sys.argv[1:])
+    megabytes = sum(len(document.encode("utf-8")) for document in documents) / 1024 / 1024
+    print(f"文書数: {len(documents)}, 合計: {megabytes:.2f} MB")
+
+    # 高速な分割が使える文書の割合と、従来の分割との一致を確認
+    shared_tokenizer = Tokenizer()
+    fast_count = 0
+    mismatches = 0
+    for document in documents:
+        sentences = split_sentences_fast(document)
+        if sentences is not None:
+            fast_count += 1
+            if sentences != janome_split(shared_tokenizer, document):
+                mismatches += 1
+    print(f"正規表現で分割できた文書: {fast_count}/{len(documents)}, 従来の分割との不一致: {mismatches}件\n")
+
+    measure("文分割（文書ごとにTokenizerを作成）", documents, megabytes,
+            lambda document: janome_split(Tokenizer(), document))
+    measure("文分割（共有Tokenizer）", documents, megabytes,
+            lambda document: janome_split(shared_tokenizer, document))
+    processor = JapaneseTextProcessor()
+    measure("文分割（正規表現の高速パス）", documents, megabytes, processor.split_into_sentences)
+    measure("チャンク分割（process_text_file）", documents, megabytes,
+            lambda document: processor.process_text_file(document, "benchmark.txt"))
+
+if __name__ == "__main__":
+    main()
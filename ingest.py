@@ -0,0 +1,229 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from src.config.settings import INGEST_JOURNAL_PATH, DEAD_LETTER_REPLAY_LIMIT
+
+# ファイルの種類ごとの必須メタデータ（ファイルアップロード画面と同じ）
+REQUIRED_METADATA = {
+    ".txt": ["main_category", "sub_category", "city"],
+    ".csv": ["city"]
+}
+
+def load_sidecar(path):
+    """メタデータのサイドカーファイルを読み込む
+
+    形式: {"defaults": {...}, "files": {"相対パス または ディレクトリ/": {...}}}
+    ファイルのメタデータは defaults、上位のディレクトリ、ファイル自身の順に上書きする。
+    """
+    if not os.path.exists(path):
+        return {"defaults": {}, "files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    return {"defaults": sidecar.get("defaults", {}), "files": sidecar.get("files", {})}
+
+def resolve_metadata(sidecar, relative_path):
+    """ファイルのメタデータをサイドカーから求める"""
+    metadata = dict(sidecar["defaults"])
+    prefixes = sorted(
+        (key for key in sidecar["files"] if key.endswith("/") and relative_path.startswith(key)),
+        key=len
+    )
+    for prefix in prefixes:
+        metadata.update(sidecar["files"][prefix])
+    metadata.update(sidecar["files"].get(relative_path, {}))
+    return metadata
+
+def find_files(directory):
+    """ディレクトリ配下の.txtと.csvファイルを相対パス順に列挙"""
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in REQUIRED_METADATA:
+                path = os.path.join(root, filename)
+                files.append((path, os.path.relpath(path, directory).replace(os.sep, "/")))
+    return files
+
+def file_digest(path):
+    """ファイル内容のハッシュ（チェックポイントの判定に使用）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def parse_file(path, relative_path, metadata, upload_date):
+    """ファイルを読み込んでチャンクに分割（ワーカープロセスで実行）"""
+    from src.utils.text_processing import iter_file_chunks
+    from src.utils.facility_csv import iter_facility_chunks
+
+    start = time.perf_counter()
+    if relative_path.lower().endswith(".csv"):
+        with open(path, "rb") as f:
+            chunks = list(iter_facility_chunks(f.read(), relative_path))
+        for chunk in chunks:
+            chunk["metadata"]["city"] = metadata["city"]
+    else:
+        with open(path, "rb") as f:
+            chunks = list(iter_file_chunks(f, relative_path))
+        for chunk in chunks:
+            chunk["metadata"].update({
+                "main_category": metadata["main_category"],
+                "sub_category": metadata["sub_category"],
+                "city": metadata["city"],
+                "created_date": metadata.get("created_date"),
+                "upload_date": upload_date,
+                "source": metadata.get("source")
+            })
+            chunk["filename"] = relative_path
+            chunk["chunk_id"] = chunk["id"]
+    return chunks, time.perf_counter() - start
+
+class Journal:
+    """処理済みのファイルを1行ずつ記録するチェックポイント（JSON Lines）"""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = {}
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断時に書きかけになった行は無視する
+                        continue
+                    self.done[(entry["namespace"], entry["path"])] = entry["sha256"]
+
+    def is_done(self, namespace, path, sha256):
+        return self.done.get((namespace, path)) == sha256
+
+    def record(self, namespace, path, sha256, result):
+        """ファイルの処理完了を記録（1行ずつ追記してすぐに書き出す）"""
+        entry = {
+            "namespace": namespace,
+            "path": path,
+            "sha256": sha256,
+            "chunks": result["changed_chunks"] + result["unchanged_chunks"],
+            "failed_chunks": result["failed_chunks"],
+            "completed_at": datetime.now().isoformat()
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done[(namespace, path)] = sha256
+
+def main():
+    """ディレクトリ配下のテキスト・施設CSVファイルを一括でアップロード"""
+    parser = argparse.ArgumentParser(description="ディレクトリ配下の.txt/.csvファイルを一括でアップロードします")
+    parser.add_argument("directory", nargs="?", help="アップロードするファイルのディレクトリ")
+    parser.add_argument("--metadata", help="メタデータのサイドカーファイル（既定: <directory>/metadata.json）")
+    parser.add_argument("--namespace", default="", help="アップロード先のnamespace")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ファイルの読み込み・分割を行うプロセス数")
+    parser.add_argument("--journal", default=INGEST_JOURNAL_PATH, help="チェックポイントのファイル")
+    parser.add_argument("--restart", action="store_true", help="チェックポイントを破棄して最初から処理する")
+    parser.add_argument("--replay", action="store_true", help="アップロードに失敗したチャンク（デッドレター）を再送する")
+    parser.add_argument("--limit", type=int, default=DEAD_LETTER_REPLAY_LIMIT, help="再送するチャンク数の上限")
+    args = parser.parse_args()
+
+    from src.services.pinecone_service import PineconeService
+
+    if args.replay:
+        result = PineconeService().replay_dead_letters(limit=args.limit)
+        sys.exit(1 if result["failed_chunks"] else 0)
+    if not args.directory:
+        parser.error("ディレクトリを指定してください")
+
+    sidecar = load_sidecar(args.metadata or os.path.join(args.directory, "metadata.json"))
+    journal = Journal(args.journal, restart=args.restart)
+    namespace = args.namespace or None
+    upload_date = datetime.now().isoformat()
+
+    pending = []
+    skipped = []
+    resumed = 0
+    for path, relative_path in find_files(args.directory):
+        metadata = resolve_metadata(sidecar, relative_path)
+        missing = [key for key in REQUIRED_METADATA[os.path.splitext(path)[1].lower()] if not metadata.get(key)]
+        if missing:
+            skipped.append((relative_path, f"メタデータがありません: {', '.join(missing)}"))
+            continue
+        sha256 = file_digest(path)
+        if journal.is_done(args.namespace, relative_path, sha256):
+            resumed += 1
+            continue
+        pending.append((path, relative_path, metadata, sha256))
+
+    print(f"対象ファイル: {len(pending)}件（処理済みのためスキップ: {resumed}件, メタデータ不足: {len(skipped)}件）")
+    if not pending:
+        return
+
+    service = PineconeService()
+    start = time.perf_counter()
+    totals = {"files": 0, "chunks": 0, "changed": 0, "deleted": 0, "failed": 0, "tokens": 0, "parse_seconds": 0.0}
+
+    # 読み込み・分割はプロセスプールで先行させ、アップロードはファイルの順に行う
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        files = iter(pending)
+        in_flight = deque()
+
+        def submit_next():
+            for path, relative_path, metadata, sha256 in files:
+                in_flight.append((relative_path, sha256, executor.submit(parse_file, path, relative_path, metadata, upload_date)))
+                return
+
+        for _ in range(args.workers * 2):
+            submit_next()
+
+        while in_flight:
+            relative_path, sha256, future = in_flight.popleft()
+            submit_next()
+            try:
+                chunks, parse_seconds = future.result()
+                print(f"\n{relative_path}: {len(chunks)}個のチャンク")
+                result = service.sync_file(
+                    relative_path,
+                    chunks,
+                    namespace=namespace,
+                    id_prefix=None if relative_path.lower().endswith(".csv") else f"{relative_path}_chunk_"
+                )
+            except Exception as e:
+                skipped.append((relative_path, str(e)))
+                print(f"{relative_path} の処理に失敗しました: {str(e)}")
+                continue
+
+            journal.record(args.namespace, relative_path, sha256, result)
+            totals["files"] += 1
+            totals["chunks"] += len(chunks)
+            totals["changed"] += result["changed_chunks"]
+            totals["deleted"] += result["deleted_chunks"]
+            totals["failed"] += result["failed_chunks"]
+            totals["tokens"] += result["embedded_tokens"]
+            totals["parse_seconds"] += parse_seconds
+
+    elapsed = time.perf_counter() - start
+    print("\n===== 取り込み結果 =====")
+    print(f"処理時間: {elapsed:.1f}秒（読み込み・分割の合計 {totals['parse_seconds']:.1f}秒）")
+    print(f"ファイル: {totals['files']}件, {totals['files'] / elapsed:.2f}件/秒")
+    print(f"チャンク: {totals['chunks']}件, {totals['chunks'] / elapsed:.1f}件/秒"
+          f"（新規・変更 {totals['changed']}件, 削除 {totals['deleted']}件, 失敗 {totals['failed']}件）")
+    print(f"埋め込みトークン: {totals['tokens']}, {totals['tokens'] / elapsed:.0f}トークン/秒")
+    if totals["failed"]:
+        print("失敗したチャンクは記録されています。`python ingest.py --replay` で再送できます")
+    if skipped:
+        print(f"\n処理できなかったファイル: {len(skipped)}件")
+        for relative_path, reason in skipped:
+            print(f"  {relative_path}: {reason}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
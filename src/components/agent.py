@@ -4,6 +4,7 @@ from src.services.question_classifier import QuestionClassifier
 from src.services.response_templates import ResponseTemplates
 from src.services.metadata_processor import MetadataProcessor
 from src.utils.error_handler import ErrorHandler, ErrorType
+from src.config.settings import QUESTION_TYPE_FILTERS
 
 def render_agent(pinecone_service: PineconeService):
     st.title("Agent Mode")
@@ -38,7 +39,10 @@ def render_agent(pinecone_service: PineconeService):
                 
                 # Pineconeから関連情報を検索
                 st.write("3. 関連情報の検索")
-                search_results = pinecone_service.query(user_input, top_k=3)
+                search_filter = QUESTION_TYPE_FILTERS.get(question_type)
+                if search_filter:
+                    st.write(f"- 検索フィルタ: {search_filter}")
+                search_results = pinecone_service.query(user_input, top_k=3, filter=search_filter)
                 
                 if search_results["matches"]:
                     # メタデータの抽出と検証
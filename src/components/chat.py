@@ -5,6 +5,7 @@ import io
 from datetime import datetime
 from src.services.pinecone_service import PineconeService
 from src.services.langchain_service import LangChainService
+from src.services.property_catalog import get_property_catalog
 from src.config.settings import (
     load_prompt_templates
 )
@@ -57,32 +58,9 @@ def load_chat_history(file):
     return messages
 
 def get_property_list(pinecone_service: PineconeService) -> list:
-    """物件情報の一覧を取得"""
+    """物件情報の一覧を取得（プロセス内の物件カタログから）"""
     try:
-        # Pineconeから物件情報の一覧を取得
-        results = pinecone_service.list_vectors(namespace="property")
-        
-        if not results:
-            return []
-            
-        properties = []
-        for match in results:
-            # テキストから物件情報を抽出
-            text = match.metadata["text"]
-            lines = text.split('\n')
-            
-            # 物件名と場所を抽出（最初の2行を想定）
-            name = lines[0].strip() if len(lines) > 0 else "不明"
-            location = lines[1].strip() if len(lines) > 1 else "不明"
-            
-            properties.append({
-                "id": match.id,
-                "name": name,
-                "location": location,
-                "text": text
-            })
-            
-        return properties
+        return get_property_catalog().get_properties(pinecone_service)
     except Exception as e:
         st.error(f"物件情報の取得中にエラーが発生しました: {str(e)}")
         return []
@@ -90,17 +68,29 @@ def get_property_list(pinecone_service: PineconeService) -> list:
 def get_property_info(property_id: str, pinecone_service: PineconeService) -> str:
     """選択された物件の詳細情報を取得"""
     try:
-        # Pineconeから物件情報を取得
-        result = pinecone_service.get_by_id(property_id, namespace="property")
+        # 物件カタログから物件情報を取得
+        result = get_property_catalog().get_property(property_id, pinecone_service)
         
         if not result:
             return "物件情報が見つかりませんでした。"
             
         # テキストを取得
-        return result.get("text", "物件情報が見つかりませんでした。")
+        return result.get("text") or "物件情報が見つかりませんでした。"
     except Exception as e:
         return f"物件情報の取得中にエラーが発生しました: {str(e)}"
 
+def get_search_filter(property_id: str, pinecone_service: PineconeService) -> dict:
+    """選択された物件の市区町村から検索用のメタデータフィルタを作成
+
+    市区町村が空・未設定の既存のベクトル（市区町村の入力が必須になる前の施設CSVなど）も含める。
+    """
+    try:
+        result = get_property_catalog().get_property(property_id, pinecone_service)
+    except Exception:
+        return None
+    city = result.get("metadata", {}).get("city") if result else None
+    return {"$or": [{"city": {"$in": [city, ""]}}, {"city": {"$exists": False}}]} if city else None
+
 def render_chat(pinecone_service: PineconeService):
     """チャット機能のUIを表示"""
     st.title("チャット")
@@ -112,7 +102,7 @@ def render_chat(pinecone_service: PineconeService):
 
     # LangChainサービスの初期化
     if "langchain_service" not in st.session_state:
-        st.session_state.langchain_service = LangChainService()
+        st.session_state.langchain_service = LangChainService(pinecone_service)
     
     # プロンプトテンプレートの読み込み（毎回最新の状態を取得）
     prompt_templates, _, _ = load_prompt_templates()
@@ -143,6 +133,7 @@ def render_chat(pinecone_service: PineconeService):
         # 物件情報の選択
         st.header("物件情報")
         properties = get_property_list(pinecone_service)
+        selected_property_id = None
         
         if properties:
             # 物件の選択肢を作成（物件名と場所を表示）
@@ -159,12 +150,16 @@ def render_chat(pinecone_service: PineconeService):
             # 選択された物件の詳細情報を取得
             st.session_state.property_info = get_property_info(selected_property_id, pinecone_service)
             
+            # 物件の市区町村で検索対象を絞り込む
+            st.session_state.search_filter = get_search_filter(selected_property_id, pinecone_service)
+            
             # 物件の詳細情報を表示
             with st.expander("選択中の物件情報"):
                 st.markdown(st.session_state.property_info)
         else:
             st.warning("物件情報が登録されていません。")
             st.session_state.property_info = "物件情報が登録されていません。"
+            st.session_state.search_filter = None
         
         # 履歴の保存 (ローカルダウンロード)
         st.write(f"現在のメッセージ数: {len(st.session_state.messages)}")
@@ -190,13 +185,8 @@ def render_chat(pinecone_service: PineconeService):
                 # セッション状態を更新
                 st.session_state.messages = loaded_messages.copy()
                 
-                # LangChainの会話履歴を更新
-                st.session_state.langchain_service.clear_memory()
-                for message in loaded_messages:
-                    if message["role"] == "user":
-                        st.session_state.langchain_service.message_history.add_user_message(message["content"])
-                    elif message["role"] == "assistant":
-                        st.session_state.langchain_service.message_history.add_ai_message(message["content"])
+                # LangChainの会話履歴を更新（古い往復は要約にまとめる）
+                st.session_state.langchain_service.load_history(loaded_messages)
                 
                 st.session_state.load_history = True
                 st.success("履歴を読み込みました")
@@ -237,33 +227,31 @@ def render_chat(pinecone_service: PineconeService):
             if template["name"] == selected_template
         )
         
-        # LangChainを使用して応答を生成
-        with st.spinner("応答を生成中..."):
-            # 会話履歴をLangChainのメッセージ形式に変換
-            chat_history = []
-            for msg in st.session_state.messages:  # すべてのメッセージを含める
-                if msg["role"] == "user":
-                    chat_history.append(("human", msg["content"]))
-                elif msg["role"] == "assistant":
-                    chat_history.append(("ai", msg["content"]))
-            
-            # 会話履歴を逆順にして、最新の会話から処理
-            chat_history.reverse()
-            
-            response, details = st.session_state.langchain_service.get_response(
-                prompt,
-                system_prompt=selected_template_data["system_prompt"],
-                response_template=selected_template_data["response_template"],
-                property_info=st.session_state.get("property_info", "物件情報はありません。"),
-                chat_history=chat_history  # 会話履歴を渡す
-            )
-            
-            # アシスタントの応答を追加
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response,
-                "details": details,
-                "timestamp": datetime.now().isoformat()
-            })
+        # ユーザーメッセージを表示し、応答は生成されたトークンから順に表示する
+        with st.chat_message("user"):
+            st.markdown(prompt)
+        
+        with st.chat_message("assistant"):
+            # 会話履歴はLangChainサービスが直近の往復と要約として保持している
+            with st.spinner("関連情報を検索中..."):
+                tokens, details = st.session_state.langchain_service.stream_response(
+                    prompt,
+                    system_prompt=selected_template_data["system_prompt"],
+                    response_template=selected_template_data["response_template"],
+                    property_info=st.session_state.get("property_info", "物件情報はありません。"),
+                    filter=st.session_state.get("search_filter"),
+                    # 回答キャッシュは物件とテンプレートが同じ場合のみ再利用する
+                    property_id=selected_property_id,
+                    template_name=selected_template
+                )
+            response = st.write_stream(tokens)
+        
+        # アシスタントの応答を追加（詳細情報はストリームの完了時に確定している）
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": response,
+            "details": details,
+            "timestamp": datetime.now().isoformat()
+        })
         
         st.rerun() 
\ No newline at end of file
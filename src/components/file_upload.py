@@ -1,104 +1,37 @@
 import streamlit as st
-from src.utils.text_processing import process_text_file
+from src.utils.text_processing import iter_file_chunks
+from src.utils.facility_csv import read_facility_csv, iter_facility_chunks
 from src.services.pinecone_service import PineconeService
-from src.config.settings import METADATA_CATEGORIES
+from src.config.settings import METADATA_CATEGORIES, CSV_PREVIEW_ROWS
 from datetime import datetime
-import pandas as pd
 import json
 import traceback
-import io
-
-def read_file_content(file) -> str:
-    """ファイルの内容を適切なエンコーディングで読み込む"""
-    encodings = ['utf-8', 'shift-jis', 'cp932', 'euc-jp']
-    content = file.getvalue()
-    
-    for encoding in encodings:
-        try:
-            # バイト列を文字列にデコード
-            decoded_content = content.decode(encoding)
-            # デコードした文字列を再度エンコードして元のバイト列と比較
-            if decoded_content.encode(encoding) == content:
-                return decoded_content
-        except (UnicodeDecodeError, UnicodeEncodeError):
-            continue
-    
-    # すべてのエンコーディングで失敗した場合
-    try:
-        # UTF-8で強制的にデコードを試みる（一部の文字が化ける可能性あり）
-        return content.decode('utf-8', errors='replace')
-    except Exception as e:
-        raise ValueError(f"ファイルのエンコーディングを特定できませんでした。エラー: {str(e)}")
 
 def process_csv_file(file):
-    """CSVファイルを処理してチャンクに分割"""
+    """CSVファイルの先頭部分をプレビューし、チャンクを順に返すイテレーターを作成"""
     try:
-        # エンコーディングのリスト（日本語のCSVで一般的なエンコーディング）
-        encodings = ['utf-8', 'shift-jis', 'cp932', 'euc-jp']
-        
-        # 各エンコーディングで試行
-        for encoding in encodings:
-            try:
-                # ファイルの内容をバイト列として読み込む
-                content = file.getvalue()
-                # 指定したエンコーディングでデコード
-                decoded_content = content.decode(encoding)
-                # デコードした内容をStringIOに変換
-                file_like = io.StringIO(decoded_content)
-                # CSVとして読み込む
-                df = pd.read_csv(file_like, header=None, names=[
-                    "大カテゴリ", "中カテゴリ", "施設名", "緯度", "経度", "徒歩距離", "徒歩分数", "直線距離"
-                ])
-                break  # 成功したらループを抜ける
-            except (UnicodeDecodeError, pd.errors.EmptyDataError):
-                continue  # 失敗したら次のエンコーディングを試す
-        
-        if 'df' not in locals():
-            raise ValueError("CSVファイルのエンコーディングを特定できませんでした。")
-        
-        # デバッグ情報の表示
-        st.write("CSVファイルの内容:")
-        st.dataframe(df)
-        
-        # 各列を結合してテキストを作成
-        chunks = []
-        for index, row in df.iterrows():
-            try:
-                # 各行をテキストに変換
-                text = f"{row['施設名']}は{row['大カテゴリ']}の{row['中カテゴリ']}です。"
-                if text.strip():
-                    # NaN値を適切に処理し、型変換を確実に行う
-                    metadata = {
-                        "main_category": str(row['大カテゴリ']),
-                        "sub_category": str(row['中カテゴリ']),
-                        "facility_name": str(row['施設名']),
-                        "latitude": float(row['緯度']) if pd.notna(row['緯度']) else 0.0,
-                        "longitude": float(row['経度']) if pd.notna(row['経度']) else 0.0,
-                        "walking_distance": int(float(row['徒歩距離'])) if pd.notna(row['徒歩距離']) else 0,
-                        "walking_minutes": int(float(row['徒歩分数'])) if pd.notna(row['徒歩分数']) else 0,
-                        "straight_distance": int(float(row['直線距離'])) if pd.notna(row['直線距離']) else 0
-                    }
-                    
-                    # デバッグ情報の表示
-                    st.write(f"行 {index + 1} のメタデータ:")
-                    st.json(metadata)
-                    
-                    chunks.append({
-                        "id": f"csv_{index}_{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                        "text": text,
-                        "metadata": metadata
-                    })
-            except Exception as e:
-                st.error(f"行 {index + 1} の処理中にエラーが発生しました: {str(e)}")
-                continue
-        
-        if not chunks:
-            raise ValueError("有効なデータが1件も見つかりませんでした。")
-            
-        return chunks
+        content = file.getvalue()
+        preview = read_facility_csv(content, nrows=CSV_PREVIEW_ROWS)
+        st.write(f"CSVファイルの内容（先頭{len(preview)}行）:")
+        st.dataframe(preview)
+        return iter_facility_chunks(content, file.name)
     except Exception as e:
         raise ValueError(f"CSVファイルの処理に失敗しました: {str(e)}")
 
+def show_sync_result(result: dict):
+    """差分アップロードの結果を表示"""
+    st.write(
+        f"新規・変更: {result['changed_chunks']}件 / 変更なし: {result['unchanged_chunks']}件 / "
+        f"削除: {result['deleted_chunks']}件"
+    )
+    if result["failed_chunks"]:
+        st.warning(
+            f"{result['failed_chunks']}件のチャンクをアップロードできませんでした。"
+            "失敗したチャンクは記録され、`python ingest.py --replay` または再度のアップロードで再送できます。"
+        )
+        with st.expander("失敗したチャンク"):
+            st.table(result["failures"])
+
 def render_file_upload(pinecone_service: PineconeService):
     """ファイルアップロード機能のUIを表示"""
     st.title("ファイルアップロード")
@@ -111,16 +44,35 @@ def render_file_upload(pinecone_service: PineconeService):
         file_extension = uploaded_file.name.split('.')[-1].lower()
         
         if file_extension == 'csv':
-            # CSVファイルの場合はメタデータ入力フォームを表示しない
+            # CSVファイルの場合はカテゴリがファイルに含まれるため、市区町村のみ入力する
+            # （チャットで物件の市区町村による絞り込み検索の対象にするため）
+            city = st.selectbox(
+                "市区町村 *",
+                METADATA_CATEGORIES["市区町村"],
+                index=None,
+                placeholder="市区町村を選択してください"
+            )
+            
             if st.button("データベースに保存"):
+                if not city:
+                    st.error("市区町村は必須項目です。")
+                    return
+                
                 try:
                     with st.spinner("ファイルを処理中..."):
                         chunks = process_csv_file(uploaded_file)
-                        st.write(f"ファイルを{len(chunks)}個のチャンクに分割しました")
                         
-                        with st.spinner("Pineconeにアップロード中..."):
-                            pinecone_service.upload_chunks(chunks)
-                            st.success("アップロードが完了しました！")
+                    with st.spinner("Pineconeにアップロード中..."):
+                        def with_city(chunks):
+                            for chunk in chunks:
+                                chunk["metadata"]["city"] = city
+                                yield chunk
+                        
+                        # 同じファイルの前回アップロード分は差分のみ反映する
+                        result = pinecone_service.sync_file(uploaded_file.name, with_city(chunks))
+                        st.write(f"{result['changed_chunks'] + result['unchanged_chunks']}件の施設を読み込みました")
+                        show_sync_result(result)
+                        st.success("アップロードが完了しました！")
                 except ValueError as e:
                     st.error(str(e))
                 except Exception as e:
@@ -179,28 +131,34 @@ def render_file_upload(pinecone_service: PineconeService):
                     return
                     
                 try:
-                    with st.spinner("ファイルを処理中..."):
-                        file_content = read_file_content(uploaded_file)
-                        chunks = process_text_file(file_content, uploaded_file.name)
-                        
-                        st.write(f"ファイルを{len(chunks)}個のチャンクに分割しました")
+                    with st.spinner("ファイルを処理してPineconeにアップロード中..."):
+                        metadata = {
+                            "main_category": main_category,
+                            "sub_category": sub_category,
+                            "city": city,
+                            "created_date": created_date.isoformat() if created_date else None,
+                            "upload_date": upload_date.isoformat(),
+                            "source": source if source else None
+                        }
                         
-                        # メタデータを追加
-                        for chunk in chunks:
-                            chunk["metadata"] = {
-                                "main_category": main_category,
-                                "sub_category": sub_category,
-                                "city": city,
-                                "created_date": created_date.isoformat() if created_date else None,
-                                "upload_date": upload_date.isoformat(),
-                                "source": source if source else None
-                            }
-                            chunk["filename"] = uploaded_file.name
-                            chunk["chunk_id"] = chunk["id"]
+                        def chunks_with_metadata():
+                            # ファイルを少しずつデコード・分割し、チャンクができた順にアップロードへ渡す
+                            uploaded_file.seek(0)
+                            for chunk in iter_file_chunks(uploaded_file, uploaded_file.name):
+                                chunk["metadata"].update(metadata)
+                                chunk["filename"] = uploaded_file.name
+                                chunk["chunk_id"] = chunk["id"]
+                                yield chunk
                         
-                        with st.spinner("Pineconeにアップロード中..."):
-                            pinecone_service.upload_chunks(chunks)
-                            st.success("アップロードが完了しました！")
+                        # 同じファイルの前回アップロード分は差分のみ反映する
+                        result = pinecone_service.sync_file(
+                            uploaded_file.name,
+                            chunks_with_metadata(),
+                            id_prefix=f"{uploaded_file.name}_chunk_"
+                        )
+                        st.write(f"ファイルを{result['changed_chunks'] + result['unchanged_chunks']}個のチャンクに分割しました")
+                        show_sync_result(result)
+                        st.success("アップロードが完了しました！")
                 except ValueError as e:
                     st.error(str(e))
                 except Exception as e:
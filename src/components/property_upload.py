@@ -1,6 +1,8 @@
 import streamlit as st
 from src.services.pinecone_service import PineconeService
+from src.services.property_catalog import get_property_catalog
 import pandas as pd
+import hashlib
 import json
 import traceback
 
@@ -17,6 +19,14 @@ CITIES = {
     # 他の都道府県の市区町村も同様に追加可能
 }
 
+def property_id(property_data: dict) -> str:
+    """所在地と物件名から決まる物件のID（同じ物件の再アップロードは上書きになる）"""
+    key = "\t".join(
+        property_data[field] or ""
+        for field in ("prefecture", "city", "detailed_address", "property_name")
+    )
+    return "property_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
 def render_property_upload(pinecone_service: PineconeService):
     """物件情報のアップロードUIを表示"""
     st.title("🏠 物件情報のアップロード")
@@ -98,14 +108,21 @@ def render_property_upload(pinecone_service: PineconeService):
                 
                 # Pineconeへのアップロード
                 chunks = [{
+                    "id": property_id(property_data),
                     "text": json.dumps(property_data, ensure_ascii=False),
                     "metadata": property_data
                 }]
                 
                 # property namespaceを使用してアップロード
-                pinecone_service.upload_chunks(chunks, namespace="property")
+                result = pinecone_service.upload_chunks(chunks, namespace="property")
+                # チャット画面の物件一覧を次回表示時に再読み込みさせる
+                get_property_catalog().invalidate()
                 
-                st.success("✅ 物件情報をアップロードしました")
+                if result["failed_chunks"]:
+                    reasons = ", ".join(failure["reason"] for failure in result["failures"])
+                    st.warning(f"⚠️ 物件情報をアップロードできませんでした（後から再送します）: {reasons}")
+                else:
+                    st.success("✅ 物件情報をアップロードしました")
                 
             except Exception as e:
                 st.error(f"❌ アップロードに失敗しました: {str(e)}")
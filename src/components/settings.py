@@ -1,5 +1,7 @@
 import streamlit as st
 from src.services.pinecone_service import PineconeService
+from src.services.embedding_cache import get_embedding_cache
+from src.services.llm_cache import get_llm_cache
 from src.config.settings import (
     CHUNK_SIZE,
     BATCH_SIZE,
@@ -210,24 +212,25 @@ def render_settings(pinecone_service: PineconeService):
                 st.markdown("#### 📊 データベースの概要")
                 st.json(stats)
                 
-                # データを取得
-                data = pinecone_service.get_index_data()
+                st.markdown("#### 🧠 埋め込みベクトルキャッシュ")
+                st.json(get_embedding_cache().stats())
                 
-                if data:
+                st.markdown("#### 💬 LLMの応答キャッシュ")
+                st.json(get_llm_cache().stats())
+                
+                # データを順に取得し、ファイルごとにチャンク数を集計（全件は保持しない）
+                files = {}
+                for item in pinecone_service.get_index_data():
+                    entry = files.get(item['filename'])
+                    if entry is None:
+                        files[item['filename']] = {**item, 'chunk_id': 1}
+                    else:
+                        entry['chunk_id'] += 1
+                
+                if files:
                     st.markdown("#### 📋 データベースの内容")
                     # データフレームを作成
-                    df = pd.DataFrame(data)
-                    
-                    # ファイルごとにグループ化して集計
-                    df_grouped = df.groupby('filename').agg({
-                        'chunk_id': 'count',
-                        'main_category': 'first',
-                        'sub_category': 'first',
-                        'city': 'first',
-                        'created_date': 'first',
-                        'upload_date': 'first',
-                        'source': 'first'
-                    }).reset_index()
+                    df_grouped = pd.DataFrame(list(files.values()))
                     
                     # 列名の日本語対応
                     column_names = {
@@ -254,97 +257,95 @@ def render_settings(pinecone_service: PineconeService):
                     st.info("ℹ️ データベースにデータがありません。")
                 
                 # 各namespaceのデータを取得して表示
-                namespaces = ["default", "property"]
-                for namespace in namespaces:
+                # 表示名と実際のnamespace（デフォルトnamespaceは空文字）
+                namespaces = {"default": "", "property": "property"}
+                for namespace, namespace_value in namespaces.items():
                     try:
-                        vectors = pinecone_service.list_vectors(namespace=namespace)
-                        if vectors:
-                            st.markdown(f"#### 📋 {namespace} namespaceの内容")
+                        # メタデータを順に取得してDataFrame用に変換
+                        metadata_list = []
+                        for vector in pinecone_service.iter_vectors(namespace=namespace_value):
+                            metadata = vector['metadata']
+                            metadata['namespace'] = namespace
+                            metadata_list.append(metadata)
+                        
+                        st.markdown(f"#### 📋 {namespace} namespaceの内容")
+                        
+                        if metadata_list:
+                            df = pd.DataFrame(metadata_list)
                             
-                            # メタデータをDataFrameに変換
-                            metadata_list = []
-                            for vector in vectors:
-                                if 'metadata' in vector:
-                                    metadata = vector['metadata']
-                                    metadata['namespace'] = namespace
-                                    metadata_list.append(metadata)
+                            # namespaceごとに適切な列を表示
+                            if namespace == "property":
+                                # 物件情報の表示
+                                display_columns = [
+                                    'property_name',
+                                    'property_type',
+                                    'prefecture',
+                                    'city',
+                                    'detailed_address',
+                                    'latitude',
+                                    'longitude'
+                                ]
+                                # 物件情報の件数を表示
+                                st.markdown(f"##### 📊 物件情報の件数: {len(metadata_list)}件")
+                                
+                                # 市区町村ごとの件数を表示
+                                city_counts = df['city'].value_counts().reset_index()
+                                city_counts.columns = ['市区町村', '件数']
+                                st.markdown("##### 📍 市区町村別物件数")
+                                st.dataframe(
+                                    city_counts,
+                                    hide_index=True,
+                                    use_container_width=True
+                                )
+                            else:
+                                # デフォルトnamespaceの表示
+                                # 既存のデータと新しいデータの両方に対応
+                                display_columns = [
+                                    'main_category',
+                                    'sub_category',
+                                    'facility_name',
+                                    'city',
+                                    'created_date',
+                                    'upload_date',
+                                    'source',
+                                    'latitude',
+                                    'longitude',
+                                    'walking_distance',
+                                    'walking_minutes',
+                                    'straight_distance'
+                                ]
                             
-                            if metadata_list:
-                                df = pd.DataFrame(metadata_list)
+                            # 存在する列のみを表示
+                            available_columns = [col for col in display_columns if col in df.columns]
+                            if available_columns:
+                                # 列名の日本語対応
+                                column_names = {
+                                    'main_category': '大カテゴリ',
+                                    'sub_category': '中カテゴリ',
+                                    'facility_name': '施設名',
+                                    'city': '市区町村',
+                                    'created_date': 'データ作成日',
+                                    'upload_date': 'アップロード日',
+                                    'source': 'ソース元',
+                                    'latitude': '緯度',
+                                    'longitude': '経度',
+                                    'walking_distance': '徒歩距離(m)',
+                                    'walking_minutes': '徒歩分数(分)',
+                                    'straight_distance': '直線距離(m)'
+                                }
                                 
-                                # namespaceごとに適切な列を表示
-                                if namespace == "property":
-                                    # 物件情報の表示
-                                    display_columns = [
-                                        'property_name',
-                                        'property_type',
-                                        'prefecture',
-                                        'city',
-                                        'detailed_address',
-                                        'latitude',
-                                        'longitude'
-                                    ]
-                                    # 物件情報の件数を表示
-                                    st.markdown(f"##### 📊 物件情報の件数: {len(metadata_list)}件")
-                                    
-                                    # 市区町村ごとの件数を表示
-                                    city_counts = df['city'].value_counts().reset_index()
-                                    city_counts.columns = ['市区町村', '件数']
-                                    st.markdown("##### 📍 市区町村別物件数")
-                                    st.dataframe(
-                                        city_counts,
-                                        hide_index=True,
-                                        use_container_width=True
-                                    )
-                                else:
-                                    # デフォルトnamespaceの表示
-                                    # 既存のデータと新しいデータの両方に対応
-                                    display_columns = [
-                                        'main_category',
-                                        'sub_category',
-                                        'facility_name',
-                                        'city',
-                                        'created_date',
-                                        'upload_date',
-                                        'source',
-                                        'latitude',
-                                        'longitude',
-                                        'walking_distance',
-                                        'walking_minutes',
-                                        'straight_distance'
-                                    ]
+                                # 列名を日本語に変換
+                                df_display = df[available_columns].rename(columns=column_names)
                                 
-                                # 存在する列のみを表示
-                                available_columns = [col for col in display_columns if col in df.columns]
-                                if available_columns:
-                                    # 列名の日本語対応
-                                    column_names = {
-                                        'main_category': '大カテゴリ',
-                                        'sub_category': '中カテゴリ',
-                                        'facility_name': '施設名',
-                                        'city': '市区町村',
-                                        'created_date': 'データ作成日',
-                                        'upload_date': 'アップロード日',
-                                        'source': 'ソース元',
-                                        'latitude': '緯度',
-                                        'longitude': '経度',
-                                        'walking_distance': '徒歩距離(m)',
-                                        'walking_minutes': '徒歩分数(分)',
-                                        'straight_distance': '直線距離(m)'
-                                    }
-                                    
-                                    # 列名を日本語に変換
-                                    df_display = df[available_columns].rename(columns=column_names)
-                                    
-                                    st.dataframe(
-                                        df_display,
-                                        hide_index=True,
-                                        use_container_width=True
-                                    )
-                                else:
-                                    st.info(f"{namespace} namespaceに表示可能なデータがありません。")
+                                st.dataframe(
+                                    df_display,
+                                    hide_index=True,
+                                    use_container_width=True
+                                )
                             else:
-                                st.info(f"{namespace} namespaceにデータがありません。")
+                                st.info(f"{namespace} namespaceに表示可能なデータがありません。")
+                        else:
+                            st.info(f"{namespace} namespaceにデータがありません。")
                     except Exception as e:
                         st.error(f"{namespace} namespaceのデータ取得に失敗しました: {str(e)}")
                         continue
@@ -19,16 +19,103 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or st.secrets.get("openai_api_key")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME") or st.secrets.get("index_name")
 PINECONE_ASSISTANT_NAME = os.getenv("PINECONE_ASSISTANT_NAME") or st.secrets.get("assistant_name")
 
+# Vector Backend Settings
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")  # ベクトルの保存先（"pinecone" または "local"）
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_index")  # ローカルインデックスの保存先ディレクトリ
+LOCAL_ANN_MIN_VECTORS = 20000  # この件数以上のnamespaceでは近似最近傍探索（IVF）を使用
+LOCAL_ANN_NPROBE = 8  # 近似最近傍探索で調べるリスト数（大きいほど再現率が高く、遅くなる）
+
 # Text Processing Settings
+CHUNK_MODE = os.getenv("CHUNK_MODE", "chars")  # チャンクの長さの単位（"chars": 文字数, "tokens": 埋め込みモデルのトークン数）
 CHUNK_SIZE = 500  # テキストを分割する際の1チャンクあたりの文字数
-BATCH_SIZE = 100  # Pineconeへのアップロード時のバッチサイズ
+CHUNK_TOKENS = 400  # トークン単位で分割する際の1チャンクあたりの最大トークン数
+CHUNK_OVERLAP_TOKENS = 50  # 前のチャンクの末尾の文を次のチャンクに重ねるトークン数の上限（文単位）
+TEXT_READ_BLOCK_SIZE = 1024 * 1024  # テキストファイルを読み込む際の1回あたりのバイト数
+ENCODING_SAMPLE_SIZE = 64 * 1024  # エンコーディングの判定に使う先頭部分のバイト数
+CSV_READ_CHUNK_ROWS = 5000  # 施設CSVを一度に読み込んで変換する行数
+CSV_PREVIEW_ROWS = 20  # アップロード画面でプレビューする施設CSVの行数
+BATCH_SIZE = 100  # アップロード時に1回で埋め込みベクトルを生成するチャンク数
+UPSERT_MAX_REQUEST_BYTES = int(os.getenv("UPSERT_MAX_REQUEST_BYTES", 2_000_000))  # upsert 1回あたりのリクエストサイズの上限（Pineconeの上限2MBより少し小さく）
+UPSERT_MAX_VECTORS = 1000  # upsert 1回あたりのベクトル数の上限
+FETCH_BATCH_SIZE = 100  # ベクトル一覧の取得時に1回で列挙・取得する件数
+DELETE_BATCH_SIZE = 1000  # ベクトルの削除時に1回で指定するIDの件数
+INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "ingest_manifest.sqlite3")  # ファイルごとのアップロード済みチャンクの記録
+CHUNK_TEXT_STORE_ENABLED = os.getenv("CHUNK_TEXT_STORE_ENABLED", "true").lower() == "true"  # チャンクの本文と表示用のメタデータをインデックスではなくローカルの本文ストアに保存するか
+CHUNK_TEXT_STORE_PATH = os.getenv("CHUNK_TEXT_STORE_PATH", "chunk_texts.sqlite3")  # チャンクの本文ストア（zlib圧縮）
+INDEX_METADATA_KEYS = ("city", "main_category", "sub_category", "record_type", "facility_name")  # 本文ストアが有効な場合にインデックスのメタデータに残すキー（検索時のフィルタに使うもの）
+DEAD_LETTER_PATH = os.getenv("DEAD_LETTER_PATH", "dead_letters.sqlite3")  # アップロードに失敗したチャンクの記録
+DEAD_LETTER_MAX_ATTEMPTS = 5  # デッドレターのチャンクを再送する試行回数の上限（最初の失敗を含む）
+DEAD_LETTER_REPLAY_LIMIT = 1000  # 1回の再送で処理するチャンク数の上限
+INGEST_JOURNAL_PATH = os.getenv("INGEST_JOURNAL_PATH", "ingest_journal.jsonl")  # 一括取り込み（ingest.py）の処理済みファイルの記録
 
 # OpenAI Settings
 EMBEDDING_MODEL = "text-embedding-ada-002"  # 使用する埋め込みモデル
+EMBEDDING_DIMENSION = 1536  # 埋め込みベクトルの次元数
+EMBEDDING_MAX_INPUT_TOKENS = 8191  # 埋め込みモデルの1入力あたりの最大トークン数
+EMBEDDING_BATCH_MAX_TOKENS = 250000  # 埋め込みAPI 1リクエストあたりの入力トークン数の上限（見積もり値）
+EMBEDDING_BATCH_MAX_INPUTS = 2048  # 埋め込みAPI 1リクエストあたりの入力テキスト数の上限
+EMBEDDING_MAX_WORKERS = 4  # 埋め込みベクトルを並列に生成するスレッド数
+UPSERT_QUEUE_SIZE = 2  # 埋め込み済みでアップロード待ちのバッチ数の上限（背圧）
+OPENAI_EMBEDDING_RPM = 3000  # 埋め込みAPIのリクエスト数/分の上限
+OPENAI_EMBEDDING_TPM = 1000000  # 埋め込みAPIのトークン数/分の上限
+
+# Cache Settings
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")  # キャッシュファイルの保存先ディレクトリ
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3")  # 埋め込みベクトルキャッシュのファイル
+EMBEDDING_CACHE_MAX_ENTRIES = 20000  # 埋め込みベクトルキャッシュの最大件数（超えた分は古いものから削除）
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"  # 質問タイプの判別・メタデータの抽出・会話履歴の要約の応答をキャッシュするか
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, "llm_completions.sqlite3")  # LLMの応答キャッシュのファイル
+LLM_CACHE_MAX_ENTRIES = 5000  # LLMの応答キャッシュの最大件数（超えた分は古いものから削除）
+PROPERTY_CATALOG_TTL = 300  # 物件一覧キャッシュの有効期間（秒）
 
 # Search Settings
 DEFAULT_TOP_K = 10  # デフォルトの検索結果数
 SIMILARITY_THRESHOLD = 0.7  # 類似度のしきい値（0-1の範囲）
+QUERY_EMBEDDING_CACHE_SIZE = 1024  # 検索クエリの埋め込みベクトルをプロセス内に保持する件数
+
+# Answer Cache Settings
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"  # 似た質問への回答を再利用するか
+ANSWER_CACHE_SIMILARITY = 0.95  # 質問の埋め込みベクトルのコサイン類似度がこの値以上なら同じ質問とみなす
+ANSWER_CACHE_TTL = 3600  # 回答キャッシュの有効期間（秒）
+ANSWER_CACHE_MAX_ENTRIES = 500  # 回答キャッシュの最大件数（超えた分は最も使われていないものから削除）
+
+# Context Packing Settings
+CONTEXT_TOKENS_PER_CHUNK = CHUNK_SIZE * 3 // 2  # 参照文脈のチャンク1件あたりのトークン数の上限の目安（日本語は1文字あたり1〜1.5トークン程度）
+CONTEXT_TOKEN_BUDGET = DEFAULT_TOP_K * CONTEXT_TOKENS_PER_CHUNK  # 回答生成のプロンプトに入れる参照文脈のトークン数の上限（検索件数分のチャンクが収まる大きさ）
+CONTEXT_SIMHASH_MAX_DISTANCE = 3  # SimHashのハミング距離がこの値以下のチャンクはほぼ同一として除外
+# 参照文脈の見出しに含めるメタデータ（キー, 表示名）。アップロード時に見出しを作成して本文ストアに保存する
+CONTEXT_METADATA_FIELDS = [
+    ("city", "市区町村"),
+    ("main_category", "大カテゴリ"),
+    ("sub_category", "中カテゴリ"),
+    ("facility_name", "施設名"),
+    ("walking_minutes", "徒歩分数"),
+    ("source", "出典"),
+    ("created_date", "作成日")
+]
+
+# Chat History Settings
+CHAT_HISTORY_MAX_TURNS = 6  # プロンプトにそのまま入れる直近の会話の往復数
+CHAT_HISTORY_TOKEN_BUDGET = 1500  # 直近の会話の往復のトークン数の上限（超えた古い往復は要約にまとめる）
+CHAT_SUMMARY_FOLD_TURNS = 3  # 要約にまとめる際に一度に畳み込む往復数（要約の呼び出し回数を抑える）
+CHAT_SUMMARY_MAX_TOKENS = 300  # 会話の要約の最大トークン数
+
+# Hybrid Search Settings
+# スパースベクトルを使う場合、Pineconeのインデックスはmetric="dotproduct"で作成されている必要がある
+SPARSE_VECTORS_ENABLED = os.getenv("SPARSE_VECTORS_ENABLED", "false").lower() == "true"  # BM25スパースベクトルを併用するか
+SPARSE_STATS_PATH = os.getenv("SPARSE_STATS_PATH", "bm25_stats.sqlite3")  # BM25の語彙と文書ごとの語の記録（複数プロセスで共有）
+SPARSE_VOCAB_PATH = os.getenv("SPARSE_VOCAB_PATH", "bm25_vocab.json")  # 以前のJSON形式の語彙（初回に語のインデックスだけを引き継ぐ）
+BM25_K1 = 1.2  # BM25の語頻度の飽和パラメータ
+BM25_B = 0.75  # BM25の文書長による正規化の強さ
+HYBRID_ALPHA = 0.7  # ハイブリッド検索での密ベクトルの重み（1.0で密ベクトルのみ、0.0でスパースのみ）
+
+# 質問タイプごとの検索時メタデータフィルタ（Agentモード）
+# record_typeを持たない既存のベクトル（record_type導入前のアップロード）はどちらの種類にも含める
+QUESTION_TYPE_FILTERS = {
+    "facility": {"$or": [{"record_type": {"$eq": "facility"}}, {"record_type": {"$exists": False}}]},  # 施設CSVのレコード
+    "area": {"$or": [{"record_type": {"$eq": "document"}}, {"record_type": {"$exists": False}}]},  # 地域情報の文書
+    "property": None  # 物件情報は全体から検索
+}
 
 # Metadata Settings
 DEFAULT_CREATION_DATE = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # メタデータの作成日が空の場合のデフォルト値
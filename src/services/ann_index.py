@@ -0,0 +1,141 @@
+from typing import List, Dict, Any, Optional
+import time
+import numpy as np
+
+class IVFFlatIndex:
+    """k-meansの重心で空間を分割する近似最近傍探索（IVF-flat）
+
+    ベクトルは正規化済み（コサイン類似度＝内積）であることを前提とする。
+    各行が属するリスト番号を行の並びと同じ順序の配列で保持するため、
+    LocalVectorIndex の行の追加・上書き・削除（末尾行の移動）にそのまま追従できる。
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray, nprobe: int):
+        self.centroids = centroids.astype(np.float32, copy=False)
+        self.assignments = assignments.astype(np.int32, copy=False)
+        self.nprobe = nprobe
+        self.trained_size = len(assignments)
+        # リストごとの行位置（転置リスト）。行が変わったら作り直す
+        self._lists = None
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, n_lists: int = None, nprobe: int = 8,
+              n_iter: int = 10, max_train_size: int = 50000, seed: int = 0) -> "IVFFlatIndex":
+        """球面k-meansで重心を学習し、全行をリストに割り当てる"""
+        all_vectors = vectors
+        rng = np.random.default_rng(seed)
+        # 学習は標本で行い、割り当ては全行に対して行う
+        if vectors.shape[0] > max_train_size:
+            vectors = vectors[rng.choice(vectors.shape[0], max_train_size, replace=False)]
+        size = vectors.shape[0]
+        n_lists = min(size, n_lists or max(1, int(np.sqrt(all_vectors.shape[0]))))
+        centroids = vectors[rng.choice(size, n_lists, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=n_lists)
+            # 空になったリストはランダムな行で初期化し直す
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = vectors[rng.choice(size, int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.where(norms > 0, norms, 1)
+
+        assignments = np.argmax(all_vectors @ centroids.T, axis=1)
+        return cls(centroids, assignments, nprobe)
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """ベクトルが属するリスト番号を求める"""
+        return np.argmax(np.atleast_2d(vectors) @ self.centroids.T, axis=1).astype(np.int32)
+
+    def add(self, vectors: np.ndarray) -> None:
+        """末尾に追加された行をまとめて割り当てる（インクリメンタル挿入）"""
+        self.assignments = np.concatenate((self.assignments, self.assign(vectors)))
+        self._lists = None
+
+    def update(self, positions: np.ndarray, vectors: np.ndarray) -> None:
+        """上書きされた行をまとめて割り当て直す"""
+        self.assignments[positions] = self.assign(vectors)
+        self._lists = None
+
+    def remove(self, position: int) -> None:
+        """行の削除に追従（末尾の行を削除位置へ移動）"""
+        last = len(self.assignments) - 1
+        self.assignments[position] = self.assignments[last]
+        self.assignments = self.assignments[:last]
+        self._lists = None
+
+    def _inverted_lists(self) -> tuple:
+        """リスト番号順に並べた行位置と、各リストの開始位置を返す"""
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(self.assignments, minlength=self.n_lists))))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def candidates(self, query: np.ndarray, nprobe: int = None) -> np.ndarray:
+        """クエリに近い nprobe 個のリストに属する行の位置を返す"""
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.n_lists:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.n_lists)
+        order, offsets = self._inverted_lists()
+        return np.concatenate([order[offsets[i]:offsets[i + 1]] for i in probe])
+
+    def save(self, path: str) -> None:
+        """重心と割り当てを保存"""
+        np.savez(path, centroids=self.centroids, assignments=self.assignments,
+                 nprobe=self.nprobe, trained_size=self.trained_size)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFFlatIndex":
+        """保存した重心と割り当てを読み込み"""
+        data = np.load(path)
+        index = cls(data["centroids"], data["assignments"], int(data["nprobe"]))
+        index.trained_size = int(data["trained_size"])
+        return index
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, top_k: int) -> np.ndarray:
+    """全件の内積による厳密な上位K件（行の位置）"""
+    scores = vectors @ query
+    top_k = min(top_k, len(scores))
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+def ann_top_k(index: IVFFlatIndex, vectors: np.ndarray, query: np.ndarray, top_k: int, nprobe: int = None) -> np.ndarray:
+    """IVFの候補だけを採点した上位K件（行の位置）"""
+    candidates = index.candidates(query, nprobe)
+    if len(candidates) == 0:
+        return candidates
+    top = exact_top_k(vectors[candidates], query, top_k)
+    return candidates[top]
+
+def recall_latency_report(vectors: np.ndarray, queries: np.ndarray, top_k: int = 10,
+                          nprobes: List[int] = None, index: Optional[IVFFlatIndex] = None) -> List[Dict[str, Any]]:
+    """nprobeごとの再現率（厳密検索との一致率）と1クエリあたりの検索時間を測定"""
+    index = index or IVFFlatIndex.train(vectors)
+    nprobes = nprobes or sorted({1, 2, 4, 8, 16, 32, index.n_lists} & set(range(1, index.n_lists + 1)))
+
+    start = time.perf_counter()
+    exact = [set(exact_top_k(vectors, query, top_k).tolist()) for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = [{"nprobe": "exact", "recall": 1.0, "ms_per_query": round(exact_ms, 4)}]
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        results = [ann_top_k(index, vectors, query, top_k, nprobe) for query in queries]
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([
+            len(expected & set(result.tolist())) / len(expected)
+            for expected, result in zip(exact, results)
+        ])
+        report.append({"nprobe": nprobe, "recall": round(float(recall), 4), "ms_per_query": round(elapsed_ms, 4)})
+    return report
@@ -0,0 +1,108 @@
+from typing import List, Dict, Any, Optional, Hashable
+from collections import OrderedDict
+import copy
+import itertools
+import threading
+import time
+import numpy as np
+from ..config.settings import (
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_MAX_ENTRIES
+)
+
+class SemanticAnswerCache:
+    """似た質問への回答を再利用するキャッシュ（スレッドセーフ、全セッションで共有）
+
+    回答は (物件ID, テンプレート名) の範囲ごとに質問の埋め込みベクトルと共に保存し、
+    同じ範囲でコサイン類似度が threshold 以上の質問が来たら保存した回答を返す。
+    保存時のインデックスの世代番号と異なる回答と、ttl 秒を過ぎた回答は使わない。
+    件数が max_entries を超えた場合は最も使われていない回答から削除する。
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_SIMILARITY, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _evict_stale(self, generation: int) -> None:
+        """期限切れと世代番号の古い回答を削除"""
+        now = time.monotonic()
+        stale = [
+            entry_id for entry_id, entry in self._entries.items()
+            if entry["generation"] != generation or now - entry["stored_at"] >= self.ttl
+        ]
+        for entry_id in stale:
+            del self._entries[entry_id]
+
+    def get(self, vector: List[float], scope: Hashable, generation: int) -> Optional[Dict[str, Any]]:
+        """似た質問の回答を取得（{"answer", "details", "query", "similarity", "age_seconds"}、ない場合はNone）"""
+        query_vector = self._normalize(vector)
+        with self._lock:
+            self._evict_stale(generation)
+            candidates = [(entry_id, entry) for entry_id, entry in self._entries.items() if entry["scope"] == scope]
+            if candidates:
+                similarities = np.stack([entry["vector"] for _, entry in candidates]) @ query_vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return {
+                        "answer": entry["answer"],
+                        "details": copy.deepcopy(entry["details"]),
+                        "query": entry["query"],
+                        "similarity": float(similarities[best]),
+                        "age_seconds": time.monotonic() - entry["stored_at"]
+                    }
+            self.misses += 1
+            return None
+
+    def set(self, vector: List[float], scope: Hashable, generation: int, query: str, answer: str, details: Dict[str, Any]) -> None:
+        """回答を保存"""
+        entry = {
+            "vector": self._normalize(vector),
+            "scope": scope,
+            "generation": generation,
+            "query": query,
+            "answer": answer,
+            "details": copy.deepcopy(details),
+            "stored_at": time.monotonic()
+        }
+        with self._lock:
+            self._entries[next(self._ids)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュの状態"""
+        with self._lock:
+            return {"件数": len(self._entries), "ヒット": self.hits, "ミス": self.misses}
+
+    def clear(self) -> None:
+        """すべての回答を削除"""
+        with self._lock:
+            self._entries.clear()
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """プロセス内で共有する回答キャッシュを取得"""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache()
+        return _answer_cache
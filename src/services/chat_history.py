@@ -0,0 +1,113 @@
+from typing import List, Dict, Any, Tuple
+from collections import deque
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+from ..utils.token_counter import count_tokens
+from ..config.settings import (
+    CHAT_HISTORY_MAX_TURNS,
+    CHAT_HISTORY_TOKEN_BUDGET,
+    CHAT_SUMMARY_FOLD_TURNS
+)
+
+SUMMARY_PROMPT = """以下はユーザーと地域情報案内アシスタントの会話の要約と、その後の会話です。
+これらをまとめて、以降の応答に必要な情報（ユーザーの希望・条件、話題にした物件・地域・施設、回答済みの事実）を
+残した日本語の要約を作成してください。要約のみを出力してください。
+
+これまでの要約:
+{summary}
+
+その後の会話:
+{turns}"""
+
+class ChatHistoryManager:
+    """会話履歴を直近の往復と古い往復の要約に分けて保持
+
+    直近 max_turns 往復（合計 token_budget トークン以内）はそのままプロンプトに入れ、
+    それより古い往復は fold_turns 往復ずつ要約にまとめる。要約はセッションごとの
+    インスタンスに保持して次の要約の入力に使うため、1回の応答で扱う履歴の量と
+    プロンプトの長さは会話が長くなっても一定に保たれる。
+    """
+
+    def __init__(self, summary_llm, max_turns: int = CHAT_HISTORY_MAX_TURNS,
+                 token_budget: int = CHAT_HISTORY_TOKEN_BUDGET, fold_turns: int = CHAT_SUMMARY_FOLD_TURNS):
+        self.summary_llm = summary_llm
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.fold_turns = fold_turns
+        self.summary = ""
+        # (ユーザーの発言, アシスタントの応答, トークン数)
+        self.turns = deque()
+        self.turn_tokens = 0
+        self.summarized_turns = 0
+
+    def add_turn(self, user_message: str, ai_message: str, fold: bool = True) -> None:
+        """1往復を追加し、上限を超えた古い往復を要約にまとめる"""
+        tokens = count_tokens(user_message) + count_tokens(ai_message)
+        self.turns.append((user_message, ai_message, tokens))
+        self.turn_tokens += tokens
+        if fold:
+            self.fold()
+
+    def _over_limit(self) -> bool:
+        return len(self.turns) > self.max_turns or (len(self.turns) > 1 and self.turn_tokens > self.token_budget)
+
+    def fold(self) -> None:
+        """上限を超えた古い往復を要約にまとめる（まとめて畳み込み、要約の呼び出し回数を抑える）"""
+        if not self._over_limit():
+            return
+        folded = []
+        while self._over_limit() or (len(folded) < self.fold_turns and len(self.turns) > 1):
+            user_message, ai_message, tokens = self.turns.popleft()
+            self.turn_tokens -= tokens
+            folded.append((user_message, ai_message))
+        self.summary = self._summarize(folded)
+        self.summarized_turns += len(folded)
+
+    def _summarize(self, turns: List[Tuple[str, str]]) -> str:
+        """これまでの要約と古い往復から新しい要約を作成"""
+        turns_text = "\n".join(f"ユーザー: {user_message}\nアシスタント: {ai_message}" for user_message, ai_message in turns)
+        prompt = SUMMARY_PROMPT.format(summary=self.summary or "（なし）", turns=turns_text)
+        try:
+            return self.summary_llm.invoke(prompt).content
+        except Exception as e:
+            # 要約に失敗した場合は古い往復を捨て、前回の要約を使い続ける
+            print(f"会話履歴の要約に失敗しました: {str(e)}")
+            return self.summary
+
+    def load(self, messages: List[Dict[str, Any]]) -> None:
+        """保存した履歴（role・contentの辞書のリスト）から会話履歴を作り直す"""
+        self.clear()
+        pending_user = None
+        for message in messages:
+            if message["role"] == "user":
+                pending_user = message["content"]
+            elif message["role"] == "assistant" and pending_user is not None:
+                self.add_turn(pending_user, message["content"], fold=False)
+                pending_user = None
+        # 読み込んだ古い往復は1回の要約にまとめる
+        self.fold()
+
+    def messages(self) -> List[Any]:
+        """プロンプトに入れる会話履歴（要約と直近の往復）"""
+        messages = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"これまでの会話の要約:\n{self.summary}"))
+        for user_message, ai_message, _ in self.turns:
+            messages.append(HumanMessage(content=user_message))
+            messages.append(AIMessage(content=ai_message))
+        return messages
+
+    def stats(self) -> Dict[str, Any]:
+        """会話履歴の状態"""
+        return {
+            "直近の往復数": len(self.turns),
+            "直近の往復のトークン数": self.turn_tokens,
+            "要約済みの往復数": self.summarized_turns,
+            "要約のトークン数": count_tokens(self.summary) if self.summary else 0
+        }
+
+    def clear(self) -> None:
+        """会話履歴をクリア"""
+        self.summary = ""
+        self.turns.clear()
+        self.turn_tokens = 0
+        self.summarized_turns = 0
@@ -0,0 +1,116 @@
+from typing import List, Dict, Any
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from ..config.settings import CHUNK_TEXT_STORE_PATH
+
+class ChunkTextStore:
+    """チャンクの本文と表示用のメタデータを (namespace, ベクトルID) ごとに圧縮して保存するローカルストア
+
+    インデックスのメタデータには検索時のフィルタに使うキーだけを持たせ、本文と
+    それ以外のメタデータ（ファイル名・日付・距離など）は検索結果の上位K件の分だけを
+    1回の問い合わせでまとめて取得する。
+    """
+
+    def __init__(self, path: str = CHUNK_TEXT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS texts (
+                namespace TEXT NOT NULL,
+                vector_id TEXT NOT NULL,
+                text BLOB NOT NULL,
+                fields BLOB,
+                PRIMARY KEY (namespace, vector_id)
+            )"""
+        )
+        # 本文のみを保存していた既存のストアには表示用のメタデータの列を追加する
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(texts)")]
+        if "fields" not in columns:
+            self._conn.execute("ALTER TABLE texts ADD COLUMN fields BLOB")
+        self._conn.commit()
+
+    @staticmethod
+    def _compress(value: str) -> bytes:
+        return zlib.compress(value.encode("utf-8"))
+
+    @staticmethod
+    def _decompress(value: bytes) -> str:
+        return zlib.decompress(value).decode("utf-8")
+
+    def put_many(self, records: Dict[str, Dict[str, Any]], namespace: str = None) -> None:
+        """ベクトルIDとレコード（本文の "text" と表示用のメタデータ）の対応をまとめて保存"""
+        if not records:
+            return
+        rows = []
+        for vector_id, record in records.items():
+            fields = {key: value for key, value in record.items() if key != "text"}
+            rows.append((
+                namespace or "",
+                vector_id,
+                self._compress(record.get("text", "")),
+                self._compress(json.dumps(fields, ensure_ascii=False)) if fields else None
+            ))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO texts (namespace, vector_id, text, fields) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def get_many(self, ids: List[str], namespace: str = None) -> Dict[str, Dict[str, Any]]:
+        """ベクトルIDのレコード（本文の "text" と表示用のメタデータ）をまとめて取得（保存されていないIDは含めない）"""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+        records = {}
+        with self._lock:
+            # SQLiteのパラメータ数の上限を超えないように分けて問い合わせる
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT vector_id, text, fields FROM texts WHERE namespace = ? AND vector_id IN ({','.join('?' * len(part))})",
+                    [namespace or "", *part]
+                ).fetchall()
+                for vector_id, text, fields in rows:
+                    records[vector_id] = {
+                        **(json.loads(self._decompress(fields)) if fields is not None else {}),
+                        "text": self._decompress(text)
+                    }
+        return records
+
+    def delete(self, ids: List[str], namespace: str = None) -> None:
+        """ベクトルIDのレコードを削除"""
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM texts WHERE namespace = ? AND vector_id = ?",
+                [(namespace or "", vector_id) for vector_id in ids]
+            )
+            self._conn.commit()
+
+    def clear(self, namespace: str = None) -> None:
+        """namespaceのレコードをすべて削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM texts WHERE namespace = ?", (namespace or "",))
+            self._conn.commit()
+
+_chunk_text_store = None
+_chunk_text_store_lock = threading.Lock()
+
+def get_chunk_text_store() -> ChunkTextStore:
+    """プロセス内で共有するチャンク本文ストアを取得"""
+    global _chunk_text_store
+    with _chunk_text_store_lock:
+        if _chunk_text_store is None:
+            _chunk_text_store = ChunkTextStore()
+        return _chunk_text_store
@@ -0,0 +1,114 @@
+from typing import List, Dict, Any, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+from .ingest_manifest import chunk_hash
+from ..config.settings import DEAD_LETTER_PATH, DEAD_LETTER_MAX_ATTEMPTS
+
+class DeadLetterQueue:
+    """アップロードに失敗したチャンクを理由と試行回数とともに記録するデッドレターキュー
+
+    チャンクはIDごとに1件（IDのないチャンクは内容のハッシュ）で、再度失敗すると
+    試行回数を増やす。後から replay_dead_letters で試行回数の上限まで再送する。
+    """
+
+    def __init__(self, path: str = DEAD_LETTER_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS dead_letters (
+                namespace TEXT NOT NULL,
+                chunk_key TEXT NOT NULL,
+                chunk TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                first_failed_at REAL NOT NULL,
+                last_failed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, chunk_key)
+            )"""
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(chunk: Dict[str, Any]) -> str:
+        return chunk.get("id") or f"hash:{chunk_hash(chunk)}"
+
+    def add(self, failures: List[Tuple[Dict[str, Any], str]], namespace: str = None) -> None:
+        """失敗したチャンクを記録（記録済みのものは試行回数を増やす）"""
+        if not failures:
+            return
+        now = time.time()
+        rows = [
+            (namespace or "", self._key(chunk), json.dumps(chunk, ensure_ascii=False, default=str), reason, now, now)
+            for chunk, reason in failures
+        ]
+        with self._lock:
+            self._conn.executemany(
+                """INSERT INTO dead_letters (namespace, chunk_key, chunk, reason, attempts, first_failed_at, last_failed_at)
+                VALUES (?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT (namespace, chunk_key) DO UPDATE SET
+                    chunk = excluded.chunk,
+                    reason = excluded.reason,
+                    attempts = attempts + 1,
+                    last_failed_at = excluded.last_failed_at""",
+                rows
+            )
+            self._conn.commit()
+
+    def resolve(self, chunk_ids: List[str], namespace: str = None) -> None:
+        """アップロードできたチャンクの記録を削除"""
+        if not chunk_ids:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM dead_letters WHERE namespace = ? AND chunk_key = ?",
+                [(namespace or "", chunk_id) for chunk_id in chunk_ids]
+            )
+            self._conn.commit()
+
+    def pending(self, limit: int, max_attempts: int = DEAD_LETTER_MAX_ATTEMPTS) -> List[Dict[str, Any]]:
+        """再送の対象（試行回数が上限未満）を古い順に取得"""
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT namespace, chunk_key, chunk, reason, attempts FROM dead_letters
+                WHERE attempts < ? ORDER BY first_failed_at LIMIT ?""",
+                (max_attempts, limit)
+            ).fetchall()
+        return [
+            {"namespace": namespace, "key": key, "chunk": json.loads(chunk), "reason": reason, "attempts": attempts}
+            for namespace, key, chunk, reason, attempts in rows
+        ]
+
+    def summary(self, max_attempts: int = DEAD_LETTER_MAX_ATTEMPTS) -> Dict[str, int]:
+        """記録件数（再送待ち・試行回数の上限に達したもの）"""
+        with self._lock:
+            pending, exhausted = self._conn.execute(
+                "SELECT COALESCE(SUM(attempts < ?), 0), COALESCE(SUM(attempts >= ?), 0) FROM dead_letters",
+                (max_attempts, max_attempts)
+            ).fetchone()
+        return {"pending": pending, "exhausted": exhausted}
+
+    def clear(self, namespace: str = None) -> None:
+        """namespaceの記録をすべて削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM dead_letters WHERE namespace = ?", (namespace or "",))
+            self._conn.commit()
+
+_dead_letter_queue = None
+_dead_letter_queue_lock = threading.Lock()
+
+def get_dead_letter_queue() -> DeadLetterQueue:
+    """プロセス内で共有するデッドレターキューを取得"""
+    global _dead_letter_queue
+    with _dead_letter_queue_lock:
+        if _dead_letter_queue is None:
+            _dead_letter_queue = DeadLetterQueue()
+        return _dead_letter_queue
@@ -0,0 +1,124 @@
+from typing import List, Dict, Any
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from ..config.settings import INGEST_MANIFEST_PATH
+
+# アップロードのたびに変わるため変更判定に含めないメタデータ
+_VOLATILE_METADATA_KEYS = ("upload_date",)
+
+def chunk_hash(chunk: Dict[str, Any]) -> str:
+    """チャンクの内容（テキストとメタデータ）のハッシュ"""
+    metadata = {
+        key: value
+        for key, value in (chunk.get("metadata") or {}).items()
+        if key not in _VOLATILE_METADATA_KEYS
+    }
+    content = json.dumps(
+        {"text": chunk.get("text", ""), "filename": chunk.get("filename", ""), "metadata": metadata},
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class IngestManifest:
+    """ファイルごとにアップロード済みのチャンクIDと内容のハッシュを記録するマニフェスト"""
+
+    def __init__(self, path: str = INGEST_MANIFEST_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunks (
+                namespace TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                vector_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, vector_id)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks (namespace, filename)")
+        # インデックスの内容が変わるたびに増える世代番号（回答キャッシュの無効化に使用）
+        self._conn.execute("CREATE TABLE IF NOT EXISTS generation (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO generation (id, value) VALUES (0, 0)")
+        self._conn.commit()
+
+    def get_file(self, filename: str, namespace: str = None) -> Dict[str, str]:
+        """ファイルのアップロード済みチャンク（ID→ハッシュ）を取得"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT vector_id, content_hash FROM chunks WHERE namespace = ? AND filename = ?",
+                (namespace or "", filename)
+            ).fetchall()
+        return dict(rows)
+
+    def replace_file(self, filename: str, hashes: Dict[str, str], namespace: str = None) -> None:
+        """ファイルのチャンクの記録を置き換え"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM chunks WHERE namespace = ? AND filename = ?",
+                (namespace or "", filename)
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (namespace, filename, vector_id, content_hash, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(namespace or "", filename, vector_id, content_hash, now) for vector_id, content_hash in hashes.items()]
+            )
+            self._conn.commit()
+
+    def update_chunks(self, filename: str, hashes: Dict[str, str], namespace: str = None) -> None:
+        """ファイルの一部のチャンクの記録を更新"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (namespace, filename, vector_id, content_hash, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(namespace or "", filename, vector_id, content_hash, now) for vector_id, content_hash in hashes.items()]
+            )
+            self._conn.commit()
+
+    def generation(self) -> int:
+        """インデックスの世代番号（別プロセスの取り込みによる変更も反映される）"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM generation WHERE id = 0").fetchone()[0]
+
+    def bump_generation(self) -> None:
+        """インデックスの内容が変わったことを記録"""
+        with self._lock:
+            self._conn.execute("UPDATE generation SET value = value + 1 WHERE id = 0")
+            self._conn.commit()
+
+    def list_files(self, namespace: str = None) -> List[str]:
+        """記録されているファイル名の一覧"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT filename FROM chunks WHERE namespace = ? ORDER BY filename",
+                (namespace or "",)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def clear(self, namespace: str = None) -> None:
+        """namespaceの記録をすべて削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE namespace = ?", (namespace or "",))
+            self._conn.commit()
+
+_ingest_manifest = None
+_ingest_manifest_lock = threading.Lock()
+
+def get_ingest_manifest() -> IngestManifest:
+    """プロセス内で共有するマニフェストを取得"""
+    global _ingest_manifest
+    with _ingest_manifest_lock:
+        if _ingest_manifest is None:
+            _ingest_manifest = IngestManifest()
+        return _ingest_manifest
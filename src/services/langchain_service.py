@@ -1,84 +1,67 @@
-from typing import List, Dict, Any, Tuple
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_community.chat_message_histories import ChatMessageHistory
+from typing import List, Dict, Any, Tuple, Iterator
+import hashlib
+import json
+import time
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage, AIMessage
-import os
+from langchain.schema import HumanMessage, AIMessage, Document
+from .pinecone_service import PineconeService
+from .chat_history import ChatHistoryManager
+from .answer_cache import get_answer_cache
+from .llm_cache import create_chat_model
+from ..utils.context_packer import pack_context
 from ..config.settings import (
-    PINECONE_API_KEY,
-    PINECONE_INDEX_NAME,
-    OPENAI_API_KEY,
     DEFAULT_TOP_K,
     SIMILARITY_THRESHOLD,
     DEFAULT_SYSTEM_PROMPT,
-    DEFAULT_RESPONSE_TEMPLATE
+    DEFAULT_RESPONSE_TEMPLATE,
+    CHAT_SUMMARY_MAX_TOKENS,
+    ANSWER_CACHE_ENABLED
 )
 
 class LangChainService:
-    def __init__(self):
+    def __init__(self, pinecone_service: PineconeService = None):
         """LangChainサービスの初期化"""
-        # チャットモデルの初期化
-        self.llm = ChatOpenAI(
-            api_key=OPENAI_API_KEY,
-            model_name="gpt-3.5-turbo",
-            temperature=0.7
-        )
-        
-        # 埋め込みモデルの初期化
-        self.embeddings = OpenAIEmbeddings(
-            api_key=OPENAI_API_KEY,
-            model="text-embedding-ada-002"
-        )
+        # チャットモデルの初期化（応答に揺らぎを持たせるため応答キャッシュは使わない）
+        self.llm = create_chat_model(temperature=0.7)
         
-        # PineconeのAPIキーを環境変数に設定
-        os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
+        # 検索はPineconeServiceの共通経路を使用（クエリのベクトル化は1回のみ）
+        self.pinecone_service = pinecone_service or PineconeService()
         
-        # Pineconeベクトルストアの初期化
-        self.vectorstore = PineconeVectorStore.from_existing_index(
-            index_name=PINECONE_INDEX_NAME,
-            embedding=self.embeddings
-        )
+        # チャット履歴の初期化（直近の往復と古い往復の要約。サービスはセッションごとに作成される）
+        self.summary_llm = create_chat_model(temperature=0, max_tokens=CHAT_SUMMARY_MAX_TOKENS)
+        self.history = ChatHistoryManager(self.summary_llm)
         
-        # チャット履歴の初期化
-        self.message_history = ChatMessageHistory()
+        # 似た質問への回答キャッシュ（全セッションで共有）
+        self.answer_cache = get_answer_cache() if ANSWER_CACHE_ENABLED else None
         
         # デフォルトのプロンプトテンプレート
         self.system_prompt = DEFAULT_SYSTEM_PROMPT
         self.response_template = DEFAULT_RESPONSE_TEMPLATE
 
-    def get_relevant_context(self, query: str, top_k: int = DEFAULT_TOP_K) -> Tuple[str, List[Dict[str, Any]]]:
-        """クエリに関連する文脈を取得"""
-        # クエリのベクトル化
-        query_vector = self.embeddings.embed_query(query)
+    def get_relevant_context(self, query: str, top_k: int = DEFAULT_TOP_K, filter: Dict[str, Any] = None) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+        """クエリに関連する文脈を取得（filterはインデックス側でメタデータを絞り込む）
         
+        候補をスコアの高い順に、ほぼ同一のチャンクを除きながら参照文脈の
+        トークン数の上限（top_k 件のチャンクが収まる大きさ）まで詰める。
+        """
         # より多くの結果を取得して、後でフィルタリング
-        docs = self.vectorstore.similarity_search_with_score(query, k=top_k * 2)
-        
-        # メタデータも検索対象に含める
-        for doc in docs:
-            # メタデータの各フィールドを検索対象に追加
-            metadata_text = []
-            for key, value in doc[0].metadata.items():
-                if isinstance(value, str):
-                    # メタデータの値をテキストに追加
-                    metadata_text.append(f"{key}: {value}")
-            
-            # メタデータをテキストの前に追加
-            if metadata_text:
-                doc[0].page_content = "\n".join(metadata_text) + "\n\n" + doc[0].page_content
+        matches = self.pinecone_service.search(query, top_k=top_k * 2, filter=filter)
+        
+        candidates = []
+        for match in matches:
+            metadata = dict(match.metadata or {})
+            text = metadata.pop("text", "")
+            candidates.append({"text": text, "metadata": metadata, "score": match.score})
         
         # スコアでフィルタリング
-        filtered_docs = [
-            doc for doc in docs 
-            if doc[1] >= SIMILARITY_THRESHOLD
-        ][:top_k]  # 上位K件に制限
+        above_threshold = [candidate for candidate in candidates if candidate["score"] >= SIMILARITY_THRESHOLD]
         
-        # フィルタリング後の結果が0件の場合は、スコアに関係なく上位K件を使用
-        if not filtered_docs and docs:
-            filtered_docs = docs[:top_k]
+        # フィルタリング後の結果が0件の場合は、スコアに関係なく上位の候補を使用
+        packed, packing_stats = pack_context(above_threshold or candidates, max_chunks=top_k)
         
-        context_text = "\n".join([doc[0].page_content for doc in filtered_docs])
+        # フィルタに一致するチャンクがない場合は、見つからなかったことを文脈として伝える
+        context_text = "\n\n".join(chunk["content"] for chunk in packed) or "該当する情報は見つかりませんでした。"
+        filtered_docs = [(Document(page_content=chunk["content"], metadata=chunk["metadata"]), chunk["score"]) for chunk in packed]
         search_details = [
             {
                 "スコア": round(doc[1], 4),  # 類似度スコアを小数点4桁まで表示
@@ -102,13 +85,14 @@ class LangChainService:
         
         print(f"検索クエリ: {query}")  # デバッグ用
         print(f"検索結果数: {len(filtered_docs)}")  # デバッグ用
+        print(f"参照文脈: {packing_stats}")  # デバッグ用
         for detail in search_details:
             print(f"スコア: {detail['スコア']}, テキスト: {detail['テキスト']}")  # デバッグ用
         
-        return context_text, search_details
+        return context_text, search_details, packing_stats
 
-    def get_response(self, query: str, system_prompt: str = None, response_template: str = None, property_info: str = None, chat_history: list = None) -> Tuple[str, Dict[str, Any]]:
-        """クエリに対する応答を生成"""
+    def _prepare_response(self, query: str, system_prompt: str = None, response_template: str = None, property_info: str = None, filter: Dict[str, Any] = None) -> Tuple[Any, Dict[str, Any], Dict[str, Any]]:
+        """応答生成のチェーン・入力と詳細情報を作成（文脈の検索を含む）"""
         # プロンプトの設定
         system_prompt = system_prompt or self.system_prompt
         response_template = response_template or self.response_template
@@ -134,35 +118,24 @@ class LangChainService:
         chain = prompt | self.llm
         
         # 関連する文脈を取得
-        context, search_details = self.get_relevant_context(query)
-        
-        # チャット履歴を設定
-        if chat_history:
-            self.message_history.messages = []
-            for role, content in chat_history:
-                if role == "human":
-                    self.message_history.add_user_message(content)
-                elif role == "ai":
-                    self.message_history.add_ai_message(content)
+        start = time.perf_counter()
+        context, search_details, packing_stats = self.get_relevant_context(query, filter=filter)
+        retrieval_seconds = time.perf_counter() - start
         
-        # 応答を生成
-        response = chain.invoke({
-            "chat_history": self.message_history.messages,
+        inputs = {
+            "chat_history": self.history.messages(),
             "context": context,
             "property_info": property_info or "物件情報はありません。",
             "input": query
-        })
-        
-        # メッセージを履歴に追加
-        self.message_history.add_user_message(query)
-        self.message_history.add_ai_message(response.content)
+        }
         
-        # 詳細情報の作成
+        # 詳細情報の作成（会話履歴と応答時間は生成の完了時に追加する）
         details = {
             "モデル": "GPT-3.5-turbo",
-            "会話履歴": "有効",
             "文脈検索": {
+                "検索フィルタ": filter or "なし",
                 "検索結果数": len(search_details),
+                "参照文脈": packing_stats,
                 "マッチしたチャンク": search_details
             },
             "プロンプト": {
@@ -170,11 +143,142 @@ class LangChainService:
                 "応答テンプレート": response_template
             },
             "物件情報": property_info or "物件情報はありません。",
-            "会話履歴数": len(chat_history) if chat_history else 0
+            "応答時間": {
+                "文脈検索（秒）": round(retrieval_seconds, 3)
+            }
+        }
+        return chain, inputs, details
+
+    def _answer_scope(self, property_id: str = None, template_name: str = None, system_prompt: str = None,
+                      response_template: str = None, property_info: str = None, filter: Dict[str, Any] = None) -> Tuple[str, str, str]:
+        """回答キャッシュを共有する範囲（物件・テンプレートと、実際に使うプロンプト・物件情報・検索フィルタのハッシュ）
+        
+        同じ物件・テンプレート名でも、編集したプロンプトや異なるフィルタでの回答は返さない。
+        """
+        content = json.dumps(
+            [system_prompt or self.system_prompt, response_template or self.response_template, property_info, filter],
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str
+        )
+        return property_id, template_name, hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _lookup_answer(self, query: str, scope: Tuple[str, str, str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """回答キャッシュから似た質問の回答を探す（(保存用のキー, ヒットした回答)）
+        
+        会話の途中の質問は前の往復に依存するため、キャッシュは会話の最初の質問でのみ
+        引き、その回答だけを保存する。クエリのベクトルはLRUキャッシュされるため、
+        ミスした場合の文脈検索で再利用される。
+        """
+        if self.answer_cache is None or self.history.turns or self.history.summary:
+            return None, None
+        try:
+            vector = self.pinecone_service.embed_query(query)
+            generation = self.pinecone_service.index_generation()
+        except Exception as e:
+            print(f"回答キャッシュの確認に失敗しました: {str(e)}")
+            return None, None
+        cache_key = {
+            "vector": vector,
+            "scope": scope,
+            "generation": generation
+        }
+        return cache_key, self.answer_cache.get(vector, cache_key["scope"], generation)
+
+    def _cached_response(self, query: str, cached: Dict[str, Any], lookup_seconds: float) -> Tuple[str, Dict[str, Any]]:
+        """回答キャッシュにヒットした回答を返す（履歴には通常の応答と同様に追加する）"""
+        details = cached["details"]
+        details["回答キャッシュ"] = {
+            "ヒット": True,
+            "類似度": round(cached["similarity"], 4),
+            "元の質問": cached["query"],
+            "保存からの経過時間（秒）": round(cached["age_seconds"], 1)
         }
+        details["応答時間"] = {"回答キャッシュ（秒）": round(lookup_seconds, 3)}
+        self.history.add_turn(query, cached["answer"])
+        details["会話履歴"] = self.history.stats()
+        print(f"回答キャッシュにヒットしました: 類似度 {cached['similarity']:.4f}, 元の質問: {cached['query']}")
+        return cached["answer"], details
+
+    def _finish_response(self, query: str, answer: str, details: Dict[str, Any], first_token_seconds: float, generation_seconds: float, cache_key: Dict[str, Any] = None) -> None:
+        """生成の完了後に履歴を更新し、応答時間を詳細情報に記録"""
+        details["回答キャッシュ"] = {"ヒット": False}
+        if cache_key is not None and answer:
+            self.answer_cache.set(cache_key["vector"], cache_key["scope"], cache_key["generation"], query, answer, details)
+        # 往復を履歴に追加（上限を超えた古い往復は要約にまとめる）
+        self.history.add_turn(query, answer)
+        details["会話履歴"] = self.history.stats()
+        details["応答時間"]["最初のトークンまで（秒）"] = round(first_token_seconds, 3)
+        details["応答時間"]["生成全体（秒）"] = round(generation_seconds, 3)
+        print(f"応答時間: 最初のトークンまで {first_token_seconds:.2f}秒, 生成全体 {generation_seconds:.2f}秒")
+
+    def get_response(self, query: str, system_prompt: str = None, response_template: str = None, property_info: str = None, filter: Dict[str, Any] = None,
+                     property_id: str = None, template_name: str = None) -> Tuple[str, Dict[str, Any]]:
+        """クエリに対する応答を生成（会話履歴はサービスが保持する直近の往復と要約を使う）
+        
+        同じ物件・テンプレート・プロンプト・検索フィルタで似た質問に回答済みの場合はキャッシュした回答を返す。
+        """
+        start = time.perf_counter()
+        scope = self._answer_scope(property_id, template_name, system_prompt, response_template, property_info, filter)
+        cache_key, cached = self._lookup_answer(query, scope)
+        if cached is not None:
+            return self._cached_response(query, cached, time.perf_counter() - start)
         
+        chain, inputs, details = self._prepare_response(query, system_prompt, response_template, property_info, filter)
+        
+        # 応答を生成
+        start = time.perf_counter()
+        response = chain.invoke(inputs)
+        elapsed = time.perf_counter() - start
+        
+        # 一括で生成する場合は最初のトークンまでの時間と生成全体の時間が同じになる
+        self._finish_response(query, response.content, details, elapsed, elapsed, cache_key)
         return response.content, details
 
+    def stream_response(self, query: str, system_prompt: str = None, response_template: str = None, property_info: str = None, filter: Dict[str, Any] = None,
+                        property_id: str = None, template_name: str = None) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """クエリに対する応答をトークンごとに返す
+        
+        (トークンのイテレーター, 詳細情報) を返す。文脈の検索はこの呼び出しで行い、
+        履歴の更新と詳細情報の応答時間はイテレーターを最後まで読んだ時点で反映する。
+        回答キャッシュにヒットした場合は回答全体を1回で返す。
+        """
+        start = time.perf_counter()
+        scope = self._answer_scope(property_id, template_name, system_prompt, response_template, property_info, filter)
+        cache_key, cached = self._lookup_answer(query, scope)
+        if cached is not None:
+            answer, details = self._cached_response(query, cached, time.perf_counter() - start)
+            return iter([answer]), details
+        
+        chain, inputs, details = self._prepare_response(query, system_prompt, response_template, property_info, filter)
+        
+        def tokens():
+            start = time.perf_counter()
+            first_token_seconds = None
+            parts = []
+            for chunk in chain.stream(inputs):
+                if not chunk.content:
+                    continue
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - start
+                parts.append(chunk.content)
+                yield chunk.content
+            generation_seconds = time.perf_counter() - start
+            self._finish_response(
+                query,
+                "".join(parts),
+                details,
+                generation_seconds if first_token_seconds is None else first_token_seconds,
+                generation_seconds,
+                cache_key
+            )
+        
+        return tokens(), details
+
+    def load_history(self, messages: List[Dict[str, Any]]):
+        """保存した履歴から会話メモリを作り直す"""
+        self.history.load(messages)
+
     def clear_memory(self):
         """会話メモリをクリア"""
-        self.message_history.clear() 
\ No newline at end of file
+        self.history.clear() 
\ No newline at end of file
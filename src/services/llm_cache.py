@@ -0,0 +1,152 @@
+from typing import Dict, Any, Optional, Sequence
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+from langchain_openai import ChatOpenAI
+from ..config.settings import (
+    OPENAI_API_KEY,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_PATH,
+    LLM_CACHE_MAX_ENTRIES
+)
+
+class LLMCallCache(BaseCache):
+    """(モデルの設定, プロンプト全体) のハッシュをキーとするLLMの応答のディスクキャッシュ
+
+    LangChainのキャッシュとしてChatOpenAIに渡す。モデルの設定（モデル名・temperature・
+    max_tokensなど）はLangChainが作るllm_stringに含まれ、プロンプトはメッセージ全体を
+    シリアライズしたものが渡されるため、どちらかが異なれば別のキーになる。
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # Streamlitの複数セッション（スレッド）から共有するため同一スレッド制約を外す
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                generations TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_access ON completions (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        """キャッシュキーを作成"""
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _dumps(generations: Sequence[Generation]) -> str:
+        return json.dumps([
+            {"message": message_to_dict(generation.message)} if isinstance(generation, ChatGeneration)
+            else {"text": generation.text}
+            for generation in generations
+        ], ensure_ascii=False)
+
+    @staticmethod
+    def _loads(value: str) -> list:
+        return [
+            ChatGeneration(message=messages_from_dict([item["message"]])[0]) if "message" in item
+            else Generation(text=item["text"])
+            for item in json.loads(value)
+        ]
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        """保存した応答を取得（ない場合はNone）"""
+        key = self.make_key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT generations FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return self._loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        """応答を保存"""
+        row = (self.make_key(prompt, llm_string), self._dumps(return_val), time.time())
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, generations, last_access) VALUES (?, ?, ?)",
+                row
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """最大件数を超えた分を最終アクセスの古い順に削除"""
+        count = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY last_access LIMIT ?)",
+                (overflow,)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュの統計情報を取得"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+    def clear(self, **kwargs: Any) -> None:
+        """キャッシュをすべて削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache() -> LLMCallCache:
+    """プロセス内で共有するLLMの応答キャッシュを取得"""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCallCache()
+        return _llm_cache
+
+def create_chat_model(model_name: str = "gpt-3.5-turbo", temperature: float = 0, cache: bool = None, **kwargs: Any) -> ChatOpenAI:
+    """チャットモデルを作成
+
+    応答キャッシュは temperature が0（同じプロンプトに同じ応答が期待できる）の場合のみ
+    使い、それ以外は cache=True を指定した場合のみ使う。cache=False で常に使わない。
+    """
+    if cache is None:
+        cache = temperature == 0
+    return ChatOpenAI(
+        api_key=OPENAI_API_KEY,
+        model_name=model_name,
+        temperature=temperature,
+        cache=get_llm_cache() if cache and LLM_CACHE_ENABLED else False,
+        **kwargs
+    )
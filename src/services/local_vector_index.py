@@ -0,0 +1,485 @@
+from typing import List, Dict, Any, Optional, Iterator
+import atexit
+import json
+import os
+import threading
+import numpy as np
+from .ann_index import IVFFlatIndex, exact_top_k, ann_top_k
+from ..config.settings import (
+    LOCAL_ANN_MIN_VECTORS,
+    LOCAL_ANN_NPROBE
+)
+
+DEFAULT_NAMESPACE = ""
+_DEFAULT_NAMESPACE_FILE = "__default__"
+
+class _Record:
+    """Pineconeのレスポンスと同様に属性・キーの両方でアクセスできる結果オブジェクト
+
+    dictを継承すると values・items・get などのフィールド名が辞書のメソッドと
+    衝突するため、フィールドは属性として保持し、キーでのアクセスも属性に委ねる。
+    """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __getitem__(self, name):
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise KeyError(name) from None
+
+    def __contains__(self, name) -> bool:
+        return name in self.__dict__
+
+    def to_dict(self) -> Dict[str, Any]:
+        """辞書に変換（入れ子の結果オブジェクトも変換する）"""
+        def convert(value):
+            if isinstance(value, _Record):
+                return value.to_dict()
+            if isinstance(value, dict):
+                return {key: convert(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [convert(item) for item in value]
+            return value
+        return {key: convert(value) for key, value in self.__dict__.items()}
+
+    def __repr__(self) -> str:
+        return f"_Record({self.__dict__!r})"
+
+def _matches_condition(value: Any, operator: str, operand: Any) -> bool:
+    """メタデータの値がフィルタ条件（Pineconeのフィルタ演算子）を満たすか判定"""
+    if operator == "$exists":
+        return (value is not None) == bool(operand)
+    if value is None:
+        # 値がない場合は「等しくない」系の条件のみ満たす
+        return operator in ("$ne", "$nin")
+
+    # リスト型の値はいずれかの要素が条件を満たせば一致とみなす
+    values = value if isinstance(value, list) else [value]
+    if operator == "$eq":
+        return operand in values
+    if operator == "$ne":
+        return operand not in values
+    if operator == "$in":
+        return any(v in operand for v in values)
+    if operator == "$nin":
+        return not any(v in operand for v in values)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        try:
+            if operator == "$gt":
+                return value > operand
+            if operator == "$gte":
+                return value >= operand
+            if operator == "$lt":
+                return value < operand
+            return value <= operand
+        except TypeError:
+            return False
+    raise ValueError(f"未対応のフィルタ演算子です: {operator}")
+
+class _Namespace:
+    """1つのnamespaceのベクトル（連続したfloat32行列）と列指向のメタデータ"""
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self._matrix = np.zeros((0, dimension), dtype=np.float32)
+        # メタデータはキーごとの列として保持（値がない行はNone）
+        self.columns: Dict[str, List[Any]] = {}
+        # スパースベクトル（インデックス→値）。ない行はNone
+        self.sparse: List[Optional[Dict[int, float]]] = []
+        # 件数が多い場合に使う近似最近傍インデックス
+        self.ann: Optional[IVFFlatIndex] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """有効な行だけを切り出した行列（コピーなし）"""
+        return self._matrix[:self.size]
+
+    def _reserve(self, size: int) -> None:
+        """行列の容量を倍々で確保"""
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, 64)
+        matrix = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        matrix[:self.size] = self.vectors
+        self._matrix = matrix
+
+    def upsert(self, vector_ids: List[str], values: np.ndarray, metadatas: List[Optional[Dict[str, Any]]],
+               sparse_values: List[Optional[Dict[str, List[Any]]]]) -> None:
+        """複数のベクトルをまとめて追加または上書き（values は行ごとのベクトルの行列）"""
+        previous_size = self.size
+        self._reserve(previous_size + len(vector_ids))
+
+        positions = np.empty(len(vector_ids), dtype=np.int64)
+        for i, vector_id in enumerate(vector_ids):
+            position = self.positions.get(vector_id)
+            if position is None:
+                position = self.size
+                self.ids.append(vector_id)
+                self.positions[vector_id] = position
+                self.sparse.append(None)
+                for column in self.columns.values():
+                    column.append(None)
+            positions[i] = position
+
+            self.sparse[position] = dict(zip(sparse_values[i]["indices"], sparse_values[i]["values"])) if sparse_values[i] else None
+            for key in self.columns:
+                self.columns[key][position] = None
+            for key, value in (metadatas[i] or {}).items():
+                if key not in self.columns:
+                    self.columns[key] = [None] * self.size
+                self.columns[key][position] = value
+
+        self._matrix[positions] = values
+        if self.ann is not None:
+            # 近似最近傍インデックスの割り当ては追加分・上書き分ごとに1回の行列積で求める
+            if self.size > previous_size:
+                self.ann.add(self._matrix[previous_size:self.size])
+            updated = np.unique(positions[positions < previous_size])
+            if len(updated):
+                self.ann.update(updated, self._matrix[updated])
+
+    def delete(self, vector_id: str) -> None:
+        """ベクトルを削除（末尾の行を削除位置へ移動して詰める）"""
+        position = self.positions.pop(vector_id, None)
+        if position is None:
+            return
+
+        if self.ann is not None:
+            self.ann.remove(position)
+
+        last = self.size - 1
+        if position != last:
+            last_id = self.ids[last]
+            self._matrix[position] = self._matrix[last]
+            self.ids[position] = last_id
+            self.positions[last_id] = position
+            self.sparse[position] = self.sparse[last]
+            for column in self.columns.values():
+                column[position] = column[last]
+
+        self.ids.pop()
+        self.sparse.pop()
+        for column in self.columns.values():
+            column.pop()
+
+    def filter_mask(self, filter: Dict[str, Any]) -> np.ndarray:
+        """メタデータフィルタに一致する行のマスクを作成"""
+        mask = np.ones(self.size, dtype=bool)
+        for key, condition in filter.items():
+            if key == "$and":
+                for sub_filter in condition:
+                    mask &= self.filter_mask(sub_filter)
+            elif key == "$or":
+                any_mask = np.zeros(self.size, dtype=bool)
+                for sub_filter in condition:
+                    any_mask |= self.filter_mask(sub_filter)
+                mask &= any_mask
+            else:
+                column = self.columns.get(key, [None] * self.size)
+                if not isinstance(condition, dict):
+                    condition = {"$eq": condition}
+                for operator, operand in condition.items():
+                    mask &= np.fromiter(
+                        (_matches_condition(value, operator, operand) for value in column),
+                        dtype=bool,
+                        count=self.size
+                    )
+        return mask
+
+    def sparse_scores(self, rows: np.ndarray, sparse_vector: Dict[str, List[Any]]) -> np.ndarray:
+        """指定行のスパースベクトルとクエリのスパースベクトルの内積"""
+        weights = dict(zip(sparse_vector["indices"], sparse_vector["values"]))
+        return np.fromiter(
+            (
+                sum(row.get(index, 0.0) * weight for index, weight in weights.items()) if row else 0.0
+                for row in (self.sparse[position] for position in rows)
+            ),
+            dtype=np.float32,
+            count=len(rows)
+        )
+
+    def metadata_at(self, position: int) -> Dict[str, Any]:
+        """指定行のメタデータを辞書として復元"""
+        return {
+            key: column[position]
+            for key, column in self.columns.items()
+            if column[position] is not None
+        }
+
+class LocalVectorIndex:
+    """プロセス内で動作するベクトルインデックス
+
+    Pinecone の Index と同じメソッド（upsert / query / fetch / delete /
+    describe_index_stats）を持ち、PineconeService からそのまま利用できる。
+    ベクトルは正規化して保持し、コサイン類似度の上位K件を行列積1回と
+    argpartition で求める。件数が ann_min_vectors 以上のnamespaceでは
+    IVF-flat の候補だけを採点する（nprobe で再現率と速度を調整）。
+    sparse_vector を指定した場合は Pinecone の dotproduct インデックスと同じく
+    密ベクトルの内積とスパースベクトルの内積の和で全件を採点する。
+    upsert・delete は変更したnamespaceを記録するだけで、ディスクへの保存は
+    flush()（およびプロセスの終了時）にnamespaceごとに1回まとめて行う。
+    """
+
+    def __init__(self, directory: str, dimension: int,
+                 ann_min_vectors: int = LOCAL_ANN_MIN_VECTORS, nprobe: int = LOCAL_ANN_NPROBE):
+        self.directory = directory
+        self.dimension = dimension
+        self.ann_min_vectors = ann_min_vectors
+        self.nprobe = nprobe
+        self._namespaces: Dict[str, _Namespace] = {}
+        # ディスクに保存していない変更があるnamespace
+        self._dirty = set()
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        atexit.register(self.flush)
+
+    def _namespace(self, namespace: Optional[str], create: bool = False) -> Optional[_Namespace]:
+        """namespaceを取得（create=Trueの場合は存在しなければ作成）"""
+        name = namespace or DEFAULT_NAMESPACE
+        if name not in self._namespaces and create:
+            self._namespaces[name] = _Namespace(self.dimension)
+        return self._namespaces.get(name)
+
+    def _as_vector(self, values: Any) -> np.ndarray:
+        """ベクトルをfloat32の配列に変換"""
+        vector = np.asarray(values, dtype=np.float32)
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"ベクトルの次元数が一致しません（期待値: {self.dimension}, 実際: {vector.shape}）")
+        return vector
+
+    def _normalize(self, values: Any) -> np.ndarray:
+        """ベクトルをfloat32の単位ベクトルに変換"""
+        vector = self._as_vector(values)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = None, **kwargs) -> Dict[str, Any]:
+        """ベクトルを追加または上書き"""
+        if not vectors:
+            return _Record(upserted_count=0)
+        values = np.stack([self._as_vector(vector["values"]) for vector in vectors])
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values /= np.where(norms > 0, norms, 1)
+        with self._lock:
+            ns = self._namespace(namespace, create=True)
+            ns.upsert(
+                [vector["id"] for vector in vectors],
+                values,
+                [vector.get("metadata") for vector in vectors],
+                [vector.get("sparse_values") for vector in vectors]
+            )
+            self._dirty.add(namespace or DEFAULT_NAMESPACE)
+            return _Record(upserted_count=len(vectors))
+
+    def _ensure_ann(self, ns: _Namespace, namespace: Optional[str]) -> Optional[IVFFlatIndex]:
+        """件数に応じて近似最近傍インデックスを作成・再学習"""
+        if ns.size < self.ann_min_vectors:
+            ns.ann = None
+        elif ns.ann is None or ns.size > ns.ann.trained_size * 4:
+            # 学習時から大きく増えた場合は重心が偏るため再学習する
+            print(f"近似最近傍インデックスを学習中... ({ns.size}件)")
+            ns.ann = IVFFlatIndex.train(ns.vectors, nprobe=self.nprobe)
+            self._dirty.add(namespace or DEFAULT_NAMESPACE)
+        return ns.ann
+
+    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = False,
+              namespace: str = None, include_values: bool = False, filter: Dict[str, Any] = None,
+              nprobe: int = None, exact: bool = False, sparse_vector: Dict[str, List[Any]] = None,
+              **kwargs) -> Dict[str, Any]:
+        """コサイン類似度の上位K件を検索（filterでメタデータによる絞り込み）"""
+        with self._lock:
+            ns = self._namespace(namespace)
+            if ns is None or ns.size == 0 or top_k <= 0:
+                return _Record(matches=[], namespace=namespace or DEFAULT_NAMESPACE)
+
+            # ハイブリッド検索では重み付け済みのクエリを正規化せずに使う
+            query_vector = self._as_vector(vector) if sparse_vector else self._normalize(vector)
+            if sparse_vector:
+                # 密ベクトルとスパースベクトルの内積の和で全件（フィルタ後）を採点する
+                rows = np.nonzero(ns.filter_mask(filter))[0] if filter else np.arange(ns.size)
+                if len(rows) == 0:
+                    return _Record(matches=[], namespace=namespace or DEFAULT_NAMESPACE)
+                row_scores = ns.vectors[rows] @ query_vector + ns.sparse_scores(rows, sparse_vector)
+                count = min(top_k, len(rows))
+                top = np.argpartition(-row_scores, count - 1)[:count]
+                top = top[np.argsort(-row_scores[top], kind="stable")]
+                scores = row_scores[top]
+                top = rows[top]
+            elif filter:
+                # フィルタで絞り込んだ行だけを採点する
+                rows = np.nonzero(ns.filter_mask(filter))[0]
+                if len(rows) == 0:
+                    return _Record(matches=[], namespace=namespace or DEFAULT_NAMESPACE)
+                top = rows[exact_top_k(ns.vectors[rows], query_vector, top_k)]
+                scores = ns.vectors[top] @ query_vector
+            else:
+                ann = None if exact else self._ensure_ann(ns, namespace)
+                top = ann_top_k(ann, ns.vectors, query_vector, top_k, nprobe) if ann is not None else None
+                if top is None or len(top) < min(top_k, ns.size):
+                    # 候補が足りない場合は全件を採点する
+                    top = exact_top_k(ns.vectors, query_vector, top_k)
+                scores = ns.vectors[top] @ query_vector
+
+            matches = [
+                _Record(
+                    id=ns.ids[position],
+                    score=float(score),
+                    values=ns.vectors[position].tolist() if include_values else [],
+                    metadata=ns.metadata_at(position) if include_metadata else None
+                )
+                for position, score in zip(top, scores)
+            ]
+            return _Record(matches=matches, namespace=namespace or DEFAULT_NAMESPACE)
+
+    def fetch(self, ids: List[str], namespace: str = None, **kwargs) -> Dict[str, Any]:
+        """IDを指定してベクトルを取得"""
+        with self._lock:
+            ns = self._namespace(namespace)
+            vectors = {}
+            if ns is not None:
+                for vector_id in ids:
+                    position = ns.positions.get(vector_id)
+                    if position is not None:
+                        vectors[vector_id] = _Record(
+                            id=vector_id,
+                            values=ns.vectors[position].tolist(),
+                            metadata=ns.metadata_at(position)
+                        )
+            return _Record(vectors=vectors, namespace=namespace or DEFAULT_NAMESPACE)
+
+    def list(self, prefix: str = None, limit: int = 100, namespace: str = None, **kwargs) -> Iterator[List[str]]:
+        """IDをページ単位で列挙（呼び出し時点のIDの一覧を返す）"""
+        with self._lock:
+            ns = self._namespace(namespace)
+            ids = sorted(ns.ids) if ns is not None else []
+        if prefix:
+            ids = [vector_id for vector_id in ids if vector_id.startswith(prefix)]
+        for i in range(0, len(ids), limit):
+            yield ids[i:i + limit]
+
+    def delete(self, ids: List[str] = None, delete_all: bool = False, namespace: str = None, **kwargs) -> Dict[str, Any]:
+        """ベクトルを削除"""
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace or DEFAULT_NAMESPACE, None)
+            else:
+                ns = self._namespace(namespace)
+                if ns is not None:
+                    for vector_id in ids or []:
+                        ns.delete(vector_id)
+            self._dirty.add(namespace or DEFAULT_NAMESPACE)
+            return _Record()
+
+    def flush(self) -> None:
+        """変更したnamespaceの内容をディスクに保存"""
+        with self._lock:
+            for name in sorted(self._dirty):
+                self._save(name)
+            self._dirty.clear()
+
+    def describe_index_stats(self, namespace: str = None, **kwargs) -> Dict[str, Any]:
+        """インデックスの統計情報を取得"""
+        with self._lock:
+            namespaces = {
+                name: _Record(vector_count=ns.size)
+                for name, ns in self._namespaces.items()
+                if ns.size > 0
+            }
+            return _Record(
+                dimension=self.dimension,
+                index_fullness=0.0,
+                total_vector_count=sum(ns.vector_count for ns in namespaces.values()),
+                namespaces=namespaces
+            )
+
+    def _paths(self, namespace: Optional[str]) -> tuple:
+        """namespaceの保存先ファイル（ベクトル, メタデータ, 近似最近傍インデックス）"""
+        name = namespace or _DEFAULT_NAMESPACE_FILE
+        return (
+            os.path.join(self.directory, f"{name}.npy"),
+            os.path.join(self.directory, f"{name}.json"),
+            os.path.join(self.directory, f"{name}.ivf.npz")
+        )
+
+    def _save(self, namespace: Optional[str]) -> None:
+        """namespaceの内容をディスクに保存"""
+        vectors_path, metadata_path, ann_path = self._paths(namespace)
+        ns = self._namespace(namespace)
+        if ns is None or ns.size == 0:
+            for path in (vectors_path, metadata_path, ann_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        np.save(vectors_path, ns.vectors)
+        with open(metadata_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "ids": ns.ids,
+                "columns": ns.columns,
+                # JSONのキーは文字列になるため [インデックス, 値] の組で保存
+                "sparse": [list(row.items()) if row else None for row in ns.sparse]
+            }, f, ensure_ascii=False)
+        if ns.ann is not None:
+            ns.ann.save(ann_path)
+        elif os.path.exists(ann_path):
+            os.remove(ann_path)
+
+    def _load(self) -> None:
+        """保存済みのnamespaceをディスクから読み込み"""
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            name = filename[:-len(".json")]
+            vectors_path, metadata_path, ann_path = self._paths(None if name == _DEFAULT_NAMESPACE_FILE else name)
+            if not os.path.exists(vectors_path):
+                continue
+
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            vectors = np.load(vectors_path).astype(np.float32, copy=False)
+
+            ns = _Namespace(self.dimension)
+            ns.ids = data["ids"]
+            ns.positions = {vector_id: position for position, vector_id in enumerate(ns.ids)}
+            ns.columns = data["columns"]
+            ns.sparse = [
+                {int(index): value for index, value in row} if row else None
+                for row in data.get("sparse", [None] * len(ns.ids))
+            ]
+            ns._matrix = np.ascontiguousarray(vectors)
+            if os.path.exists(ann_path):
+                ann = IVFFlatIndex.load(ann_path)
+                # 保存時の行数と一致しない場合は次回検索時に再学習する
+                if len(ann.assignments) == ns.size:
+                    ann.nprobe = self.nprobe
+                    ns.ann = ann
+            self._namespaces[DEFAULT_NAMESPACE if name == _DEFAULT_NAMESPACE_FILE else name] = ns
+
+_local_indexes: Dict[str, LocalVectorIndex] = {}
+_local_indexes_lock = threading.Lock()
+
+def get_local_vector_index(directory: str, dimension: int) -> LocalVectorIndex:
+    """プロセス内で共有するローカルインデックスを取得（保存先ディレクトリごとに1つ）
+
+    Streamlitの再実行やセッションごとに作り直すと、ディスクからの読み込みが毎回走り、
+    インスタンスごとのメモリ上の内容が互いの保存を上書きしてしまうため共有する。
+    """
+    key = os.path.abspath(directory)
+    with _local_indexes_lock:
+        index = _local_indexes.get(key)
+        if index is None:
+            index = LocalVectorIndex(directory, dimension)
+            _local_indexes[key] = index
+        elif index.dimension != dimension:
+            raise ValueError(f"ローカルインデックスの次元数が一致しません（保存先: {directory}, 期待値: {dimension}, 実際: {index.dimension}）")
+        return index
@@ -1,10 +1,10 @@
 from typing import Dict, Any, List, Optional
 from dataclasses import dataclass
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from src.config.settings import OPENAI_API_KEY
+from src.services.llm_cache import create_chat_model
 import json
 
 @dataclass
@@ -19,10 +19,8 @@ class MetadataProcessor:
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY is not set in settings")
         
-        self.llm = ChatOpenAI(
-            model_name=model_name,
-            openai_api_key=OPENAI_API_KEY
-        )
+        # メタデータの抽出は同じ入力に同じ結果を返すよう temperature 0 とする（応答キャッシュも既定で使われる）
+        self.llm = create_chat_model(model_name=model_name, temperature=0)
         
         # 質問タイプごとのメタデータフィールド定義
         self.metadata_fields = {
@@ -1,18 +1,75 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Iterator, Iterable
+from itertools import islice
 from pinecone import Pinecone, ServerlessSpec
 from openai import OpenAI
+import queue
+import threading
 import time
+from .local_vector_index import get_local_vector_index
+from .embedding_cache import get_embedding_cache, normalize_text
+from .sparse_encoder import get_sparse_encoder, scale_hybrid_vectors
+from .property_catalog import PROPERTY_NAMESPACE, get_property_catalog
+from .pipeline_stats import PipelineStats
+from .upsert_batcher import get_upsert_batcher
+from .dead_letter import get_dead_letter_queue
+from .chunk_text_store import get_chunk_text_store
+from .ingest_manifest import get_ingest_manifest, chunk_hash
+from .rate_limiter import (
+    get_openai_rate_limiter,
+    backoff_delay,
+    is_rate_limit_error,
+    get_retry_after
+)
+from ..utils.cache import LRUCache
+from ..utils.token_counter import count_tokens, get_token_counter
+from ..utils.context_packer import build_context_header
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from ..config.settings import (
     PINECONE_API_KEY,
     PINECONE_INDEX_NAME,
+    VECTOR_BACKEND,
+    LOCAL_INDEX_DIR,
     OPENAI_API_KEY,
     EMBEDDING_MODEL,
+    EMBEDDING_DIMENSION,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_BATCH_MAX_INPUTS,
+    EMBEDDING_MAX_WORKERS,
+    UPSERT_QUEUE_SIZE,
     BATCH_SIZE,
+    FETCH_BATCH_SIZE,
+    DELETE_BATCH_SIZE,
+    DEAD_LETTER_MAX_ATTEMPTS,
+    DEAD_LETTER_REPLAY_LIMIT,
     DEFAULT_TOP_K,
-    SIMILARITY_THRESHOLD
+    SIMILARITY_THRESHOLD,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    SPARSE_VECTORS_ENABLED,
+    HYBRID_ALPHA,
+    CHUNK_TEXT_STORE_ENABLED,
+    INDEX_METADATA_KEYS
 )
 import json
 
+# 検索クエリの埋め込みベクトルのキャッシュ（プロセス内で共有）
+_query_vector_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を見積もる（tiktokenが使えない場合はBPEトークン数の上限となるUTF-8のバイト数）"""
+    return count_tokens(text)
+
+def context_token_count(chunk: Dict[str, Any]) -> int:
+    """参照文脈の配分に使うチャンクのトークン数
+    
+    tiktokenで数えた場合はチャンク分割時のトークン数をそのまま使い、バイト数で
+    見積もった場合（日本語では実際の2〜3倍）は文字数で見積もり直す。
+    """
+    token_count = chunk.get("metadata", {}).get("token_count")
+    if token_count and get_token_counter().is_exact:
+        return token_count
+    return get_token_counter().estimate(chunk["text"])
+
 class PineconeService:
     def __init__(self):
         """Pineconeサービスの初期化"""
@@ -22,16 +79,36 @@ class PineconeService:
                 raise ValueError("OpenAI APIキーが設定されていません")
             self.openai_client = OpenAI(api_key=OPENAI_API_KEY)
             
-            # Pineconeの初期化
-            if not PINECONE_API_KEY:
-                raise ValueError("Pinecone APIキーが設定されていません")
-            if not PINECONE_INDEX_NAME:
-                raise ValueError("Pineconeインデックス名が設定されていません")
-            
-            self.pc = Pinecone(api_key=PINECONE_API_KEY)
+            # 埋め込みベクトルキャッシュ（プロセス内で共有）
+            self.embedding_cache = get_embedding_cache()
+            # 埋め込みAPIのレートリミッター（全セッションで共有）
+            self.rate_limiter = get_openai_rate_limiter()
+            # BM25スパースベクトルのエンコーダー（ハイブリッド検索が有効な場合のみ）
+            self.sparse_encoder = get_sparse_encoder() if SPARSE_VECTORS_ENABLED else None
+            # ファイルごとのアップロード済みチャンクの記録（差分アップロード用）
+            self.manifest = get_ingest_manifest()
+            # upsertのリクエストサイズの上限はアップロードをまたいで学習する（プロセス内で共有）
+            self.upsert_batcher = get_upsert_batcher()
+            # アップロードに失敗したチャンクの記録（後から再送する）
+            self.dead_letters = get_dead_letter_queue()
+            # チャンクの本文ストア（有効な場合はフィルタ用のキー以外をインデックスのメタデータに含めない）
+            self.text_store = get_chunk_text_store() if CHUNK_TEXT_STORE_ENABLED else None
             
-            # インデックスの存在確認と初期化
-            self._initialize_index()
+            if VECTOR_BACKEND == "local":
+                # プロセス内で共有するローカルインデックスを使用
+                self.index = get_local_vector_index(LOCAL_INDEX_DIR, EMBEDDING_DIMENSION)
+                print(f"ローカルインデックス '{LOCAL_INDEX_DIR}' を使用します")
+            else:
+                # Pineconeの初期化
+                if not PINECONE_API_KEY:
+                    raise ValueError("Pinecone APIキーが設定されていません")
+                if not PINECONE_INDEX_NAME:
+                    raise ValueError("Pineconeインデックス名が設定されていません")
+                
+                self.pc = Pinecone(api_key=PINECONE_API_KEY)
+                
+                # インデックスの存在確認と初期化
+                self._initialize_index()
             
             # インデックスの次元数を取得
             stats = self.index.describe_index_stats()
@@ -61,8 +138,9 @@ class PineconeService:
                     )
                     self.pc.create_index(
                         name=PINECONE_INDEX_NAME,
-                        dimension=1536,  # OpenAIの埋め込みモデルの次元数
-                        metric="cosine",
+                        dimension=EMBEDDING_DIMENSION,  # OpenAIの埋め込みモデルの次元数
+                        # スパースベクトルを併用する場合はdotproductが必要
+                        metric="dotproduct" if SPARSE_VECTORS_ENABLED else "cosine",
                         spec=spec
                     )
                     print(f"インデックス '{PINECONE_INDEX_NAME}' の作成を開始しました")
@@ -88,163 +166,564 @@ class PineconeService:
                 else:
                     raise Exception(f"インデックスの初期化に失敗しました（最大試行回数到達）: {str(e)}")
 
-    def get_embedding(self, text: str) -> List[float]:
-        """テキストの埋め込みベクトルを取得"""
-        max_retries = 3
-        retry_delay = 1  # seconds
+    def _create_embeddings(self, texts: List[str], max_retries: int = 3) -> List[List[float]]:
+        """埋め込みAPIを呼び出す（共有レートリミッターで流量を制御し、失敗時はジッター付きで再試行）"""
+        tokens = sum(estimate_tokens(text) for text in texts)
         
         for attempt in range(max_retries):
             try:
+                self.rate_limiter.acquire(tokens)
                 response = self.openai_client.embeddings.create(
                     model=EMBEDDING_MODEL,
-                    input=text
+                    input=texts
                 )
-                return response.data[0].embedding
+                self.rate_limiter.report_success()
+                # レスポンスの順序は保証されないため、入力順に並べ直す
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
             except Exception as e:
+                if is_rate_limit_error(e):
+                    # 429の場合は全スレッドを一時停止させる（待機はacquireで行う）
+                    delay = self.rate_limiter.report_rate_limit(get_retry_after(e))
+                else:
+                    delay = backoff_delay(attempt)
                 if attempt < max_retries - 1:
                     print(f"埋め込みベクトルの生成に失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
-                    print(f"{retry_delay}秒後に再試行します...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
+                    print(f"{delay:.1f}秒後に再試行します...")
+                    if not is_rate_limit_error(e):
+                        time.sleep(delay)
                 else:
                     raise Exception(f"埋め込みベクトルの生成に失敗しました（最大試行回数到達）: {str(e)}")
 
-    def upload_chunks(self, chunks: List[Dict[str, Any]], namespace: str = None, batch_size: int = BATCH_SIZE) -> None:
-        """チャンクをPineconeにアップロード"""
-        if not chunks:
-            print("アップロードするチャンクがありません")
-            return
+    def get_embedding(self, text: str) -> List[float]:
+        """テキストの埋め込みベクトルを取得"""
+        cached = self.embedding_cache.get(EMBEDDING_MODEL, text)
+        if cached is not None:
+            return cached
+        
+        vector = self._create_embeddings([text])[0]
+        self.embedding_cache.put(EMBEDDING_MODEL, text, vector)
+        return vector
+
+    def get_embeddings(self, texts: List[str], max_retries: int = 3) -> List[List[float]]:
+        """複数テキストの埋め込みベクトルを1回のAPI呼び出しで取得（キャッシュ済みのものは再利用）"""
+        vectors = self.embedding_cache.get_many(EMBEDDING_MODEL, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if not missing:
+            return vectors
+        if len(missing) < len(texts):
+            print(f"  キャッシュ済み: {len(texts) - len(missing)}件, 新規生成: {len(missing)}件")
+        missing_texts = [texts[i] for i in missing]
+        
+        new_vectors = self._create_embeddings(missing_texts, max_retries=max_retries)
+        self.embedding_cache.put_many(EMBEDDING_MODEL, missing_texts, new_vectors)
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+        return vectors
 
-        try:
-            total_chunks = len(chunks)
-            print(f"アップロード開始: 合計{total_chunks}件のチャンク")
+    def _group_by_token_budget(self, chunks: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """チャンクを埋め込みAPIの入力上限に収まるグループに分割"""
+        groups = []
+        current_group = []
+        current_tokens = 0
+        
+        for chunk in chunks:
+            # チャンク分割時に数えたトークン数があればそれを使う
+            tokens = chunk.get("metadata", {}).get("token_count") or estimate_tokens(chunk["text"])
+            if current_group and (
+                current_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS
+                or len(current_group) >= EMBEDDING_BATCH_MAX_INPUTS
+            ):
+                groups.append(current_group)
+                current_group = []
+                current_tokens = 0
+            current_group.append(chunk)
+            current_tokens += tokens
+        
+        if current_group:
+            groups.append(current_group)
+        
+        return groups
+
+    def _embed_chunks(self, chunks: List[Dict[str, Any]]) -> Tuple[Dict[str, List[float]], List[Tuple[Dict[str, Any], str]]]:
+        """チャンクをまとめて埋め込み、チャンクIDと埋め込みベクトルの対応を返す
+        
+        失敗したグループは半分ずつに分割して再試行し、単独でも失敗したチャンクは
+        (チャンク, エラー内容) のリストとして返す。
+        """
+        embeddings = {}
+        failed = []
+        
+        valid_chunks = []
+        for chunk in chunks:
+            if not chunk.get("id"):
+                failed.append((chunk, "チャンクIDがありません"))
+            elif not chunk.get("text"):
+                failed.append((chunk, "テキストが空です"))
+            else:
+                valid_chunks.append(chunk)
+        
+        # (グループ, 分割済みかどうか) を先頭のグループから処理するため逆順に積む
+        pending = [(group, False) for group in self._group_by_token_budget(valid_chunks)][::-1]
+        while pending:
+            group, is_split = pending.pop()
+            # 分割後のサブバッチは再試行せず、単独のチャンクのみ通常どおり再試行する
+            max_retries = 1 if is_split and len(group) > 1 else 3
+            try:
+                print(f"  {len(group)}件のチャンクの埋め込みベクトルを生成中...")
+                vectors = self.get_embeddings([chunk["text"] for chunk in group], max_retries=max_retries)
+                for chunk, vector in zip(group, vectors):
+                    embeddings[chunk["id"]] = vector
+            except Exception as e:
+                if len(group) > 1:
+                    middle = len(group) // 2
+                    print(f"  {len(group)}件のチャンクを分割して再試行します: {str(e)}")
+                    pending.append((group[middle:], True))
+                    pending.append((group[:middle], True))
+                else:
+                    print(f"  チャンク {group[0]['id']} の処理中にエラーが発生しました: {str(e)}")
+                    failed.append((group[0], str(e)))
+        
+        return embeddings, failed
+
+    def _build_metadata(self, chunk: Dict[str, Any]) -> Dict[str, Any]:
+        """チャンクからベクトルに付けるメタデータ（本文を含む）を作成
+        
+        空の値（""・None）は含めない。インデックスに保存する際は _split_metadata で
+        フィルタ用のキーとそれ以外に分ける。
+        """
+        chunk_metadata = chunk.get("metadata", {})
+        metadata = {
+            "text": chunk["text"],
+            "filename": chunk.get("filename", ""),
+            "chunk_id": chunk.get("chunk_id", ""),
+            "main_category": chunk_metadata.get("main_category", ""),
+            "sub_category": chunk_metadata.get("sub_category", ""),
+            "city": chunk_metadata.get("city", ""),
+            "created_date": chunk_metadata.get("created_date", ""),
+            "upload_date": chunk_metadata.get("upload_date", ""),
+            "source": chunk_metadata.get("source", ""),
+            # 参照文脈の配分に使うトークン数（回答生成時に数え直さない）
+            "token_count": context_token_count(chunk),
+            # レコードの種類（施設CSVの行か文書のチャンクか）。検索時のフィルタに使用
+            "record_type": "facility" if chunk_metadata.get("facility_name") else "document",
+            # CSVファイルのメタデータ
+            "facility_name": chunk_metadata.get("facility_name", ""),
+            "latitude": chunk_metadata.get("latitude"),
+            "longitude": chunk_metadata.get("longitude"),
+            "walking_distance": chunk_metadata.get("walking_distance"),
+            "walking_minutes": chunk_metadata.get("walking_minutes"),
+            "straight_distance": chunk_metadata.get("straight_distance")
+        }
+        metadata = {key: value for key, value in metadata.items() if value is not None and value != ""}
+        # 回答生成時の参照文脈の見出しとそのトークン数はアップロード時に作成しておく
+        header = build_context_header(metadata)
+        if header:
+            metadata["context_header"] = header
+            metadata["context_header_tokens"] = get_token_counter().estimate(header)
+        return metadata
+
+    def _split_metadata(self, metadata: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """メタデータを (インデックスに保存する分, 本文ストアに保存する分) に分ける
+        
+        本文ストアが有効な場合はフィルタに使うキーだけをインデックスに残し、本文と
+        表示用のメタデータは本文ストアに保存する。無効な場合はすべてインデックスに保存する。
+        """
+        if self.text_store is None:
+            return metadata, {}
+        index_metadata = {key: value for key, value in metadata.items() if key in INDEX_METADATA_KEYS}
+        stored = {key: value for key, value in metadata.items() if key not in INDEX_METADATA_KEYS}
+        return index_metadata, stored
+
+    def hydrate_metadata(self, records: List[Any], namespace: str = None) -> List[Any]:
+        """本文をメタデータに持たないレコード（検索結果・取得結果）に本文ストアの本文と表示用のメタデータを補う
+        
+        records は metadata 属性またはキーを持つオブジェクトのリストで、本文ストアは
+        まとめて1回だけ問い合わせる。本文ストアにない場合は本文を空文字とする。
+        """
+        def metadata_of(record):
+            return record["metadata"] if isinstance(record, dict) else record.metadata
+        
+        def id_of(record):
+            return record["id"] if isinstance(record, dict) else record.id
+        
+        missing = [record for record in records if metadata_of(record) is not None and "text" not in metadata_of(record)]
+        if not missing:
+            return records
+        stored = self.text_store.get_many([id_of(record) for record in missing], namespace) if self.text_store is not None else {}
+        for record in missing:
+            metadata_of(record).update(stored.get(id_of(record), {"text": ""}))
+        return records
+
+    def _upsert_batch(self, batch_num: int, batch: List[Dict[str, Any]], embeddings: Dict[str, List[float]], namespace: str = None) -> List[Tuple[Dict[str, Any], str]]:
+        """埋め込み済みのバッチをPineconeにアップロード
+        
+        リクエストのサイズ・件数の上限に合わせて分割し、単独でも上限を超えた
+        チャンクを (チャンク, エラー内容) のリストとして返す。
+        """
+        vectors = []
+        chunks_by_id = {}
+        stored_records = {}
+        for chunk in batch:
+            if chunk.get("id") not in embeddings:
+                continue
             
-            # チャンクをバッチに分割
-            for i in range(0, len(chunks), batch_size):
-                batch = chunks[i:i + batch_size]
-                batch_num = i // batch_size + 1
-                print(f"\nバッチ {batch_num} を処理中... ({len(batch)}件)")
-                
-                # バッチ内の各チャンクの埋め込みベクトルを取得
-                vectors = []
-                retry_chunks = []  # 再試行が必要なチャンク
-                
-                for j, chunk in enumerate(batch, 1):
+            # メタデータの設定（CSVファイルのメタデータを含める）
+            metadata, stored = self._split_metadata(self._build_metadata(chunk))
+            
+            # デバッグ情報の表示
+            print(f"  メタデータ: {json.dumps(metadata, ensure_ascii=False)}")
+            
+            chunks_by_id[chunk["id"]] = chunk
+            if stored:
+                stored_records[chunk["id"]] = stored
+            vectors.append({
+                "id": chunk["id"],
+                "values": embeddings[chunk["id"]],
+                "metadata": metadata
+            })
+        
+        if not vectors:
+            return []
+        
+        if self.sparse_encoder is not None:
+            # スパースベクトルはローカルで計算し、密ベクトルと同じupsertで送る
+            sparse_vectors = self.sparse_encoder.encode_documents(
+                [chunks_by_id[vector["id"]]["text"] for vector in vectors],
+                [vector["id"] for vector in vectors],
+                namespace
+            )
+            for vector, sparse_values in zip(vectors, sparse_vectors):
+                if sparse_values["indices"]:
+                    vector["sparse_values"] = sparse_values
+        
+        if self.text_store is not None:
+            # 検索結果に本文のないベクトルが返らないよう、本文はupsertより先に保存する
+            self.text_store.put_many(stored_records, namespace)
+        
+        failed = self.upsert_batcher.upsert(
+            lambda request: self.index.upsert(vectors=request, namespace=namespace),
+            vectors,
+            label=f"バッチ {batch_num} "
+        )
+        # インデックスの内容が変わったので、古い内容に基づく回答キャッシュを無効にする
+        self.manifest.bump_generation()
+        print(f"  バッチ {batch_num} のアップロードが完了しました")
+        return [(chunks_by_id[vector_id], reason) for vector_id, reason in failed]
+
+    def _embed_batch(self, batch: List[Dict[str, Any]], stats: PipelineStats) -> Tuple[Dict[str, List[float]], List[Tuple[Dict[str, Any], str]]]:
+        """バッチを埋め込み、処理時間を記録"""
+        start = time.perf_counter()
+        result = self._embed_chunks(batch)
+        stats.record("embed", len(batch), time.perf_counter() - start)
+        return result
+
+    def upload_chunks(self, chunks: Iterable[Dict[str, Any]], namespace: str = None, batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+        """チャンクをPineconeにアップロード
+        
+        チャンクの読み出し → 埋め込み生成 → アップロード の各段を上限付きのキューでつなぎ、
+        バッチNのアップロード中に後続バッチの埋め込みを生成する。chunks はリストのほか
+        ジェネレーターも渡せ、先行して読み出すバッチ数はキューの上限までに抑える。
+        段ごとのスループットを集計して返す。
+        """
+        stats = PipelineStats(["chunk", "embed", "upsert"])
+        failed_chunks = []
+        # アップロードの失敗で中断したチャンク
+        aborted_chunks = []
+        upsert_errors = []
+        upsert_queue = queue.Queue(maxsize=UPSERT_QUEUE_SIZE)
+        
+        def upsert_worker():
+            while True:
+                wait_start = time.perf_counter()
+                item = upsert_queue.get()
+                stats.record_wait("upsert", time.perf_counter() - wait_start)
+                if item is None:
+                    return
+                batch_num, batch, embeddings = item
+                # 既にキューで待っているバッチはまとめて1回のアップロードにする
+                finished = False
+                while True:
                     try:
-                        print(f"  チャンク {j}/{len(batch)} の埋め込みベクトルを生成中...")
-                        vector = self.get_embedding(chunk["text"])
-                        
-                        # メタデータの設定（CSVファイルのメタデータを含める）
-                        metadata = {
-                            "text": chunk["text"],
-                            "filename": chunk.get("filename", ""),
-                            "chunk_id": chunk.get("chunk_id", ""),
-                            "main_category": chunk.get("metadata", {}).get("main_category", ""),
-                            "sub_category": chunk.get("metadata", {}).get("sub_category", ""),
-                            "city": chunk.get("metadata", {}).get("city", ""),
-                            "created_date": chunk.get("metadata", {}).get("created_date", ""),
-                            "upload_date": chunk.get("metadata", {}).get("upload_date", ""),
-                            "source": chunk.get("metadata", {}).get("source", ""),
-                            # CSVファイルのメタデータ
-                            "facility_name": chunk.get("metadata", {}).get("facility_name", ""),
-                            "latitude": chunk.get("metadata", {}).get("latitude"),
-                            "longitude": chunk.get("metadata", {}).get("longitude"),
-                            "walking_distance": chunk.get("metadata", {}).get("walking_distance"),
-                            "walking_minutes": chunk.get("metadata", {}).get("walking_minutes"),
-                            "straight_distance": chunk.get("metadata", {}).get("straight_distance")
-                        }
+                        queued = upsert_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if queued is None:
+                        finished = True
+                        break
+                    batch = batch + queued[1]
+                    embeddings = {**embeddings, **queued[2]}
+                embedded = [chunk for chunk in batch if chunk.get("id") in embeddings]
+                if upsert_errors:
+                    # 失敗後は残りのバッチをアップロードせずにデッドレターに回し、読み出し側を止めない
+                    aborted_chunks.extend((chunk, "先行バッチのアップロード失敗により中断") for chunk in embedded)
+                else:
+                    start = time.perf_counter()
+                    try:
+                        failed = self._upsert_batch(batch_num, batch, embeddings, namespace)
+                        failed_chunks.extend(failed)
+                        failed_ids = {chunk.get("id") for chunk, _ in failed}
+                        self.dead_letters.resolve([chunk["id"] for chunk in embedded if chunk["id"] not in failed_ids], namespace)
+                        stats.record("upsert", len(embeddings), time.perf_counter() - start)
+                    except Exception as e:
+                        upsert_errors.append(e)
+                        aborted_chunks.extend((chunk, str(e)) for chunk in embedded)
+                if finished:
+                    return
+        
+        def enqueue_upsert(batch_num, batch, future):
+            embeddings, failed = future.result()
+            failed_chunks.extend(failed)
+            wait_start = time.perf_counter()
+            upsert_queue.put((batch_num, batch, embeddings))
+            # キューが満杯の間はアップロードの完了を待つ（背圧）
+            stats.record_wait("embed", time.perf_counter() - wait_start)
+
+        try:
+            print("アップロード開始")
+            total_chunks = 0
+            total_tokens = 0
+            chunk_iterator = iter(chunks)
+            upserter = threading.Thread(target=upsert_worker, daemon=True)
+            upserter.start()
+            
+            try:
+                # 複数バッチの埋め込みを並列に生成し、完了したバッチから順にアップロード段へ渡す
+                with ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS) as executor:
+                    in_flight = deque()
+                    batch_num = 0
+                    while not upsert_errors:
+                        start = time.perf_counter()
+                        batch = list(islice(chunk_iterator, batch_size))
+                        stats.record("chunk", len(batch), time.perf_counter() - start)
+                        if not batch:
+                            break
                         
-                        # デバッグ情報の表示
-                        print(f"  メタデータ: {json.dumps(metadata, ensure_ascii=False)}")
+                        batch_num += 1
+                        total_chunks += len(batch)
+                        total_tokens += sum(
+                            chunk.get("metadata", {}).get("token_count") or estimate_tokens(chunk["text"])
+                            for chunk in batch
+                        )
+                        print(f"\nバッチ {batch_num} を処理中... ({len(batch)}件)")
+                        in_flight.append((batch_num, batch, executor.submit(self._embed_batch, batch, stats)))
                         
-                        vectors.append({
-                            "id": chunk["id"],
-                            "values": vector,
-                            "metadata": metadata
-                        })
-                    except Exception as e:
-                        print(f"  チャンク {chunk['id']} の処理中にエラーが発生しました: {str(e)}")
-                        retry_chunks.append(chunk)
-                        continue
-                
-                if vectors:
-                    max_retries = 3
-                    retry_delay = 2
+                        # 先行して埋め込むバッチ数をワーカー数までに制限
+                        while len(in_flight) > EMBEDDING_MAX_WORKERS:
+                            enqueue_upsert(*in_flight.popleft())
                     
-                    for attempt in range(max_retries):
-                        try:
-                            # バッチをアップロード（namespaceを指定）
-                            print(f"  {len(vectors)}件のベクトルをアップロード中...")
-                            self.index.upsert(vectors=vectors, namespace=namespace)
-                            print(f"  バッチ {batch_num} のアップロードが完了しました")
-                            break
-                        except Exception as e:
-                            if attempt < max_retries - 1:
-                                print(f"  バッチ {batch_num} のアップロードに失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
-                                print(f"  {retry_delay}秒後に再試行します...")
-                                time.sleep(retry_delay)
-                                retry_delay *= 2
-                            else:
-                                raise Exception(f"バッチ {batch_num} のアップロードに失敗しました（最大試行回数到達）: {str(e)}")
-                
-                # 失敗したチャンクを再試行
-                if retry_chunks:
-                    print(f"\n失敗したチャンク {len(retry_chunks)}件 を再試行します...")
-                    self.upload_chunks(retry_chunks, namespace, batch_size)
+                    while in_flight:
+                        enqueue_upsert(*in_flight.popleft())
+            finally:
+                upsert_queue.put(None)
+                upserter.join()
+                # ローカルインデックスはアップロードごとに1回だけディスクに保存する
+                self.flush_index()
             
-            print("\nアップロード完了")
+            if upsert_errors:
+                self.dead_letters.add(failed_chunks + aborted_chunks, namespace)
+                raise Exception(
+                    f"{str(upsert_errors[0])}（{len(failed_chunks) + len(aborted_chunks)}件のチャンクをデッドレターに記録しました）"
+                )
+            
+            if total_chunks == 0:
+                print("アップロードするチャンクがありません")
+                return {
+                    "total_chunks": 0,
+                    "succeeded_chunks": 0,
+                    "embedded_tokens": 0,
+                    "failed_chunks": 0,
+                    "failed_ids": [],
+                    "failures": [],
+                    **stats.report()
+                }
+            
+            if failed_chunks:
+                # 失敗したチャンクはその場で再試行せず、デッドレターに記録して後から再送する
+                self.dead_letters.add(failed_chunks, namespace)
+                print(f"\nアップロードできなかったチャンク: {len(failed_chunks)}件（デッドレターに記録しました）")
+                for chunk, reason in failed_chunks:
+                    print(f"  {chunk.get('id', '(IDなし)')}: {reason}")
+            
+            stats.print_report()
+            print(f"  upsertのリクエスト上限: {self.upsert_batcher.report()}")
+            print(f"\nアップロード完了（成功 {total_chunks - len(failed_chunks)}件, 失敗 {len(failed_chunks)}件）")
+            return {
+                "total_chunks": total_chunks,
+                "succeeded_chunks": total_chunks - len(failed_chunks),
+                "embedded_tokens": total_tokens,
+                "failed_chunks": len(failed_chunks),
+                "failed_ids": [chunk.get("id") for chunk, _ in failed_chunks],
+                "failures": [{"id": chunk.get("id"), "reason": reason} for chunk, reason in failed_chunks],
+                **stats.report()
+            }
             
         except Exception as e:
             raise Exception(f"チャンクのアップロードに失敗しました: {str(e)}")
 
-    def query(self, query_text: str, namespace: str = None, top_k: int = DEFAULT_TOP_K, similarity_threshold: float = SIMILARITY_THRESHOLD) -> Dict[str, Any]:
-        """クエリに基づいて類似チャンクを検索"""
+    def sync_file(self, filename: str, chunks: Iterable[Dict[str, Any]], namespace: str = None,
+                  id_prefix: str = None, batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+        """ファイルのチャンクを差分アップロード
+        
+        前回アップロード時のチャンクID・内容のハッシュ（マニフェスト）と比較し、
+        新規・変更されたチャンクだけを埋め込んでアップロードし、今回のチャンクに
+        含まれなくなったIDはインデックスから削除する。マニフェストに記録がない
+        ファイルは id_prefix で既存のIDを列挙して削除対象を求める。
+        chunks はジェネレーターでもよく、読み出しながら変更の有無を判定する。
+        """
+        previous = self.manifest.get_file(filename, namespace)
+        if not previous and id_prefix:
+            for ids in self.index.list(prefix=id_prefix, limit=FETCH_BATCH_SIZE, namespace=namespace or ""):
+                previous.update({vector_id: None for vector_id in ids})
+        
+        current = {}
+        counts = {"total": 0, "changed": 0}
+        
+        def changed_chunks():
+            for chunk in chunks:
+                counts["total"] += 1
+                if chunk.get("id"):
+                    current[chunk["id"]] = chunk_hash(chunk)
+                    if previous.get(chunk["id"]) == current[chunk["id"]]:
+                        continue
+                counts["changed"] += 1
+                yield chunk
+        
+        result = self.upload_chunks(changed_chunks(), namespace=namespace, batch_size=batch_size)
+        orphan_ids = [vector_id for vector_id in previous if vector_id not in current]
+        print(
+            f"{filename}: 新規・変更 {counts['changed']}件, 変更なし {counts['total'] - counts['changed']}件, "
+            f"削除 {len(orphan_ids)}件"
+        )
+        self.delete_vectors(orphan_ids, namespace=namespace)
+        
+        # 失敗したチャンクは前回の記録を残し、次回のアップロードで再試行する
+        failed_ids = set(result["failed_ids"])
+        hashes = {vector_id: content_hash for vector_id, content_hash in current.items() if vector_id not in failed_ids}
+        hashes.update({
+            vector_id: previous[vector_id]
+            for vector_id in failed_ids
+            if previous.get(vector_id) is not None
+        })
+        self.manifest.replace_file(filename, hashes, namespace)
+        
+        return {
+            **result,
+            "changed_chunks": counts["changed"],
+            "unchanged_chunks": counts["total"] - counts["changed"],
+            "deleted_chunks": len(orphan_ids)
+        }
+
+    def replay_dead_letters(self, limit: int = DEAD_LETTER_REPLAY_LIMIT,
+                            max_attempts: int = DEAD_LETTER_MAX_ATTEMPTS) -> Dict[str, Any]:
+        """デッドレターのチャンクを再送
+        
+        試行回数が上限未満のチャンクを古い順に limit 件まで namespace ごとに
+        アップロードする。成功したチャンクは記録から消え、再び失敗したチャンクは
+        試行回数が増える。差分アップロードしたファイルのチャンクはマニフェストも更新する。
+        """
+        entries = self.dead_letters.pending(limit, max_attempts)
+        chunks_by_namespace = {}
+        for entry in entries:
+            chunks_by_namespace.setdefault(entry["namespace"], []).append(entry["chunk"])
+        
+        succeeded = 0
+        failed = 0
+        for namespace, chunks in chunks_by_namespace.items():
+            print(f"\nデッドレターの再送: {len(chunks)}件（namespace: {namespace or 'default'}）")
+            result = self.upload_chunks(chunks, namespace=namespace or None)
+            succeeded += result["succeeded_chunks"]
+            failed += result["failed_chunks"]
+            
+            failed_ids = set(result["failed_ids"])
+            hashes_by_file = {}
+            for chunk in chunks:
+                if chunk.get("id") and chunk.get("filename") and chunk["id"] not in failed_ids:
+                    hashes_by_file.setdefault(chunk["filename"], {})[chunk["id"]] = chunk_hash(chunk)
+            for filename, hashes in hashes_by_file.items():
+                if self.manifest.get_file(filename, namespace):
+                    self.manifest.update_chunks(filename, hashes, namespace)
+        
+        summary = self.dead_letters.summary(max_attempts)
+        print(
+            f"\nデッドレターの再送完了: 成功 {succeeded}件, 失敗 {failed}件 / "
+            f"残り {summary['pending']}件, 試行回数の上限に達したもの {summary['exhausted']}件"
+        )
+        return {"replayed_chunks": len(entries), "succeeded_chunks": succeeded, "failed_chunks": failed, **summary}
+
+    def delete_vectors(self, ids: List[str], namespace: str = None) -> None:
+        """IDを指定してベクトルを削除"""
+        try:
+            for i in range(0, len(ids), DELETE_BATCH_SIZE):
+                self.index.delete(ids=ids[i:i + DELETE_BATCH_SIZE], namespace=namespace)
+            self.flush_index()
+            self.manifest.bump_generation()
+            # 削除したチャンクは再送しない
+            self.dead_letters.resolve(ids, namespace)
+            if self.text_store is not None:
+                self.text_store.delete(ids, namespace)
+            if self.sparse_encoder is not None:
+                # 削除したベクトルの語を文書頻度から差し引く
+                self.sparse_encoder.delete_documents(ids, namespace)
+            if namespace == PROPERTY_NAMESPACE:
+                # チャット画面の物件一覧に削除した物件が残らないようにする
+                get_property_catalog().invalidate()
+        except Exception as e:
+            raise Exception(f"ベクトルの削除に失敗しました: {str(e)}")
+
+    def flush_index(self) -> None:
+        """ローカルインデックスの変更をディスクに保存（Pineconeの場合は何もしない）"""
+        flush = getattr(self.index, "flush", None)
+        if flush is not None:
+            flush()
+
+    def index_generation(self) -> int:
+        """インデックスの世代番号（upsert・削除・クリアのたびに増える）"""
+        return self.manifest.generation()
+
+    def embed_query(self, query_text: str) -> List[float]:
+        """検索クエリの埋め込みベクトルを取得（正規化したクエリ文字列でプロセス内LRUキャッシュ）"""
+        key = (EMBEDDING_MODEL, normalize_text(query_text))
+        query_vector = _query_vector_cache.get(key)
+        if query_vector is None:
+            query_vector = self.get_embedding(query_text)
+            _query_vector_cache.set(key, query_vector)
+        return query_vector
+
+    def search(self, query_text: str, namespace: str = None, top_k: int = DEFAULT_TOP_K, filter: Dict[str, Any] = None, alpha: float = None) -> List[Any]:
+        """クエリを1回だけベクトル化し、ベクトルで類似チャンクを検索（全検索経路の共通入口）
+        
+        filter はメタデータフィルタとしてインデックス側で適用する。一致するものが
+        ない場合は空のリストを返す（フィルタを外して検索し直すことはしない）。
+        スパースベクトルが有効な場合は密ベクトルをalpha、BM25のスパースベクトルを
+        (1 - alpha) で重み付けしたハイブリッド検索を行う（省略時は HYBRID_ALPHA）。
+        """
         max_retries = 3
         retry_delay = 1
         
+        query_vector = self.embed_query(query_text)
+        sparse_vector = None
+        if self.sparse_encoder is not None:
+            alpha = HYBRID_ALPHA if alpha is None else alpha
+            if alpha < 1:
+                sparse = self.sparse_encoder.encode_query(query_text)
+                if sparse["indices"]:
+                    query_vector, sparse_vector = scale_hybrid_vectors(query_vector, sparse, alpha)
+        elif alpha is not None:
+            print("スパースベクトルが無効なため、密ベクトルのみで検索します")
+        
         for attempt in range(max_retries):
             try:
-                # より多くの候補を取得
-                query_vector = self.get_embedding(query_text)
-                print(f"検索クエリ: {query_text}")
-                print(f"類似度しきい値: {similarity_threshold}")
-                print(f"取得する候補数: {top_k * 2}")
-                
-                # より多くの候補を取得（フィルタリング用）
                 results = self.index.query(
                     vector=query_vector,
-                    top_k=top_k * 2,  # フィルタリング用に2倍取得
+                    top_k=top_k,
                     include_metadata=True,
-                    namespace=namespace  # namespaceを指定
+                    namespace=namespace,  # namespaceを指定
+                    filter=filter,
+                    sparse_vector=sparse_vector
                 )
-                
-                print(f"取得した候補数: {len(results.matches)}")
-                if results.matches:
-                    print("候補のスコア:")
-                    for match in results.matches:
-                        print(f"スコア: {match.score:.3f}")
-                
-                # 類似度でフィルタリング
-                filtered_matches = [
-                    match for match in results.matches
-                    if match.score >= similarity_threshold
-                ]
-                
-                print(f"フィルタリング後の候補数: {len(filtered_matches)}")
-                
-                # 上位K件に制限
-                filtered_matches = filtered_matches[:top_k]
-                
-                print(f"最終的な検索結果数: {len(filtered_matches)}")
-                for match in filtered_matches:
-                    print(f"スコア: {match.score:.3f}, テキスト: {match.metadata['text'][:100]}...")
-                
-                return {
-                    "matches": filtered_matches,
-                    "total_matches": len(results.matches),
-                    "filtered_matches": len(filtered_matches)
-                }
-                
+                if filter and not results.matches:
+                    print(f"フィルタ {json.dumps(filter, ensure_ascii=False)} に一致する結果がありません")
+                return self.hydrate_metadata(results.matches, namespace)
             except Exception as e:
                 if attempt < max_retries - 1:
                     print(f"検索クエリの実行に失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
@@ -254,6 +733,46 @@ class PineconeService:
                 else:
                     raise Exception(f"検索クエリの実行に失敗しました（最大試行回数到達）: {str(e)}")
 
+    def query(self, query_text: str, namespace: str = None, top_k: int = DEFAULT_TOP_K, similarity_threshold: float = SIMILARITY_THRESHOLD, filter: Dict[str, Any] = None, alpha: float = None) -> Dict[str, Any]:
+        """クエリに基づいて類似チャンクを検索（alphaでハイブリッド検索の密ベクトルの重みを指定）"""
+        print(f"検索クエリ: {query_text}")
+        print(f"類似度しきい値: {similarity_threshold}")
+        print(f"取得する候補数: {top_k * 2}")
+        if filter:
+            print(f"メタデータフィルタ: {json.dumps(filter, ensure_ascii=False)}")
+        if self.sparse_encoder is not None:
+            print(f"ハイブリッド検索の密ベクトルの重み: {HYBRID_ALPHA if alpha is None else alpha}")
+        
+        # より多くの候補を取得（フィルタリング用に2倍取得）
+        matches = self.search(query_text, namespace=namespace, top_k=top_k * 2, filter=filter, alpha=alpha)
+        
+        print(f"取得した候補数: {len(matches)}")
+        if matches:
+            print("候補のスコア:")
+            for match in matches:
+                print(f"スコア: {match.score:.3f}")
+        
+        # 類似度でフィルタリング
+        filtered_matches = [
+            match for match in matches
+            if match.score >= similarity_threshold
+        ]
+        
+        print(f"フィルタリング後の候補数: {len(filtered_matches)}")
+        
+        # 上位K件に制限
+        filtered_matches = filtered_matches[:top_k]
+        
+        print(f"最終的な検索結果数: {len(filtered_matches)}")
+        for match in filtered_matches:
+            print(f"スコア: {match.score:.3f}, テキスト: {match.metadata['text'][:100]}...")
+        
+        return {
+            "matches": filtered_matches,
+            "total_matches": len(matches),
+            "filtered_matches": len(filtered_matches)
+        }
+
     def get_index_stats(self, namespace: str = None) -> Dict[str, Any]:
         """インデックスの統計情報を取得"""
         max_retries = 3
@@ -264,7 +783,10 @@ class PineconeService:
                 stats = self.index.describe_index_stats(namespace=namespace)
                 return {
                     "total_vector_count": stats.total_vector_count,
-                    "namespaces": stats.namespaces
+                    "namespaces": {
+                        name: {"vector_count": summary.vector_count}
+                        for name, summary in (stats.namespaces or {}).items()
+                    }
                 }
             except Exception as e:
                 if attempt < max_retries - 1:
@@ -279,41 +801,56 @@ class PineconeService:
         """インデックスをクリア"""
         try:
             self.index.delete(delete_all=True, namespace=namespace)
+            self.flush_index()
+            self.manifest.clear(namespace)
+            self.manifest.bump_generation()
+            self.dead_letters.clear(namespace)
+            if self.text_store is not None:
+                self.text_store.clear(namespace)
+            if self.sparse_encoder is not None:
+                self.sparse_encoder.clear(namespace)
+            if namespace == PROPERTY_NAMESPACE:
+                get_property_catalog().invalidate()
             print(f"インデックスをクリアしました（namespace: {namespace if namespace else 'default'}）")
         except Exception as e:
             raise Exception(f"インデックスのクリアに失敗しました: {str(e)}")
 
-    def get_index_data(self) -> List[Dict]:
-        """インデックスのデータを取得"""
+    def iter_vectors(self, namespace: str = None, prefix: str = None, batch_size: int = FETCH_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+        """namespace内のベクトルを順に返す
+        
+        IDをページ単位で列挙し、メタデータはページごとにまとめて取得するため、
+        件数が多くても一度にすべてを読み込まない。ベクトルの値は含めない。
+        """
         try:
-            # デフォルトnamespaceのデータを取得
-            results = self.index.query(
-                vector=[0] * 1536,  # ダミーベクトル
-                top_k=1000,
-                include_metadata=True,
-                namespace=""
-            )
-            
-            data = []
-            for match in results.matches:
-                if 'metadata' in match:
-                    metadata = match['metadata']
-                    # 必要なメタデータを抽出
-                    item = {
-                        'filename': metadata.get('filename', ''),
-                        'chunk_id': metadata.get('chunk_id', ''),
-                        'main_category': metadata.get('main_category', ''),
-                        'sub_category': metadata.get('sub_category', ''),
-                        'city': metadata.get('city', ''),
-                        'created_date': metadata.get('created_date', ''),
-                        'upload_date': metadata.get('upload_date', ''),
-                        'source': metadata.get('source', '')
-                    }
-                    data.append(item)
-            
-            return data
+            for ids in self.index.list(prefix=prefix, limit=batch_size, namespace=namespace or ""):
+                if not ids:
+                    continue
+                result = self.index.fetch(ids=list(ids), namespace=namespace or "")
+                records = [
+                    {"id": vector_id, "metadata": dict(result.vectors[vector_id].metadata or {})}
+                    for vector_id in ids
+                    if result.vectors.get(vector_id) is not None
+                ]
+                yield from self.hydrate_metadata(records, namespace)
         except Exception as e:
-            raise Exception(f"インデックスデータの取得に失敗しました: {str(e)}")
+            raise Exception(f"ベクトルの取得に失敗しました: {str(e)}")
+
+    def get_index_data(self) -> Iterator[Dict[str, Any]]:
+        """インデックスのデータを取得"""
+        # デフォルトnamespaceのデータを順に取得
+        for record in self.iter_vectors(namespace=""):
+            metadata = record["metadata"]
+            # 必要なメタデータを抽出
+            yield {
+                'filename': metadata.get('filename', ''),
+                'chunk_id': metadata.get('chunk_id', ''),
+                'main_category': metadata.get('main_category', ''),
+                'sub_category': metadata.get('sub_category', ''),
+                'city': metadata.get('city', ''),
+                'created_date': metadata.get('created_date', ''),
+                'upload_date': metadata.get('upload_date', ''),
+                'source': metadata.get('source', '')
+            }
 
     def get_stats(self, namespace: str = None) -> dict:
         """指定されたnamespaceの統計情報を取得"""
@@ -325,19 +862,9 @@ class PineconeService:
         except Exception as e:
             raise Exception(f"統計情報の取得に失敗しました: {str(e)}")
 
-    def list_vectors(self, namespace: str = None, limit: int = 1000) -> list:
-        """指定されたnamespaceのベクトルを取得"""
-        try:
-            # 空のクエリで全ベクトルを取得
-            results = self.index.query(
-                vector=[0] * 1536,  # ダミーベクトル（次元数はモデルに依存）
-                top_k=limit,
-                include_metadata=True,
-                namespace=namespace
-            )
-            return results.matches
-        except Exception as e:
-            raise Exception(f"ベクトルの取得に失敗しました: {str(e)}")
+    def list_vectors(self, namespace: str = None, limit: int = None) -> List[Dict[str, Any]]:
+        """指定されたnamespaceのベクトルを取得（limitを指定しない場合はすべて）"""
+        return list(islice(self.iter_vectors(namespace=namespace), limit))
 
     def get_by_id(self, vector_id: str, namespace: str = None) -> Dict[str, Any]:
         """指定されたIDのベクトルを取得"""
@@ -352,11 +879,12 @@ class PineconeService:
             vector = result.vectors[vector_id]
             
             # 結果を整形
+            record = self.hydrate_metadata([{"id": vector.id, "metadata": dict(vector.metadata or {})}], namespace)[0]
             return {
                 "id": vector.id,
                 "values": vector.values,
-                "metadata": vector.metadata,
-                "text": vector.metadata.get("text", "")
+                "metadata": record["metadata"],
+                "text": record["metadata"]["text"]
             }
         except Exception as e:
             print(f"ベクトルの取得中にエラーが発生しました: {str(e)}")
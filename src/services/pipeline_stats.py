@@ -0,0 +1,57 @@
+from typing import List, Dict, Any
+import threading
+import time
+
+class PipelineStats:
+    """取り込みパイプラインの段ごとの処理件数・処理時間・待ち時間を集計
+
+    busy は段が実際に処理していた時間、wait は前後の段を待っていた時間
+    （キューが空・満杯）。待ち時間の長い段の前後にボトルネックがある。
+    """
+
+    def __init__(self, stages: List[str]):
+        self.stages = stages
+        self._items = {stage: 0 for stage in stages}
+        self._busy = {stage: 0.0 for stage in stages}
+        self._wait = {stage: 0.0 for stage in stages}
+        self._started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, items: int, seconds: float) -> None:
+        """段の処理件数と処理時間を記録"""
+        with self._lock:
+            self._items[stage] += items
+            self._busy[stage] += seconds
+
+    def record_wait(self, stage: str, seconds: float) -> None:
+        """段が前後の段を待っていた時間を記録"""
+        with self._lock:
+            self._wait[stage] += seconds
+
+    def report(self) -> Dict[str, Any]:
+        """段ごとのスループットを集計"""
+        with self._lock:
+            elapsed = time.perf_counter() - self._started_at
+            stages = []
+            for stage in self.stages:
+                busy = self._busy[stage]
+                stages.append({
+                    "stage": stage,
+                    "items": self._items[stage],
+                    "busy_seconds": round(busy, 3),
+                    "wait_seconds": round(self._wait[stage], 3),
+                    "items_per_second": round(self._items[stage] / busy, 1) if busy > 0 else None
+                })
+            return {"elapsed_seconds": round(elapsed, 3), "stages": stages}
+
+    def print_report(self) -> None:
+        """段ごとのスループットを表示"""
+        report = self.report()
+        print(f"\n処理時間: {report['elapsed_seconds']}秒")
+        for stage in report["stages"]:
+            throughput = stage["items_per_second"]
+            print(
+                f"  {stage['stage']}: {stage['items']}件, 処理 {stage['busy_seconds']}秒, "
+                f"待ち {stage['wait_seconds']}秒, "
+                f"{throughput if throughput is not None else '-'}件/秒"
+            )
@@ -0,0 +1,84 @@
+from typing import List, Dict, Any, Optional
+import json
+import threading
+import time
+from ..config.settings import PROPERTY_CATALOG_TTL
+
+PROPERTY_NAMESPACE = "property"
+
+def parse_property(record: Dict[str, Any]) -> Dict[str, Any]:
+    """ベクトルのレコードから物件名・場所・テキストを取り出す"""
+    metadata = record.get("metadata", {})
+    text = metadata.get("text", "")
+
+    try:
+        # 物件情報登録画面から登録されたデータはJSON形式
+        data = json.loads(text)
+        name = data.get("property_name") or "不明"
+        location = f"{data.get('prefecture', '')}{data.get('city', '')}{data.get('detailed_address', '')}" or "不明"
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        # 物件名と場所を抽出（最初の2行を想定）
+        lines = text.split('\n')
+        name = lines[0].strip() if len(lines) > 0 else "不明"
+        location = lines[1].strip() if len(lines) > 1 else "不明"
+
+    return {
+        "id": record["id"],
+        "name": name,
+        "location": location,
+        "text": text,
+        "metadata": metadata
+    }
+
+class PropertyCatalog:
+    """物件一覧のプロセス内キャッシュ
+
+    一覧は最初のアクセス時に一度だけ読み込み、TTLが切れたら再読み込みする。
+    物件情報がアップロード・削除されたときは invalidate() で即座に破棄する。
+    """
+
+    def __init__(self, ttl: float = PROPERTY_CATALOG_TTL):
+        self.ttl = ttl
+        self._properties: Optional[List[Dict[str, Any]]] = None
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_stale(self) -> bool:
+        return self._properties is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    def get_properties(self, pinecone_service) -> List[Dict[str, Any]]:
+        """物件の一覧を取得"""
+        with self._lock:
+            if self._is_stale():
+                properties = [
+                    parse_property(record)
+                    for record in pinecone_service.iter_vectors(namespace=PROPERTY_NAMESPACE)
+                ]
+                self._properties = properties
+                self._by_id = {prop["id"]: prop for prop in properties}
+                self._loaded_at = time.monotonic()
+            return self._properties
+
+    def get_property(self, property_id: str, pinecone_service) -> Optional[Dict[str, Any]]:
+        """IDを指定して物件を取得"""
+        self.get_properties(pinecone_service)
+        with self._lock:
+            return self._by_id.get(property_id)
+
+    def invalidate(self) -> None:
+        """キャッシュを破棄（次回アクセス時に再読み込み）"""
+        with self._lock:
+            self._properties = None
+            self._by_id = {}
+
+_property_catalog = None
+_property_catalog_lock = threading.Lock()
+
+def get_property_catalog() -> PropertyCatalog:
+    """プロセス内で共有する物件カタログを取得"""
+    global _property_catalog
+    with _property_catalog_lock:
+        if _property_catalog is None:
+            _property_catalog = PropertyCatalog()
+        return _property_catalog
@@ -1,9 +1,9 @@
 from typing import Literal, Optional
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from src.config.settings import OPENAI_API_KEY
+from src.services.llm_cache import create_chat_model
 
 class QuestionType(BaseModel):
     """質問タイプを表すモデル"""
@@ -24,10 +24,8 @@ class QuestionClassifier:
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY is not set in settings")
         
-        self.llm = ChatOpenAI(
-            model_name=model_name,
-            openai_api_key=OPENAI_API_KEY
-        )
+        # 質問タイプの判別は同じ入力に同じ結果を返すよう temperature 0 とする（応答キャッシュも既定で使われる）
+        self.llm = create_chat_model(model_name=model_name, temperature=0)
         self.parser = PydanticOutputParser(pydantic_object=QuestionType)
         
         # フォーマット指示を取得
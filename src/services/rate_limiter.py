@@ -0,0 +1,107 @@
+from typing import Optional
+import random
+import threading
+import time
+from ..config.settings import (
+    OPENAI_EMBEDDING_RPM,
+    OPENAI_EMBEDDING_TPM
+)
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """指数バックオフの待機時間をジッター付きで計算（full jitter）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """レート制限（HTTP 429）によるエラーかどうかを判定"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    return type(error).__name__ == "RateLimitError"
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """エラーレスポンスの Retry-After ヘッダーから待機秒数を取得"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """リクエスト数/分とトークン数/分の2つのトークンバケットによるレート制限
+
+    429エラーを受けると全スレッドを一時停止し、補充速度を半減させる。
+    成功が続くと補充速度を少しずつ元に戻す（AIMD方式）。
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._rate_factor = 1.0  # 429エラーに応じて下げる補充速度の係数
+        self._consecutive_rate_limits = 0
+        self._paused_until = 0.0
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        """経過時間に応じてバケットを補充"""
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_allowance = min(
+            float(self.requests_per_minute),
+            self._request_allowance + elapsed * self.requests_per_minute * self._rate_factor / 60
+        )
+        self._token_allowance = min(
+            float(self.tokens_per_minute),
+            self._token_allowance + elapsed * self.tokens_per_minute * self._rate_factor / 60
+        )
+
+    def acquire(self, tokens: int = 0) -> None:
+        """リクエスト1件と指定トークン数の枠が空くまで待機して確保"""
+        # バケット容量を超える要求は容量まで切り詰める（永久に待たないため）
+        tokens = min(tokens, self.tokens_per_minute)
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._request_allowance >= 1 and self._token_allowance >= tokens:
+                    self._request_allowance -= 1
+                    self._token_allowance -= tokens
+                    return
+                else:
+                    request_wait = max(0.0, 1 - self._request_allowance) * 60 / (self.requests_per_minute * self._rate_factor)
+                    token_wait = max(0.0, tokens - self._token_allowance) * 60 / (self.tokens_per_minute * self._rate_factor)
+                    wait = max(request_wait, token_wait)
+            time.sleep(min(max(wait, 0.01), 5.0))
+
+    def report_success(self) -> None:
+        """リクエスト成功を記録し、補充速度を少しずつ回復"""
+        with self._lock:
+            self._consecutive_rate_limits = 0
+            self._rate_factor = min(1.0, self._rate_factor * 1.05)
+
+    def report_rate_limit(self, retry_after: Optional[float] = None) -> float:
+        """429エラーを記録し、全スレッドの一時停止時間（秒）を返す"""
+        with self._lock:
+            self._consecutive_rate_limits += 1
+            self._rate_factor = max(0.1, self._rate_factor / 2)
+            delay = retry_after if retry_after is not None else backoff_delay(self._consecutive_rate_limits)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            return delay
+
+_openai_rate_limiter = None
+_openai_rate_limiter_lock = threading.Lock()
+
+def get_openai_rate_limiter() -> RateLimiter:
+    """プロセス内の全セッションで共有するOpenAI埋め込みAPI用のレートリミッターを取得"""
+    global _openai_rate_limiter
+    with _openai_rate_limiter_lock:
+        if _openai_rate_limiter is None:
+            _openai_rate_limiter = RateLimiter(OPENAI_EMBEDDING_RPM, OPENAI_EMBEDDING_TPM)
+        return _openai_rate_limiter
@@ -0,0 +1,246 @@
+from typing import List, Dict, Any, Iterable, Iterator
+from collections import Counter
+from contextlib import contextmanager
+import json
+import math
+import os
+import sqlite3
+import threading
+import unicodedata
+from ..utils.text_processing import get_tokenizer
+from ..config.settings import (
+    SPARSE_STATS_PATH,
+    SPARSE_VOCAB_PATH,
+    BM25_K1,
+    BM25_B
+)
+
+# 検索語として意味を持たない品詞
+_SKIP_PARTS_OF_SPEECH = ("記号", "助詞", "助動詞")
+
+class BM25SparseEncoder:
+    """Janomeで分かち書きした語のBM25重みによるスパースベクトルを作成
+
+    文書側は語の出現頻度を文書長で正規化したTF成分のみ、クエリ側はIDFを重みとする
+    （両者の内積がBM25スコアになる）。語彙（語→インデックス）と文書ごとの語はSQLiteに記録し、
+    文書頻度はベクトルIDごとに数える（同じIDの再アップロードは置き換え、削除した分は差し引く）。
+    語のインデックスはトランザクション内で割り当てるため、取り込みCLIとアプリのように
+    複数のプロセスから同じファイルを使っても、同じ語には同じインデックスが割り当てられる。
+    """
+
+    def __init__(self, path: str = SPARSE_STATS_PATH, k1: float = BM25_K1, b: float = BM25_B,
+                 legacy_path: str = SPARSE_VOCAB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = get_tokenizer()
+        self._lock = threading.Lock()
+
+        # トランザクションは明示的に開始する（他のプロセスの書き込み中は待つ）
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                term_index INTEGER NOT NULL UNIQUE,
+                doc_freq INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                namespace TEXT NOT NULL,
+                vector_id TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                term_indices TEXT NOT NULL,
+                PRIMARY KEY (namespace, vector_id)
+            )"""
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), doc_count INTEGER NOT NULL, total_length INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO totals (id, doc_count, total_length) VALUES (0, 0, 0)")
+        self._import_legacy_vocabulary(legacy_path)
+
+    def tokenize(self, text: str) -> List[str]:
+        """テキストを検索語に分割（記号・助詞・助動詞は除外）"""
+        text = unicodedata.normalize("NFKC", text).lower()
+        return [
+            token.surface
+            for token in self.tokenizer.tokenize(text)
+            if token.part_of_speech.split(",")[0] not in _SKIP_PARTS_OF_SPEECH and token.surface.strip()
+        ]
+
+    def encode_documents(self, texts: List[str], ids: List[str], namespace: str = None) -> List[Dict[str, List[Any]]]:
+        """文書のスパースベクトルを作成し、ベクトルIDごとの語の記録を更新"""
+        term_counts = [Counter(self.tokenize(text)) for text in texts]
+        # 同じIDが複数ある場合は最後のものを記録する
+        documents = dict(zip(ids, term_counts))
+
+        with self._lock, self._transaction():
+            self._remove_documents(list(documents), namespace)
+            vocabulary = self._assign_indices({term for counts in term_counts for term in counts})
+            rows = []
+            for vector_id, counts in documents.items():
+                rows.append((namespace or "", vector_id, sum(counts.values()), json.dumps(sorted(vocabulary[term] for term in counts))))
+            self._conn.executemany(
+                "INSERT INTO documents (namespace, vector_id, length, term_indices) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.executemany(
+                "UPDATE terms SET doc_freq = doc_freq + 1 WHERE term = ?",
+                [(term,) for counts in documents.values() for term in counts]
+            )
+            self._conn.execute(
+                "UPDATE totals SET doc_count = doc_count + ?, total_length = total_length + ? WHERE id = 0",
+                (len(rows), sum(row[2] for row in rows))
+            )
+            doc_count, total_length = self._totals()
+
+        average_length = total_length / doc_count if doc_count else 1.0
+        vectors = []
+        for counts in term_counts:
+            length = sum(counts.values())
+            norm = self.k1 * (1 - self.b + self.b * length / average_length)
+            indices = [vocabulary[term] for term in counts]
+            values = [tf * (self.k1 + 1) / (tf + norm) for tf in counts.values()]
+            vectors.append({"indices": indices, "values": values})
+        return vectors
+
+    def encode_query(self, text: str) -> Dict[str, List[Any]]:
+        """クエリのスパースベクトル（既知の語のIDF）を作成"""
+        terms = list(set(self.tokenize(text)))
+        with self._lock:
+            doc_count, _ = self._totals()
+            rows = self._select_terms(terms, "term_index, doc_freq")
+        weights = {
+            index: math.log((doc_count - df + 0.5) / (df + 0.5) + 1)
+            for index, df in rows
+        }
+        return {"indices": list(weights.keys()), "values": list(weights.values())}
+
+    def delete_documents(self, ids: List[str], namespace: str = None) -> None:
+        """削除したベクトルの語を文書頻度から差し引く"""
+        with self._lock, self._transaction():
+            self._remove_documents(ids, namespace)
+
+    def clear(self, namespace: str = None) -> None:
+        """namespace内の文書の記録をすべて削除（語のインデックスは既存のベクトルのため残す）"""
+        with self._lock, self._transaction():
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT vector_id FROM documents WHERE namespace = ?", (namespace or "",)
+            )]
+            self._remove_documents(ids, namespace)
+
+    def stats(self) -> Dict[str, Any]:
+        """語彙と文書の統計情報を取得"""
+        with self._lock:
+            doc_count, total_length = self._totals()
+            terms = self._conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+        return {
+            "documents": doc_count,
+            "terms": terms,
+            "average_length": round(total_length / doc_count, 2) if doc_count else 0.0
+        }
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """書き込みのトランザクション（開始時に書き込みロックを取得し、他のプロセスの書き込みと直列化する）"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _totals(self) -> tuple:
+        """(文書数, 語数の合計) を取得"""
+        return self._conn.execute("SELECT doc_count, total_length FROM totals WHERE id = 0").fetchone()
+
+    def _select_terms(self, terms: List[str], columns: str) -> List[tuple]:
+        """語の記録を取得（SQLiteのプレースホルダ数の上限を超えないように分割して検索）"""
+        rows = []
+        for i in range(0, len(terms), 500):
+            batch = terms[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(self._conn.execute(f"SELECT {columns} FROM terms WHERE term IN ({placeholders})", batch))
+        return rows
+
+    def _assign_indices(self, terms: Iterable[str]) -> Dict[str, int]:
+        """語のインデックスを取得（未登録の語には続きのインデックスを割り当てる）"""
+        terms = sorted(terms)
+        vocabulary = dict(self._select_terms(terms, "term, term_index"))
+        next_index = self._conn.execute("SELECT COALESCE(MAX(term_index) + 1, 0) FROM terms").fetchone()[0]
+        new_terms = [term for term in terms if term not in vocabulary]
+        for offset, term in enumerate(new_terms):
+            vocabulary[term] = next_index + offset
+        self._conn.executemany(
+            "INSERT INTO terms (term, term_index) VALUES (?, ?)",
+            [(term, vocabulary[term]) for term in new_terms]
+        )
+        return vocabulary
+
+    def _remove_documents(self, ids: List[str], namespace: str = None) -> None:
+        """記録済みの文書の語を文書頻度から差し引いて削除"""
+        removed = []
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            removed.extend(self._conn.execute(
+                f"SELECT vector_id, length, term_indices FROM documents WHERE namespace = ? AND vector_id IN ({placeholders})",
+                [namespace or ""] + batch
+            ).fetchall())
+        if not removed:
+            return
+        self._conn.executemany(
+            "UPDATE terms SET doc_freq = doc_freq - 1 WHERE term_index = ?",
+            [(index,) for _, _, term_indices in removed for index in json.loads(term_indices)]
+        )
+        self._conn.executemany(
+            "DELETE FROM documents WHERE namespace = ? AND vector_id = ?",
+            [(namespace or "", vector_id) for vector_id, _, _ in removed]
+        )
+        self._conn.execute(
+            "UPDATE totals SET doc_count = doc_count - ?, total_length = total_length - ? WHERE id = 0",
+            (len(removed), sum(length for _, length, _ in removed))
+        )
+
+    def _import_legacy_vocabulary(self, legacy_path: str) -> None:
+        """以前のJSON形式の語彙から語のインデックスを引き継ぐ（既存のベクトルのインデックスを保つ）
+        
+        JSONの文書頻度はベクトルIDごとの記録がないため引き継がない（再アップロードで数え直す）。
+        """
+        if not legacy_path or not os.path.exists(legacy_path):
+            return
+        with self._lock, self._transaction():
+            if self._conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0]:
+                return
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                vocabulary = json.load(f)["vocabulary"]
+            self._conn.executemany(
+                "INSERT INTO terms (term, term_index) VALUES (?, ?)",
+                list(vocabulary.items())
+            )
+        print(f"BM25の語彙を引き継ぎました: {len(vocabulary)}語（文書頻度はファイルを再アップロードすると数え直されます）")
+
+def scale_hybrid_vectors(dense: List[float], sparse: Dict[str, List[Any]], alpha: float) -> tuple:
+    """密ベクトルをalpha、スパースベクトルを(1 - alpha)で重み付け"""
+    if not 0 <= alpha <= 1:
+        raise ValueError("alphaは0から1の範囲で指定してください")
+    return (
+        [value * alpha for value in dense],
+        {"indices": sparse["indices"], "values": [value * (1 - alpha) for value in sparse["values"]]}
+    )
+
+_sparse_encoder = None
+_sparse_encoder_lock = threading.Lock()
+
+def get_sparse_encoder() -> BM25SparseEncoder:
+    """プロセス内で共有するBM25エンコーダーを取得"""
+    global _sparse_encoder
+    with _sparse_encoder_lock:
+        if _sparse_encoder is None:
+            _sparse_encoder = BM25SparseEncoder()
+        return _sparse_encoder
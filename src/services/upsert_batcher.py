@@ -0,0 +1,145 @@
+from typing import List, Dict, Any, Callable, Optional, Tuple
+import json
+import threading
+import time
+from ..config.settings import UPSERT_MAX_REQUEST_BYTES, UPSERT_MAX_VECTORS
+
+# リクエストサイズの上限超過を示すエラーメッセージ（PineconeのREST・gRPC）
+_SIZE_LIMIT_MESSAGES = (
+    "exceeds the maximum",
+    "request size",
+    "too large",
+    "larger than max"
+)
+
+def is_size_limit_error(error: Exception) -> bool:
+    """リクエストサイズの上限超過によるエラーかどうかを判定"""
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if status == 413:
+        return True
+    message = str(error).lower()
+    return any(text in message for text in _SIZE_LIMIT_MESSAGES)
+
+def vector_size(vector: Dict[str, Any]) -> int:
+    """ベクトル1件をJSONにした際のバイト数"""
+    return len(json.dumps(vector, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+class AdaptiveUpsertBatcher:
+    """ベクトルをリクエストのバイト数と件数の上限に収まるように分けてアップロード
+
+    上限超過のエラーになったリクエストは半分に分けて再試行し、成功した最大の
+    バイト数と失敗した最小のバイト数の間で上限を二分探索的に絞り込む。
+    学習した上限はインスタンス（サービス）の間、以降のアップロードでも使う。
+    """
+
+    def __init__(self, max_bytes: int = UPSERT_MAX_REQUEST_BYTES, max_vectors: int = UPSERT_MAX_VECTORS):
+        self.configured_bytes = max_bytes
+        self.max_bytes = max_bytes
+        self.max_vectors = max_vectors
+        # 成功した最大のリクエストと、上限超過になった最小のリクエストのバイト数
+        self.largest_ok_bytes = 0
+        self.largest_ok_vectors = 0
+        self.smallest_failed_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _learn(self) -> None:
+        """成功・失敗したバイト数から上限を更新"""
+        if self.smallest_failed_bytes is None:
+            self.max_bytes = self.configured_bytes
+        elif self.largest_ok_bytes >= self.smallest_failed_bytes:
+            # 失敗より大きいリクエストが成功した（上限が変わった）場合は失敗の記録を捨てる
+            self.smallest_failed_bytes = None
+            self.max_bytes = self.configured_bytes
+        else:
+            self.max_bytes = max((self.largest_ok_bytes + self.smallest_failed_bytes) // 2, self.largest_ok_bytes, 1)
+
+    def record_success(self, vectors: int, size: int) -> None:
+        with self._lock:
+            if size > self.largest_ok_bytes:
+                self.largest_ok_bytes = size
+                self._learn()
+            self.largest_ok_vectors = max(self.largest_ok_vectors, vectors)
+
+    def record_size_limit(self, size: int) -> None:
+        with self._lock:
+            if self.smallest_failed_bytes is None or size < self.smallest_failed_bytes:
+                self.smallest_failed_bytes = size
+                self._learn()
+
+    def split(self, vectors: List[Dict[str, Any]]) -> List[Tuple[List[Dict[str, Any]], int]]:
+        """ベクトルを上限に収まるリクエストに分割（各リクエストのバイト数付き）"""
+        with self._lock:
+            max_bytes = self.max_bytes
+            max_vectors = self.max_vectors
+
+        requests = []
+        current = []
+        current_bytes = 0
+        for vector in vectors:
+            size = vector_size(vector)
+            if current and (current_bytes + size > max_bytes or len(current) >= max_vectors):
+                requests.append((current, current_bytes))
+                current = []
+                current_bytes = 0
+            current.append(vector)
+            current_bytes += size
+        if current:
+            requests.append((current, current_bytes))
+        return requests
+
+    def upsert(self, upsert: Callable[[List[Dict[str, Any]]], None], vectors: List[Dict[str, Any]],
+               label: str = "", max_retries: int = 3) -> List[Tuple[str, str]]:
+        """ベクトルを分割してアップロードし、単独でも上限を超えたベクトルの (ID, エラー内容) を返す"""
+        failed = []
+        # 先頭のリクエストから処理するため逆順に積む
+        pending = self.split(vectors)[::-1]
+        while pending:
+            request, size = pending.pop()
+            retry_delay = 2
+            for attempt in range(max_retries):
+                try:
+                    print(f"  {len(request)}件のベクトルをアップロード中...（{size / 1024:.0f}KB）")
+                    upsert(request)
+                    self.record_success(len(request), size)
+                    break
+                except Exception as e:
+                    if is_size_limit_error(e):
+                        self.record_size_limit(size)
+                        if len(request) > 1:
+                            middle = len(request) // 2
+                            print(f"  リクエストサイズの上限を超えたため、{len(request)}件のベクトルを分割して再試行します")
+                            for part in (request[middle:], request[:middle]):
+                                pending.append((part, sum(vector_size(vector) for vector in part)))
+                        else:
+                            print(f"  ベクトル {request[0]['id']} はリクエストサイズの上限を超えています: {str(e)}")
+                            failed.append((request[0]["id"], str(e)))
+                        break
+                    if attempt < max_retries - 1:
+                        print(f"  {label}のアップロードに失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
+                        print(f"  {retry_delay}秒後に再試行します...")
+                        time.sleep(retry_delay)
+                        retry_delay *= 2
+                    else:
+                        raise Exception(f"{label}のアップロードに失敗しました（最大試行回数到達）: {str(e)}")
+        return failed
+
+    def report(self) -> Dict[str, Any]:
+        """学習した上限"""
+        with self._lock:
+            return {
+                "max_request_bytes": self.max_bytes,
+                "max_request_vectors": self.max_vectors,
+                "largest_ok_bytes": self.largest_ok_bytes,
+                "largest_ok_vectors": self.largest_ok_vectors
+            }
+
+_upsert_batcher = None
+_upsert_batcher_lock = threading.Lock()
+
+def get_upsert_batcher() -> AdaptiveUpsertBatcher:
+    """プロセス内で共有するupsertのバッチ分割器を取得（学習したリクエストサイズの上限を引き継ぐ）"""
+    global _upsert_batcher
+    with _upsert_batcher_lock:
+        if _upsert_batcher is None:
+            _upsert_batcher = AdaptiveUpsertBatcher()
+        return _upsert_batcher
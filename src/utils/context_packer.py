@@ -0,0 +1,100 @@
+from typing import List, Dict, Any, Tuple
+import hashlib
+import unicodedata
+from .token_counter import estimate_tokens
+from ..config.settings import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TOKENS_PER_CHUNK,
+    CONTEXT_SIMHASH_MAX_DISTANCE,
+    CONTEXT_METADATA_FIELDS
+)
+
+# SimHashのシングル（文字n-gram）の長さ。日本語は単語の区切りがないため文字単位とする
+_SHINGLE_SIZE = 3
+
+def build_context_header(metadata: Dict[str, Any]) -> str:
+    """参照文脈の見出し（回答に役立つメタデータのみ）を作成"""
+    fields = [
+        f"{label}: {metadata[key]}"
+        for key, label in CONTEXT_METADATA_FIELDS
+        if metadata.get(key) not in (None, "")
+    ]
+    return f"[{' / '.join(fields)}]" if fields else ""
+
+def simhash(text: str) -> int:
+    """文字n-gramの64ビットSimHash（表記揺れを吸収するためNFKC正規化し空白を除く）"""
+    text = "".join(unicodedata.normalize("NFKC", text).split())
+    if len(text) <= _SHINGLE_SIZE:
+        shingles = [text]
+    else:
+        shingles = [text[i:i + _SHINGLE_SIZE] for i in range(len(text) - _SHINGLE_SIZE + 1)]
+
+    weights = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def pack_context(candidates: List[Dict[str, Any]], token_budget: int = None,
+                 max_chunks: int = None, max_distance: int = CONTEXT_SIMHASH_MAX_DISTANCE) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """検索結果をスコアの高い順にトークン数の上限まで詰める
+
+    candidates は {"text", "metadata", "score"} のリスト。既に選んだチャンクと
+    ほぼ同一（SimHashのハミング距離が max_distance 以下）のチャンクと、残りの
+    トークン数に収まらないチャンクは飛ばす。見出しと本文のトークン数はメタデータの
+    context_header・context_header_tokens・token_count（アップロード時に保存）を
+    使う。選んだチャンクには見出しを付けた
+    "content" と "tokens" を追加して返す。token_budget を省略した場合は
+    max_chunks 件のチャンクが収まる大きさ（max_chunks も省略した場合は
+    CONTEXT_TOKEN_BUDGET）とする。
+    """
+    if token_budget is None:
+        token_budget = max_chunks * CONTEXT_TOKENS_PER_CHUNK if max_chunks else CONTEXT_TOKEN_BUDGET
+    selected = []
+    fingerprints = []
+    duplicates = 0
+    over_budget = 0
+    used_tokens = 0
+
+    for candidate in sorted(candidates, key=lambda candidate: candidate["score"], reverse=True):
+        if max_chunks is not None and len(selected) >= max_chunks:
+            break
+        text = candidate["text"]
+        if not text:
+            continue
+
+        fingerprint = simhash(text)
+        if any(hamming_distance(fingerprint, other) <= max_distance for other in fingerprints):
+            duplicates += 1
+            continue
+
+        metadata = candidate["metadata"]
+        # 見出しとトークン数はアップロード時に保存したものを使い、ない場合（既存のデータ）はここで作成する
+        if "context_header" in metadata:
+            header = metadata["context_header"]
+            header_tokens = metadata.get("context_header_tokens") or estimate_tokens(header)
+        else:
+            header = build_context_header(metadata)
+            header_tokens = estimate_tokens(header) if header else 0
+        content = f"{header}\n{text}" if header else text
+        tokens = (metadata.get("token_count") or estimate_tokens(text)) + (header_tokens + 1 if header else 0)
+        if used_tokens + tokens > token_budget:
+            over_budget += 1
+            continue
+
+        fingerprints.append(fingerprint)
+        used_tokens += tokens
+        selected.append({**candidate, "content": content, "tokens": tokens})
+
+    stats = {
+        "トークン数": used_tokens,
+        "トークン上限": token_budget,
+        "採用数": len(selected),
+        "重複として除外": duplicates,
+        "上限超過で除外": over_budget
+    }
+    return selected, stats
@@ -0,0 +1,68 @@
+from typing import List, Dict, Any, Iterator, Optional, Set
+import hashlib
+import io
+import pandas as pd
+from .text_processing import detect_encoding
+from ..config.settings import ENCODING_SAMPLE_SIZE, CSV_READ_CHUNK_ROWS
+
+# 施設CSVの列（ヘッダー行なし）
+FACILITY_COLUMNS = ["大カテゴリ", "中カテゴリ", "施設名", "緯度", "経度", "徒歩距離", "徒歩分数", "直線距離"]
+
+def read_facility_csv(content: bytes, chunksize: Optional[int] = None, nrows: Optional[int] = None):
+    """施設CSVを先頭部分から判定したエンコーディングで読み込む
+
+    chunksize を指定した場合は chunksize 行ずつのDataFrameを返すイテレーターになる。
+    """
+    encoding = detect_encoding(content[:ENCODING_SAMPLE_SIZE])
+    return pd.read_csv(
+        io.BytesIO(content),
+        header=None,
+        names=FACILITY_COLUMNS,
+        encoding=encoding,
+        encoding_errors="replace",
+        chunksize=chunksize,
+        nrows=nrows
+    )
+
+def facility_ids(df: pd.DataFrame, filename: str) -> List[str]:
+    """ファイル名・施設名・カテゴリ・座標から決まる施設のID（再アップロード時は同じIDで上書きされる）
+
+    距離は物件ごとのCSVで異なるため、同じ施設でもファイルが違えば別のIDにする。
+    """
+    keys = (
+        filename + "\t" + df["facility_name"] + "\t" + df["main_category"] + "\t" + df["sub_category"] + "\t"
+        + df["latitude"].astype(str) + "\t" + df["longitude"].astype(str)
+    )
+    return ["facility_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] for key in keys]
+
+def facility_chunks(df: pd.DataFrame, filename: str) -> List[Dict[str, Any]]:
+    """施設CSVの各行をまとめてチャンクに変換（施設名のない行は除く）"""
+    df = df[df["施設名"].notna()]
+    # 列単位で型を揃え、数値にできない値は0とする
+    metadata = pd.DataFrame({
+        "main_category": df["大カテゴリ"].fillna("").astype(str),
+        "sub_category": df["中カテゴリ"].fillna("").astype(str),
+        "facility_name": df["施設名"].astype(str),
+        "latitude": pd.to_numeric(df["緯度"], errors="coerce").fillna(0.0).astype(float),
+        "longitude": pd.to_numeric(df["経度"], errors="coerce").fillna(0.0).astype(float),
+        "walking_distance": pd.to_numeric(df["徒歩距離"], errors="coerce").fillna(0).astype(int),
+        "walking_minutes": pd.to_numeric(df["徒歩分数"], errors="coerce").fillna(0).astype(int),
+        "straight_distance": pd.to_numeric(df["直線距離"], errors="coerce").fillna(0).astype(int)
+    })
+    texts = metadata["facility_name"] + "は" + metadata["main_category"] + "の" + metadata["sub_category"] + "です。"
+    return [
+        {"id": chunk_id, "text": text, "filename": filename, "metadata": row}
+        for chunk_id, text, row in zip(facility_ids(metadata, filename), texts, metadata.to_dict("records"))
+    ]
+
+def iter_facility_chunks(content: bytes, filename: str, chunksize: int = CSV_READ_CHUNK_ROWS) -> Iterator[Dict[str, Any]]:
+    """施設CSVを chunksize 行ずつ読み込んでチャンクを順に返す（同じ施設の重複行は最初の1件のみ）"""
+    seen: Set[str] = set()
+    for df in read_facility_csv(content, chunksize=chunksize):
+        for chunk in facility_chunks(df, filename):
+            if chunk["id"] in seen:
+                continue
+            seen.add(chunk["id"])
+            yield chunk
+    if not seen:
+        raise ValueError("有効なデータが1件も見つかりませんでした。")
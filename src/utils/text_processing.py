@@ -1,44 +1,249 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, BinaryIO, Optional, Tuple
 from janome.tokenizer import Tokenizer
-from ..config.settings import CHUNK_SIZE
+from .token_counter import get_token_counter
+from ..config.settings import (
+    CHUNK_MODE,
+    CHUNK_SIZE,
+    CHUNK_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    EMBEDDING_MAX_INPUT_TOKENS,
+    TEXT_READ_BLOCK_SIZE,
+    ENCODING_SAMPLE_SIZE
+)
+import codecs
+import re
+import threading
 import time
+import unicodedata
+
+SENTENCE_TERMINATORS = ['。', '！', '？', '!', '?']
+
+# 文末記号を前後の文字ごと切り出す（記号が連続する部分をまとめて取り出す）
+_TERMINATOR_RUN = re.compile(r"(?:[^\w\s]|[_\u3000〇])*[。！？!?](?:[^\w\s]|[_\u3000〇])*")
+_SENTENCE = re.compile(r"[^。！？!?]*[。！？!?]|[^。！？!?]+")
+# Janomeで隣接する記号とまとめられず、単独の記号として分割される全角記号
+_STANDALONE_SYMBOLS = set(
+    "。！？、「」『』（）【】…〜★※＜＞●◆→・ー　＿／：；＆＄＠＋＝｜〒々〆＊"
+    "○◎■□▲△▼▽◇“”‘’〔〕［］｛｝〈〉《》"
+)
+# 漢数字（数字と同様に、隣接する記号とまとめて1語になることがある）
+_NUMERIC_CHARS = set("〇一二三四五六七八九十百千万億兆")
+_CLOSING_BRACKETS = set("）」』】〕］｝〉》”’")
+
+# Janomeが一度に解析する区間の最大文字数と、句読点・空行で区間を区切り始める文字数
+_PARTIAL_MAX_CHARS = Tokenizer.MAX_CHUNK_SIZE
+_PARTIAL_SPLIT_CHARS = Tokenizer.CHUNK_SIZE
+# Janomeが区間を区切る候補（句読点・空行の直後）
+_PARTIAL_SPLIT = re.compile(r"(?<=[、。,.？?！!])|(?<=\n\n)|(?<=\r\n\r\n)")
+_NON_SPACE = re.compile(r"\S")
+
+# 文末記号が現れないまま読み進める最大文字数
+MAX_PENDING_CHARS = 1 << 20
+
+# BOMとエンコーディングの対応（UTF-16は BOM から byte order を判定させる）
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16")
+]
+# BOMがない場合に試すエンコーディング（日本語のテキストで一般的なもの）
+_CANDIDATE_ENCODINGS = ['utf-8', 'shift-jis', 'cp932', 'euc-jp']
+# 誤ったエンコーディングで読んだときに現れやすい文字（半角カナ・外字）
+_UNLIKELY_CHARS = re.compile(r"[\uff61-\uff9f\ue000-\uf8ff]")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+def get_tokenizer() -> Tokenizer:
+    """プロセス内で共有するJanomeのトークナイザーを取得（辞書の読み込みは1回だけ）"""
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            _tokenizer = Tokenizer()
+        return _tokenizer
+
+def _is_standalone_terminator_run(text: str, run: re.Match) -> bool:
+    """文末記号を含む記号の並び（text 内の run）が、Janomeでも記号ごとに分割されるか判定
+    
+    条件はJanomeとの差分テスト（tests/test_text_processing.py）で確かめたもので、
+    当てはまらない並びを含む区間はJanomeで分割する。
+    """
+    symbols = run.group()
+    # 半角の「!」「?」は前後に記号がない場合のみ単独の記号になる
+    if not (all(char in _STANDALONE_SYMBOLS for char in symbols) or symbols in ("!", "?")):
+        return False
+    # 区間の先頭や空白の直後の記号は、後続の文字とまとめられることがある
+    if run.start() == 0 or text[run.start() - 1].isspace():
+        return False
+    before = text[run.start() - 1]
+    after = text[run.end()] if run.end() < len(text) else ""
+    # 数字・漢数字の前後では、数字と記号がまとめて1語になることがある
+    if before.isdigit() or before in _NUMERIC_CHARS or after.isdigit() or after in _NUMERIC_CHARS:
+        return False
+    # 英字の直後の記号の連続は、英字とまとめて未知語になることがある
+    if len(symbols) > 1 and unicodedata.normalize("NFKC", before).isascii():
+        return False
+    # 文末記号が3つ以上続く並びと、閉じ括弧を挟んで文末記号が続く並びはまとめられることがある
+    terminators = sum(char in SENTENCE_TERMINATORS for char in symbols)
+    return terminators <= 2 and (terminators == 1 or not any(char in _CLOSING_BRACKETS for char in symbols))
+
+def _is_fast_path_safe(text: str) -> bool:
+    """text のすべての文末記号の並びが、正規表現で分割してもJanomeと同じ結果になるか判定"""
+    return all(_is_standalone_terminator_run(text, run) for run in _TERMINATOR_RUN.finditer(text))
+
+def _partial_end(text: str) -> Optional[int]:
+    """Janomeが text の先頭から1回で解析する区間の長さ（確実に決められない場合はNone）
+    
+    Janomeは500文字を超えると、解析位置が句読点か空行の直後になったところで区間を区切る。
+    文字・数字の直後の全角の句読点は必ず解析位置になるため、最初の区切り候補がそれなら
+    そこで区切られる。それ以外の候補は解析位置にならないことがあるため判定しない。
+    """
+    limit = min(len(text), _PARTIAL_MAX_CHARS)
+    candidate = _PARTIAL_SPLIT.search(text, _PARTIAL_SPLIT_CHARS, limit)
+    if candidate is None or candidate.start() >= limit:
+        return limit
+    end = candidate.start()
+    return end if text[end - 1] in "、。！？" and text[end - 2].isalnum() else None
+
+def _split_partial_fast(text: str) -> Optional[Tuple[List[str], str, int]]:
+    """Janomeが1回で解析する区間を正規表現で文単位に分割（判定できない場合はNone）
+    
+    (文末記号で終わる文, 区間の末尾に残る文の途中, 区間の長さ) を返す。
+    """
+    end = _partial_end(text)
+    if end is None or not _is_fast_path_safe(text[:end]):
+        return None
+    sentences = _SENTENCE.findall(text[:end])
+    tail = sentences.pop() if sentences[-1][-1] not in SENTENCE_TERMINATORS else ""
+    return sentences, tail, end
+
+def _tokenize_partial(tokenizer: Tokenizer, text: str) -> Tuple[list, int]:
+    """Janomeで text の先頭の1区間だけを解析し、(形態素のリスト, 区間の長さ) を返す
+    
+    Tokenizer.tokenize が内部で区間ごとに呼び出す処理（janome 0.5.0 に固定している）。
+    """
+    return tokenizer._Tokenizer__tokenize_partial(text, False, True, "")
+
+def split_sentences_fast(text: str) -> List[str]:
+    """正規表現で文単位に分割（Janomeと同じ結果になる場合のみ。判定できない場合はNone）"""
+    text = text.strip()
+    sentences = []
+    current = ""
+    start = 0
+    while start < len(text):
+        result = _split_partial_fast(text[start:start + _PARTIAL_MAX_CHARS])
+        if result is None:
+            return None
+        partial_sentences, tail, end = result
+        if partial_sentences:
+            partial_sentences[0] = current + partial_sentences[0]
+            current = ""
+        sentences.extend(partial_sentences)
+        current += tail
+        start += end
+    return sentences + [current] if current else sentences
 
 class JapaneseTextProcessor:
     def __init__(self):
-        self.tokenizer = Tokenizer()
+        self.tokenizer = get_tokenizer()
 
-    def split_into_sentences(self, text: str) -> List[str]:
-        """テキストを文単位に分割"""
+    def _split_partial(self, text: str) -> Tuple[List[str], str, int]:
+        """Janomeが1回で解析する区間を文単位に分割
+        
+        (文末記号で終わる文, 区間の末尾に残る文の途中, 区間の長さ) を返す。区間の終わりが決まり、
+        文末記号がJanomeでも単独の記号になる並びだけなら正規表現で分割し、それ以外は
+        Janomeで区間を解析する。
+        """
+        result = _split_partial_fast(text)
+        if result is not None:
+            return result
+        
+        tokens, end = _tokenize_partial(self.tokenizer, text)
         sentences = []
         current_sentence = []
-        
-        for token in self.tokenizer.tokenize(text):
+        for token in tokens:
             current_sentence.append(token.surface)
-            if token.surface in ['。', '！', '？', '!', '?']:
+            if token.surface in SENTENCE_TERMINATORS:
                 sentences.append(''.join(current_sentence))
                 current_sentence = []
+        return sentences, ''.join(current_sentence), end
+
+    def _split_from(self, text: str, start: int, current: str) -> Tuple[List[str], str, int]:
+        """text の start から1区間を分割し、(確定した文, 続きの文, 次の区間の開始位置) を返す"""
+        sentences, tail, end = self._split_partial(text[start:start + _PARTIAL_MAX_CHARS])
+        if sentences:
+            # 前の区間から続く文は、この区間の最初の文につなげる
+            sentences[0] = current + sentences[0]
+            return sentences, tail, start + end
+        return sentences, current + tail, start + end
+
+    def iter_sentences(self, blocks: Iterable[str]) -> Iterator[str]:
+        """テキストを少しずつ受け取り、確定した文から順に返す
         
-        if current_sentence:
-            sentences.append(''.join(current_sentence))
+        Janomeがテキスト全体を解析するときと同じ区間ごとに分割するため、
+        受け取り方によらず split_into_sentences と同じ結果になる。
+        """
+        pending = ""
+        current = ""
+        started = False
         
-        return sentences
+        for block in blocks:
+            pending += block
+            if not started:
+                # 文書先頭の空白は除去する（Janomeと同じ結果にする）
+                pending = pending.lstrip()
+                if not pending:
+                    continue
+                started = True
+            
+            # 末尾の空白を除いても1区間分の文字が残っていれば、区間の終わりが決まる
+            start = 0
+            while _NON_SPACE.search(pending, start + _PARTIAL_MAX_CHARS - 1):
+                sentences, current, start = self._split_from(pending, start, current)
+                yield from sentences
+            pending = pending[start:]
+            if len(current) > MAX_PENDING_CHARS:
+                # 文末記号が長く現れない場合は、メモリを抑えるためそこで区切る
+                yield current
+                current = ""
+        
+        # 文書末尾の空白は除去する
+        pending = pending.rstrip()
+        start = 0
+        while start < len(pending):
+            sentences, current, start = self._split_from(pending, start, current)
+            yield from sentences
+        if current:
+            yield current
+
+    def split_into_sentences(self, text: str) -> List[str]:
+        """テキストを文単位に分割"""
+        return list(self.iter_sentences([text]))
 
     def is_sentence_boundary(self, text: str) -> bool:
         """文の区切りかどうかを判定"""
         if not text:
             return False
-        return text[-1] in ['。', '！', '？', '!', '?']
+        return text[-1] in SENTENCE_TERMINATORS
 
-    def process_text_file(self, file_content: str, filename: str, chunk_size: int = CHUNK_SIZE) -> List[Dict[str, Any]]:
-        """テキストファイルを文脈を考慮したチャンクに分割"""
-        chunks = []
+    def _make_chunk(self, filename: str, chunk_id: int, text: str) -> Dict[str, Any]:
+        """チャンクを作成（トークン数をメタデータに記録し、後段で数え直さずに済むようにする）"""
+        return {
+            "id": f"{filename}_chunk_{chunk_id}",  # ファイル名を含めたID
+            "text": text,
+            "metadata": {
+                "filename": filename,
+                "chunk_id": chunk_id,
+                "token_count": get_token_counter().count(text)
+            }
+        }
+
+    def iter_chunks(self, sentences: Iterable[str], filename: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+        """文を文脈を考慮したチャンクにまとめ、完成したチャンクから順に返す"""
         current_chunk = ""
         current_length = 0
         chunk_id = 0
         
-        # 文単位に分割
-        sentences = self.split_into_sentences(file_content)
-        
         for sentence in sentences:
             sentence_size = len(sentence)
             
@@ -49,31 +254,19 @@ class JapaneseTextProcessor:
             else:
                 # 現在のチャンクが空でない場合、新しいチャンクを作成
                 if current_chunk:
-                    chunks.append({
-                        "id": f"{filename}_chunk_{chunk_id}",  # ファイル名を含めたID
-                        "text": current_chunk.strip(),
-                        "metadata": {
-                            "filename": filename,
-                            "chunk_id": chunk_id
-                        }
-                    })
+                    yield self._make_chunk(filename, chunk_id, current_chunk.strip())
                     chunk_id += 1
                     current_chunk = ""
                     current_length = 0
                 
                 # 文がチャンクサイズを超える場合は、強制的に分割
                 if sentence_size > chunk_size:
-                    # 文を適切なサイズに分割
+                    # 文を適切なサイズに分割（断片ごとに別のIDとし、同じIDで上書きされないようにする。
+                    # 以前の同じIDで保存されたベクトルは差分アップロードで孤立IDとして削除される）
                     for i in range(0, len(sentence), chunk_size):
                         sub_chunk = sentence[i:i + chunk_size]
-                        chunks.append({
-                            "id": f"{filename}_chunk_{chunk_id}",  # ファイル名を含めたID
-                            "text": sub_chunk,
-                            "metadata": {
-                                "filename": filename,
-                                "chunk_id": chunk_id
-                            }
-                        })
+                        yield self._make_chunk(filename, chunk_id, sub_chunk)
+                        chunk_id += 1
                     current_chunk = ""
                     current_length = 0
                 else:
@@ -82,18 +275,145 @@ class JapaneseTextProcessor:
         
         # 最後のチャンクを追加
         if current_chunk:
-            chunks.append({
-                "id": f"{filename}_chunk_{chunk_id}",  # ファイル名を含めたID
-                "text": current_chunk.strip(),
-                "metadata": {
-                    "filename": filename,
-                    "chunk_id": chunk_id
-                }
-            })
+            yield self._make_chunk(filename, chunk_id, current_chunk.strip())
+
+    def _split_long_sentence(self, sentence: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+        """最大トークン数を超える文を形態素の境界で分割"""
+        counter = get_token_counter()
+        piece = ""
+        piece_tokens = 0
         
-        return chunks
+        for token in self.tokenizer.tokenize(sentence):
+            tokens = counter.count(token.surface)
+            if piece and piece_tokens + tokens > max_tokens:
+                yield piece, piece_tokens
+                piece = ""
+                piece_tokens = 0
+            
+            if tokens > max_tokens:
+                # 1つの形態素が上限を超える場合のみ文字数で分割（1文字はUTF-8で最大4バイト）
+                step = max(1, max_tokens // 4)
+                for i in range(0, len(token.surface), step):
+                    sub_piece = token.surface[i:i + step]
+                    yield sub_piece, counter.count(sub_piece)
+            else:
+                piece += token.surface
+                piece_tokens += tokens
+        
+        if piece:
+            yield piece, piece_tokens
+
+    def iter_token_chunks(self, sentences: Iterable[str], filename: str, max_tokens: int = CHUNK_TOKENS,
+                          overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict[str, Any]]:
+        """文を埋め込みモデルのトークン数で数えたチャンクにまとめる
+        
+        チャンクは文単位で組み立て、前のチャンクの末尾の文を overlap_tokens まで
+        次のチャンクの先頭に重ねる。上限を超える文は形態素の境界で分割するため、
+        どのチャンクも埋め込みモデルの入力上限に収まる。
+        """
+        counter = get_token_counter()
+        max_tokens = min(max_tokens, EMBEDDING_MAX_INPUT_TOKENS)
+        overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        
+        def units():
+            # 文（または分割した文の断片）とトークン数（連結時の改行の1トークンを含む）
+            for sentence in sentences:
+                tokens = counter.count(sentence) + 1
+                if tokens <= max_tokens:
+                    yield sentence, tokens
+                else:
+                    for piece, piece_tokens in self._split_long_sentence(sentence, max_tokens - 1):
+                        yield piece, piece_tokens + 1
+        
+        current: List[Tuple[str, int]] = []
+        current_tokens = 0
+        chunk_id = 0
+        
+        for unit, tokens in units():
+            if current and current_tokens + tokens > max_tokens:
+                text = "\n".join(text for text, _ in current).strip()
+                if text:
+                    yield self._make_chunk(filename, chunk_id, text)
+                    chunk_id += 1
+                
+                # 末尾の文を重なりとして次のチャンクに引き継ぐ（次の文が収まる範囲で）
+                overlap = []
+                overlap_total = 0
+                for previous, previous_tokens in reversed(current):
+                    if overlap_total + previous_tokens > overlap_tokens or overlap_total + previous_tokens + tokens > max_tokens:
+                        break
+                    overlap.insert(0, (previous, previous_tokens))
+                    overlap_total += previous_tokens
+                current = overlap
+                current_tokens = overlap_total
+            
+            current.append((unit, tokens))
+            current_tokens += tokens
+        
+        text = "\n".join(text for text, _ in current).strip()
+        if text:
+            yield self._make_chunk(filename, chunk_id, text)
+
+    def _chunk_sentences(self, sentences: Iterable[str], filename: str, chunk_size: int, mode: str) -> Iterator[Dict[str, Any]]:
+        """設定された単位（文字数またはトークン数）で文をチャンクにまとめる"""
+        if mode == "tokens":
+            return self.iter_token_chunks(sentences, filename)
+        return self.iter_chunks(sentences, filename, chunk_size)
+
+    def process_text_file(self, file_content: str, filename: str, chunk_size: int = CHUNK_SIZE, mode: str = CHUNK_MODE) -> List[Dict[str, Any]]:
+        """テキストファイルを文脈を考慮したチャンクに分割"""
+        return list(self._chunk_sentences(self.iter_sentences([file_content]), filename, chunk_size, mode))
+
+    def iter_file_chunks(self, stream: BinaryIO, filename: str, chunk_size: int = CHUNK_SIZE, mode: str = CHUNK_MODE) -> Iterator[Dict[str, Any]]:
+        """バイト列のストリームを少しずつデコードしながらチャンクに分割"""
+        return self._chunk_sentences(self.iter_sentences(iter_decoded_blocks(stream)), filename, chunk_size, mode)
+
+def detect_encoding(sample: bytes) -> str:
+    """BOMと先頭部分のバイト列からエンコーディングを判定"""
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    
+    decodable = []
+    for encoding in _CANDIDATE_ENCODINGS:
+        try:
+            # 末尾で途切れたマルチバイト文字はエラーにしない
+            text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+        except UnicodeDecodeError:
+            continue
+        if encoding == "utf-8":
+            return encoding
+        decodable.append((len(_UNLIKELY_CHARS.findall(text)), encoding))
+    
+    if decodable:
+        # EUC-JPのバイト列はShift_JISとしても読めてしまうため、半角カナや外字に
+        # 化ける文字が最も少ないものを選ぶ（同数の場合は候補の順）
+        return min(decodable, key=lambda item: item[0])[1]
+    
+    # いずれにも当てはまらない場合はUTF-8として読み、不正なバイトは置換する
+    return "utf-8"
+
+def iter_decoded_blocks(stream: BinaryIO, block_size: int = TEXT_READ_BLOCK_SIZE) -> Iterator[str]:
+    """バイト列のストリームを先頭部分で判定したエンコーディングで少しずつデコード"""
+    sample = stream.read(ENCODING_SAMPLE_SIZE)
+    decoder = codecs.getincrementaldecoder(detect_encoding(sample))(errors="replace")
+    
+    block = sample
+    while block:
+        text = decoder.decode(block)
+        if text:
+            yield text
+        block = stream.read(block_size)
+    
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
 
 # 後方互換性のための関数
-def process_text_file(file_content: str, filename: str, chunk_size: int = CHUNK_SIZE) -> List[Dict[str, Any]]:
+def process_text_file(file_content: str, filename: str, chunk_size: int = CHUNK_SIZE, mode: str = CHUNK_MODE) -> List[Dict[str, Any]]:
+    processor = JapaneseTextProcessor()
+    return processor.process_text_file(file_content, filename, chunk_size, mode)
+
+def iter_file_chunks(stream: BinaryIO, filename: str, chunk_size: int = CHUNK_SIZE, mode: str = CHUNK_MODE) -> Iterator[Dict[str, Any]]:
     processor = JapaneseTextProcessor()
-    return processor.process_text_file(file_content, filename, chunk_size)
\ No newline at end of file
+    return processor.iter_file_chunks(stream, filename, chunk_size, mode)
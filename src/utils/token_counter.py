@@ -0,0 +1,66 @@
+from typing import Optional
+import threading
+from ..config.settings import EMBEDDING_MODEL
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+class TokenCounter:
+    """埋め込みモデルのトークン数を数える
+
+    tiktoken が使える場合はモデルのエンコーディングで正確に数え、使えない場合は
+    UTF-8のバイト数（BPEのトークン数の上限）で見積もる。
+    """
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model = model
+        self.encoding = None
+        if tiktoken is None:
+            print("tiktokenがインストールされていないため、トークン数はバイト数で見積もります")
+            return
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            # 初回はエンコーディングのダウンロードが必要なため、オフラインでは失敗する
+            print(f"tiktokenのエンコーディングを読み込めませんでした（バイト数で見積もります）: {str(e)}")
+
+    @property
+    def is_exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        """テキストのトークン数"""
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(text.encode("utf-8"))
+
+    def estimate(self, text: str) -> int:
+        """テキストのトークン数の見積もり（プロンプトの配分用）
+        
+        バイト数は日本語では実際の2〜3倍になり配分には大きすぎるため、tiktokenが
+        使えない場合は文字数（日本語はおおむね1文字1トークン）で見積もる。
+        """
+        if self.encoding is not None:
+            return self.count(text)
+        return len(text)
+
+_token_counter: Optional[TokenCounter] = None
+_token_counter_lock = threading.Lock()
+
+def get_token_counter() -> TokenCounter:
+    """プロセス内で共有するトークンカウンターを取得"""
+    global _token_counter
+    with _token_counter_lock:
+        if _token_counter is None:
+            _token_counter = TokenCounter()
+        return _token_counter
+
+def count_tokens(text: str) -> int:
+    """埋め込みモデルのトークン数を数える"""
+    return get_token_counter().count(text)
+
+def estimate_tokens(text: str) -> int:
+    """トークン数を見積もる（プロンプトの配分用）"""
+    return get_token_counter().estimate(text)
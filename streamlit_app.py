@@ -1,7 +1,7 @@
 import streamlit as st
 import subprocess
 import threading
-from src.utils.text_processing import process_text_file
+from src.utils.text_processing import process_text_file, get_tokenizer
 from src.services.pinecone_service import PineconeService
 from src.components.file_upload import render_file_upload
 from src.components.chat import render_chat
@@ -20,6 +20,11 @@ if "system_prompt" not in st.session_state:
 if "response_template" not in st.session_state:
     st.session_state.response_template = DEFAULT_RESPONSE_TEMPLATE
 
+# Janomeの辞書をバックグラウンドで読み込んでおく（プロセス内で1回だけ）
+if "tokenizer_preloaded" not in st.session_state:
+    threading.Thread(target=get_tokenizer, daemon=True).start()
+    st.session_state.tokenizer_preloaded = True
+
 # Pineconeサービスの初期化
 try:
     pinecone_service = PineconeService()
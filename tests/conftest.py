@@ -0,0 +1,47 @@
+import os
+import sys
+
+# 設定モジュールはインポート時にAPIキーを読むため、テストではダミーの値を設定する
+for key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "PINECONE_INDEX_NAME", "PINECONE_ASSISTANT_NAME"):
+    os.environ.setdefault(key, "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from src.config.settings import EMBEDDING_DIMENSION
+from src.services import (
+    chunk_text_store,
+    dead_letter,
+    embedding_cache,
+    ingest_manifest,
+    local_vector_index,
+    pinecone_service,
+    sparse_encoder
+)
+
+def fake_embedding(text: str) -> list:
+    """テキストから決まる埋め込みベクトル（OpenAIを呼ばない）"""
+    seed = int.from_bytes(text.encode("utf-8")[:8].ljust(8, b"\0"), "little") ^ len(text)
+    return np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSION).astype(np.float32).tolist()
+
+@pytest.fixture
+def local_service(tmp_path, monkeypatch):
+    """ローカルインデックスを使うPineconeService（保存先は一時ディレクトリ、埋め込みはOpenAIを呼ばない）"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pinecone_service, "VECTOR_BACKEND", "local")
+    monkeypatch.setattr(pinecone_service, "LOCAL_INDEX_DIR", str(tmp_path / "index"))
+    # ファイルに保存する共有インスタンスは一時ディレクトリで作り直す
+    monkeypatch.setattr(local_vector_index, "_local_indexes", {})
+    for module, name in (
+        (ingest_manifest, "_ingest_manifest"),
+        (dead_letter, "_dead_letter_queue"),
+        (chunk_text_store, "_chunk_text_store"),
+        (embedding_cache, "_embedding_cache"),
+        (sparse_encoder, "_sparse_encoder")
+    ):
+        monkeypatch.setattr(module, name, None)
+    service = pinecone_service.PineconeService()
+    monkeypatch.setattr(service, "get_embeddings", lambda texts, max_retries=3: [fake_embedding(text) for text in texts])
+    monkeypatch.setattr(service, "get_embedding", fake_embedding)
+    return service
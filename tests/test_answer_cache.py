@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from src.services.answer_cache import SemanticAnswerCache
+from src.services.chat_history import ChatHistoryManager
+from src.services.langchain_service import LangChainService
+
+_VECTORS = {
+    "駅はどこですか": [1.0, 0.0, 0.0],
+    "駅はどこですか？": [0.99, 0.05, 0.0],
+    "詳しく教えて": [0.98, 0.1, 0.0]
+}
+
+@pytest.fixture
+def service():
+    """埋め込みと検索を差し替えたLangChainService（回答は呼び出し順に A1, A2, ...）"""
+    generation = SimpleNamespace(value=0)
+    pinecone_service = SimpleNamespace(
+        search=lambda query, top_k, filter: [SimpleNamespace(metadata={"text": "川越駅の近く"}, score=0.9)],
+        embed_query=lambda query: _VECTORS[query],
+        index_generation=lambda: generation.value
+    )
+    service = object.__new__(LangChainService)
+    service.llm = FakeListChatModel(responses=["A1", "A2", "A3", "A4"])
+    service.pinecone_service = pinecone_service
+    service.history = ChatHistoryManager(FakeListChatModel(responses=["要約"]))
+    service.answer_cache = SemanticAnswerCache(threshold=0.95)
+    service.system_prompt = "system"
+    service.response_template = "template"
+    service.generation = generation
+    return service
+
+def test_similar_first_question_is_answered_from_cache(service):
+    answer, details = service.get_response("駅はどこですか", property_id="p1", template_name="t")
+    assert answer == "A1" and details["回答キャッシュ"] == {"ヒット": False}
+
+    service.clear_memory()
+    tokens, details = service.stream_response("駅はどこですか？", property_id="p1", template_name="t")
+    assert list(tokens) == ["A1"]
+    assert details["回答キャッシュ"]["ヒット"] is True
+
+def test_follow_up_question_is_not_answered_from_cache(service):
+    service.get_response("駅はどこですか", property_id="p1", template_name="t")
+
+    # 会話の途中では、最初の質問とよく似ていてもキャッシュを使わない
+    answer, details = service.get_response("詳しく教えて", property_id="p1", template_name="t")
+
+    assert answer == "A2"
+    assert details["回答キャッシュ"] == {"ヒット": False}
+    assert service.answer_cache.stats()["件数"] == 1
+
+def test_index_change_or_other_property_misses(service):
+    service.get_response("駅はどこですか", property_id="p1", template_name="t")
+
+    service.clear_memory()
+    assert service.get_response("駅はどこですか", property_id="p2", template_name="t")[0] == "A2"
+
+    service.clear_memory()
+    service.generation.value += 1
+    assert service.get_response("駅はどこですか", property_id="p1", template_name="t")[0] == "A3"
+
+def test_other_prompt_filter_or_property_info_misses(service):
+    service.get_response("駅はどこですか", property_id="p1", template_name="t")
+
+    # 同じ物件・テンプレート名でも、実際に使うプロンプトや検索フィルタが違えば別の回答を生成する
+    for options in ({"system_prompt": "編集したプロンプト"}, {"filter": {"city": {"$eq": "川越市"}}}, {"property_info": "3LDK"}):
+        service.clear_memory()
+        answer, details = service.get_response("駅はどこですか", property_id="p1", template_name="t", **options)
+        assert details["回答キャッシュ"] == {"ヒット": False}, options
+
+    service.clear_memory()
+    answer, details = service.get_response("駅はどこですか", property_id="p1", template_name="t", system_prompt="system")
+    assert answer == "A1" and details["回答キャッシュ"]["ヒット"] is True
@@ -0,0 +1,76 @@
+import random
+import pytest
+from src.config.settings import CHUNK_SIZE, DEFAULT_TOP_K
+from src.utils.context_packer import pack_context
+from src.utils.token_counter import get_token_counter
+
+def _text(seed: int, length: int) -> str:
+    rng = random.Random(seed)
+    return "".join(rng.choice("あいうえおかきくけこさしすせそ川越市駅病院学校公園") for _ in range(length))
+
+def test_full_length_chunks_fit_the_default_budget():
+    candidates = [
+        {"text": _text(i, CHUNK_SIZE - 25), "metadata": {"city": "川越市", "main_category": "生活"}, "score": 0.9 - i * 0.01}
+        for i in range(DEFAULT_TOP_K * 2)
+    ]
+
+    selected, stats = pack_context(candidates, max_chunks=DEFAULT_TOP_K)
+
+    assert len(selected) == DEFAULT_TOP_K
+    assert stats["上限超過で除外"] == 0
+    assert selected[0]["content"].startswith("[市区町村: 川越市 / 大カテゴリ: 生活]\n")
+
+def test_near_duplicates_are_skipped():
+    text = _text(0, 300)
+    candidates = [
+        {"text": text, "metadata": {}, "score": 0.9},
+        {"text": text + "。", "metadata": {}, "score": 0.8},
+        {"text": _text(1, 300), "metadata": {}, "score": 0.7}
+    ]
+
+    selected, stats = pack_context(candidates, max_chunks=3)
+
+    assert [chunk["score"] for chunk in selected] == [0.9, 0.7]
+    assert stats["重複として除外"] == 1
+
+def test_stored_token_count_is_used_for_the_budget():
+    candidates = [
+        {"text": "短い本文", "metadata": {"token_count": 900}, "score": 0.9},
+        {"text": "別の短い本文", "metadata": {}, "score": 0.8}
+    ]
+
+    selected, stats = pack_context(candidates, token_budget=1000)
+
+    assert [chunk["tokens"] for chunk in selected] == [900, len("別の短い本文")]
+
+    selected, stats = pack_context(candidates, token_budget=500)
+    assert stats["上限超過で除外"] == 1
+
+def test_token_count_is_stored_at_upload(local_service):
+    text = "川越駅から徒歩5分の場所にあります。"
+    counter = get_token_counter()
+    local_service.upload_chunks([{"id": "doc.txt_chunk_0", "text": text, "metadata": {"token_count": counter.count(text)}}])
+
+    [match] = local_service.search("川越駅")
+
+    # tiktokenが使えない環境ではバイト数ではなく文字数で保存する
+    assert match.metadata["token_count"] == (counter.count(text) if counter.is_exact else len(text))
+
+def test_stored_context_header_is_used(monkeypatch):
+    from src.utils import context_packer
+    monkeypatch.setattr(context_packer, "build_context_header", lambda metadata: pytest.fail("見出しを作り直した"))
+    candidates = [{"text": "本文", "metadata": {"context_header": "[市区町村: 川越市]", "context_header_tokens": 7, "token_count": 2}, "score": 0.9}]
+
+    [chunk], _ = pack_context(candidates, max_chunks=1)
+
+    assert chunk["content"] == "[市区町村: 川越市]\n本文"
+    assert chunk["tokens"] == 7 + 1 + 2
+
+def test_context_header_is_stored_at_upload(local_service):
+    local_service.upload_chunks([{"id": "doc.txt_chunk_0", "text": "川越駅の近く", "metadata": {"city": "川越市", "main_category": "交通"}}])
+
+    [match] = local_service.search("川越駅")
+
+    assert match.metadata["context_header"] == "[市区町村: 川越市 / 大カテゴリ: 交通]"
+    # フィルタ用のキーではないため、インデックスのメタデータには含めない
+    assert "context_header" not in local_service.index.fetch(ids=["doc.txt_chunk_0"]).vectors["doc.txt_chunk_0"].metadata
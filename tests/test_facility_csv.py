@@ -0,0 +1,29 @@
+from src.utils.facility_csv import iter_facility_chunks
+
+def _csv(*rows: str) -> bytes:
+    return "\n".join(rows).encode("utf-8")
+
+# 同じ施設を、物件ごとに異なる距離で含む2つのCSV
+FILE_A = _csv("生活,スーパー,ライフ川越店,35.9,139.4,400,5,300", "教育,小学校,第一小学校,35.91,139.41,800,10,600")
+FILE_B = _csv("生活,スーパー,ライフ川越店,35.9,139.4,1200,15,900")
+
+def test_same_facility_in_two_files_gets_separate_ids():
+    [a_supermarket, _] = iter_facility_chunks(FILE_A, "a.csv")
+    [b_supermarket] = iter_facility_chunks(FILE_B, "b.csv")
+
+    assert a_supermarket["id"] != b_supermarket["id"]
+    assert [chunk["id"] for chunk in iter_facility_chunks(FILE_A, "a.csv")][0] == a_supermarket["id"]
+
+def test_syncing_one_file_keeps_the_other_files_facility(local_service):
+    local_service.sync_file("a.csv", iter_facility_chunks(FILE_A, "a.csv"))
+    local_service.sync_file("b.csv", iter_facility_chunks(FILE_B, "b.csv"))
+    [a_supermarket, _] = iter_facility_chunks(FILE_A, "a.csv")
+
+    # 後からアップロードしたファイルの距離で上書きされない
+    assert local_service.get_by_id(a_supermarket["id"])["metadata"]["walking_distance"] == 400
+    assert set(local_service.manifest.get_file("a.csv")) == {chunk["id"] for chunk in iter_facility_chunks(FILE_A, "a.csv")}
+
+    # b.csv から施設がなくなっても a.csv の施設は残る
+    local_service.sync_file("b.csv", iter_facility_chunks(_csv("教育,保育園,ひかり保育園,35.92,139.42,200,3,150"), "b.csv"))
+    assert local_service.get_by_id(a_supermarket["id"]) is not None
+    assert local_service.get_index_stats()["total_vector_count"] == 3
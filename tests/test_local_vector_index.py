@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from src.config.settings import EMBEDDING_DIMENSION
+from src.services.local_vector_index import LocalVectorIndex, get_local_vector_index
+from src.services.pinecone_service import PineconeService
+
+def _vector(seed: int) -> list:
+    return np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSION).astype(np.float32).tolist()
+
+def test_get_by_id_round_trip(local_service):
+    values = _vector(0)
+    local_service.index.upsert(vectors=[{"id": "doc_1", "values": values, "metadata": {"text": "駅の近く", "city": "川越市"}}])
+
+    result = local_service.get_by_id("doc_1")
+
+    assert result["id"] == "doc_1"
+    assert isinstance(result["values"], list)
+    np.testing.assert_allclose(result["values"], np.asarray(values) / np.linalg.norm(values), rtol=1e-5)
+    assert result["metadata"]["city"] == "川越市"
+    assert result["text"] == "駅の近く"
+
+def test_record_fields_do_not_shadow_dict_methods(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), EMBEDDING_DIMENSION)
+    index.upsert(vectors=[{"id": "a", "values": _vector(1), "metadata": {"text": "x"}}])
+
+    match = index.query(vector=_vector(1), top_k=1, include_values=True, include_metadata=True).matches[0]
+
+    assert isinstance(match.values, list) and len(match.values) == EMBEDDING_DIMENSION
+    assert match["metadata"] == match.metadata == {"text": "x"}
+
+def test_services_share_one_index_per_directory(local_service):
+    other = PineconeService()
+    assert other.index is local_service.index
+
+    local_service.index.upsert(vectors=[{"id": "a", "values": _vector(2)}])
+    other.index.upsert(vectors=[{"id": "b", "values": _vector(3)}])
+
+    assert local_service.get_index_stats()["total_vector_count"] == 2
+    assert get_local_vector_index(local_service.index.directory, EMBEDDING_DIMENSION) is other.index
+
+def test_changes_are_persisted_on_flush(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), EMBEDDING_DIMENSION)
+    index.upsert(vectors=[{"id": f"v{i}", "values": _vector(i), "metadata": {"n": i}} for i in range(5)])
+    index.delete(ids=["v0"])
+
+    assert LocalVectorIndex(str(tmp_path), EMBEDDING_DIMENSION).describe_index_stats().total_vector_count == 0
+
+    index.flush()
+    reloaded = LocalVectorIndex(str(tmp_path), EMBEDDING_DIMENSION)
+    assert reloaded.describe_index_stats().total_vector_count == 4
+    assert reloaded.fetch(ids=["v3"]).vectors["v3"].metadata == {"n": 3}
+
+def test_filtered_search_does_not_fall_back_to_other_cities(local_service):
+    local_service.index.upsert(vectors=[
+        {"id": "kawagoe", "values": _vector(4), "metadata": {"text": "川越駅の近く", "city": "川越市"}},
+        {"id": "legacy", "values": _vector(5), "metadata": {"text": "市区町村のない既存の行", "city": ""}}
+    ])
+
+    assert local_service.search("駅", filter={"city": {"$eq": "所沢市"}}) == []
+
+    # 市区町村が空の既存の行は明示的なフィルタでのみ含める
+    legacy_filter = {"$or": [{"city": {"$in": ["所沢市", ""]}}, {"city": {"$exists": False}}]}
+    assert [match.id for match in local_service.search("駅", filter=legacy_filter)] == ["legacy"]
+
+def test_index_metadata_keeps_only_filter_keys(local_service):
+    chunk = {
+        "id": "a.csv_0", "text": "ライフ川越店は生活のスーパーです。", "filename": "a.csv", "chunk_id": "a.csv_0",
+        "metadata": {"city": "川越市", "main_category": "生活", "sub_category": "スーパー", "facility_name": "ライフ川越店",
+                     "latitude": 35.9, "walking_minutes": 5, "upload_date": "2026-10-17"}
+    }
+    local_service.upload_chunks([chunk])
+
+    raw = local_service.index.fetch(ids=["a.csv_0"]).vectors["a.csv_0"].metadata
+    assert set(raw) == {"city", "main_category", "sub_category", "record_type", "facility_name"}
+
+    # 本文と表示用のメタデータは検索結果に補われる
+    [match] = local_service.search("スーパー", filter={"city": {"$eq": "川越市"}})
+    assert match.metadata["text"] == chunk["text"]
+    assert match.metadata["walking_minutes"] == 5 and match.metadata["filename"] == "a.csv"
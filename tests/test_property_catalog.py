@@ -0,0 +1,19 @@
+import json
+from src.services import property_catalog
+from src.services.property_catalog import PROPERTY_NAMESPACE, get_property_catalog
+
+def _property_chunk(property_id: str, name: str) -> dict:
+    data = {"property_name": name, "prefecture": "埼玉県", "city": "川越市", "detailed_address": "1-1"}
+    return {"id": property_id, "text": json.dumps(data, ensure_ascii=False), "metadata": data}
+
+def test_deleting_or_clearing_properties_refreshes_the_catalog(local_service, monkeypatch):
+    monkeypatch.setattr(property_catalog, "_property_catalog", None)
+    catalog = get_property_catalog()
+    local_service.upload_chunks([_property_chunk("p1", "川越ハイツ"), _property_chunk("p2", "本川越レジデンス")], namespace=PROPERTY_NAMESPACE)
+    assert {prop["id"] for prop in catalog.get_properties(local_service)} == {"p1", "p2"}
+
+    local_service.delete_vectors(["p1"], namespace=PROPERTY_NAMESPACE)
+    assert [prop["id"] for prop in catalog.get_properties(local_service)] == ["p2"]
+
+    local_service.clear_index(namespace=PROPERTY_NAMESPACE)
+    assert catalog.get_properties(local_service) == []
@@ -0,0 +1,61 @@
+import json
+import pytest
+from src.services.sparse_encoder import BM25SparseEncoder, get_sparse_encoder
+from src.utils.text_processing import JapaneseTextProcessor
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    """以前の語彙ファイル（bm25_vocab.json）などを作業ディレクトリから読み込まないようにする"""
+    monkeypatch.chdir(tmp_path)
+
+TEXTS = ["川越駅の近くにスーパーがあります。", "川越駅の保育園は定員150名です。"]
+
+def test_reuploading_the_same_ids_does_not_count_documents_twice(tmp_path):
+    encoder = BM25SparseEncoder(path=str(tmp_path / "bm25.sqlite3"))
+    first = encoder.encode_documents(TEXTS, ["a", "b"])
+    query = encoder.encode_query("川越駅の保育園")
+    assert encoder.encode_documents(TEXTS, ["a", "b"]) == first
+    assert encoder.encode_query("川越駅の保育園") == query
+    assert encoder.stats()["documents"] == 2
+
+def test_deleted_documents_are_subtracted(tmp_path):
+    encoder = BM25SparseEncoder(path=str(tmp_path / "bm25.sqlite3"))
+    encoder.encode_documents(TEXTS[:1], ["a"])
+    query = encoder.encode_query("川越")
+    encoder.encode_documents(TEXTS[1:], ["b"])
+    assert encoder.encode_query("川越") != query
+    encoder.delete_documents(["b"])
+    assert encoder.encode_query("川越") == query
+    assert encoder.stats()["documents"] == 1
+    encoder.clear()
+    assert encoder.stats()["documents"] == 0
+
+def test_processes_sharing_the_file_assign_the_same_indices(tmp_path):
+    # 取り込みCLIとアプリが同じファイルを使う場合を、別々のインスタンスで再現する
+    path = str(tmp_path / "bm25.sqlite3")
+    app, cli = BM25SparseEncoder(path=path), BM25SparseEncoder(path=path)
+    app_vector = app.encode_documents(TEXTS[:1], ["a"])[0]
+    cli_vector = cli.encode_documents(TEXTS[1:], ["b"])[0]
+    app_terms = dict(zip(dict.fromkeys(app.tokenize(TEXTS[0])), app_vector["indices"]))
+    cli_terms = dict(zip(dict.fromkeys(cli.tokenize(TEXTS[1])), cli_vector["indices"]))
+    assert app_terms["川越"] == cli_terms["川越"]
+    assert len(set(app_terms.values()) | set(cli_terms.values())) == len(set(app_terms) | set(cli_terms))
+    assert app.stats()["documents"] == cli.stats()["documents"] == 2
+    assert app.encode_query("保育園") == cli.encode_query("保育園")
+
+def test_legacy_vocabulary_keeps_its_indices(tmp_path):
+    legacy_path = tmp_path / "bm25_vocab.json"
+    legacy_path.write_text(json.dumps({"vocabulary": {"川越": 7, "駅": 3}, "doc_freq": {}, "doc_count": 0, "total_length": 0}), encoding="utf-8")
+    encoder = BM25SparseEncoder(path=str(tmp_path / "bm25.sqlite3"), legacy_path=str(legacy_path))
+    vector = encoder.encode_documents(["川越駅"], ["a"])[0]
+    assert dict(zip(dict.fromkeys(encoder.tokenize("川越駅")), vector["indices"])) == {"川越": 7, "駅": 3}
+
+def test_sync_and_clear_update_document_statistics(local_service):
+    local_service.sparse_encoder = get_sparse_encoder()
+    processor = JapaneseTextProcessor()
+    local_service.sync_file("guide.txt", processor.process_text_file("".join(TEXTS), "guide.txt", chunk_size=20))
+    assert local_service.sparse_encoder.stats()["documents"] == 2
+    local_service.sync_file("guide.txt", processor.process_text_file(TEXTS[0], "guide.txt", chunk_size=20))
+    assert local_service.sparse_encoder.stats()["documents"] == 1
+    local_service.clear_index()
+    assert local_service.sparse_encoder.stats()["documents"] == 0
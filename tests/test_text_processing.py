@@ -0,0 +1,134 @@
+import random
+import pytest
+from src.utils.text_processing import (
+    JapaneseTextProcessor, SENTENCE_TERMINATORS, _partial_end, _tokenize_partial, get_tokenizer, split_sentences_fast
+)
+
+# 文末記号・括弧・数字・英字を多めに含め、記号のまとまり方が変わる並びを作りやすくする
+_ALPHABET = (
+    list("あいかなの漢字町アイナカ一二十") + list("0123４５") + list("abAZ") + list("。！？!?") * 4
+    + list("）」』】(（「『【)、・…ー〜※,.") + [" ", "\n", "　"]
+)
+
+def janome_split(text: str) -> list:
+    """Janomeの形態素で文末記号ごとに区切る（正規表現の高速パス導入前の分割）"""
+    sentences = []
+    current = []
+    for token in get_tokenizer().tokenize(text):
+        current.append(token.surface)
+        if token.surface in SENTENCE_TERMINATORS:
+            sentences.append("".join(current))
+            current = []
+    if current:
+        sentences.append("".join(current))
+    return sentences
+
+# 施設案内の文書に現れやすい文・記号の並び
+_PIECES = [
+    "営業時間は9時から18時です。", "定休日なし！", "(祝日)", "！", "駐車場あり？", "Wi-Fi!", "最寄り駅は川越駅。",
+    "徒歩5分!?", "「はい。」", "と言った。", "※要予約", "…", "　", "\n", "\n\n", "１２３", "ABC",
+    "問い合わせ先:049-000-0000。", "！！", "？？", "（土日）", "営業中", "です", "。", "!", "?", "★",
+    "第2土曜日。", "約1.5km。", "、", "また、", "本日は晴天なり。"
+]
+
+def generated_texts(seed: int, count: int, max_length: int = 16, min_length: int = 1) -> list:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(_ALPHABET) for _ in range(rng.randint(min_length, max_length))) for _ in range(count)]
+
+def generated_documents(seed: int, count: int, max_pieces: int = 12, min_pieces: int = 1) -> list:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(_PIECES) for _ in range(rng.randint(min_pieces, max_pieces))) for _ in range(count)]
+
+def split_into_blocks(text: str, rng: random.Random) -> list:
+    """ストリーミングの読み込みを想定して、テキストをランダムな位置で区切る"""
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(1, 8)))) if len(text) > 1 else []
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+@pytest.mark.parametrize("text", [
+    "3？？！？）。", "2！？！？」あ", "！？！！？人", "今日は晴れ。明日は雨！", "「はい。」と言った？",
+    "なし！！(祝日)！営業中Wi-Fi!", "漢。あ？！！）？0ba"
+])
+def test_fast_path_matches_janome_on_known_cases(text):
+    sentences = split_sentences_fast(text)
+    assert sentences is None or sentences == janome_split(text.strip())
+    assert JapaneseTextProcessor().split_into_sentences(text) == janome_split(text)
+
+def test_fast_path_matches_janome_on_generated_text():
+    used = 0
+    for text in generated_texts(seed=13, count=5000):
+        sentences = split_sentences_fast(text)
+        if sentences is None:
+            continue
+        used += 1
+        assert sentences == janome_split(text.strip()), repr(text)
+    # 高速パスが一定数使われていること（条件を厳しくしすぎていないこと）
+    assert used > 500
+
+@pytest.mark.parametrize("text", ["。あ！!2!1", "。ナ？!漢?町", "今日は晴れ。明日は雨！「はい。」と言った？"])
+def test_streaming_matches_whole_text_on_known_cases(text):
+    processor = JapaneseTextProcessor()
+    whole = processor.split_into_sentences(text)
+    assert list(processor.iter_sentences(list(text))) == whole
+
+def test_streaming_matches_whole_text_on_generated_text():
+    processor = JapaneseTextProcessor()
+    rng = random.Random(14)
+    for text in generated_texts(seed=14, count=2000, max_length=40):
+        whole = processor.split_into_sentences(text)
+        blocks = split_into_blocks(text, rng)
+        assert list(processor.iter_sentences(blocks)) == whole, (text, blocks)
+
+def test_split_matches_whole_text_janome_on_generated_text():
+    # 区間ごとではなく、テキスト全体をJanomeで解析した結果と比べる
+    processor = JapaneseTextProcessor()
+    for text in generated_texts(seed=15, count=1500, max_length=40) + generated_documents(seed=16, count=1000):
+        assert processor.split_into_sentences(text) == janome_split(text), repr(text)
+
+def test_split_matches_whole_text_janome_on_long_text():
+    # Janomeが複数の区間に分けて解析する長さのテキストを、読み込み方を変えて比べる
+    processor = JapaneseTextProcessor()
+    rng = random.Random(17)
+    texts = generated_texts(seed=17, count=15, max_length=2500, min_length=600)
+    texts += generated_documents(seed=18, count=30, max_pieces=300, min_pieces=60)
+    for text in texts:
+        expected = janome_split(text)
+        assert processor.split_into_sentences(text) == expected, repr(text)
+        assert list(processor.iter_sentences(split_into_blocks(text, rng))) == expected, repr(text)
+        sentences = split_sentences_fast(text)
+        assert sentences is None or sentences == expected, repr(text)
+
+def test_predicted_partial_end_matches_janome():
+    tokenizer = get_tokenizer()
+    predicted = 0
+    for text in generated_documents(seed=19, count=150, max_pieces=300, min_pieces=60):
+        text = text.strip()
+        end = _partial_end(text)
+        if end is not None:
+            predicted += 1
+            assert end == _tokenize_partial(tokenizer, text)[1], repr(text)
+    # 施設案内のような文書では、区間の終わりを多くの場合で判定できること
+    assert predicted > 75
+
+def test_split_long_sentence_gets_one_id_per_piece():
+    text = "短い文。" + "あ" * 120 + "。次の文。"
+    chunks = JapaneseTextProcessor().process_text_file(text, "doc.txt", chunk_size=50, mode="chars")
+
+    ids = [chunk["id"] for chunk in chunks]
+    assert len(ids) == len(set(ids))
+    assert "".join(chunk["text"] for chunk in chunks).replace("\n", "") == text
+
+def test_resync_removes_vectors_stored_under_the_old_numbering(local_service):
+    text = "短い文。" + "あ" * 120 + "。次の文。"
+    # 以前の分割では長い文の断片がすべて同じIDになり、後続のチャンクもそのIDを使っていた
+    local_service.index.upsert(vectors=[
+        {"id": f"doc.txt_chunk_{i}", "values": local_service.get_embedding(str(i)), "metadata": {"text": str(i)}}
+        for i in (0, 1)
+    ])
+    local_service.index.upsert(vectors=[{"id": "doc.txt_chunk_9", "values": local_service.get_embedding("9"), "metadata": {"text": "9"}}])
+
+    chunks = JapaneseTextProcessor().process_text_file(text, "doc.txt", chunk_size=50, mode="chars")
+    result = local_service.sync_file("doc.txt", chunks, id_prefix="doc.txt_chunk_")
+
+    stored = {vector_id for ids in local_service.index.list(prefix="doc.txt_chunk_") for vector_id in ids}
+    assert stored == {chunk["id"] for chunk in chunks}
+    assert result["deleted_chunks"] == 1